@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import credentials
+from discord_bot import notifier
+from greeks import YEAR_SECONDS, chain_greeks
+from ib_simulator import FakeIB, SimMarket
+from new_broker import IBTWSAPI
+from strike_index import StrikeIndex
+
+# Latency paths measured, in report order
+PATHS = ("entry", "entry_protected", "trailing_tighten", "stop_out_detection", "move_to_cost", "re_entry",
+         "eod_close", "greeks_chain")
+
+
+class Harness:
+    """
+    One Strategy wired to a fresh FakeIB, with timestamps of what reaches the broker
+    """
+
+    def __init__(self, latency: float, seed: int):
+        from main import Strategy, creds
+
+        self.ib = FakeIB(SimMarket(seed=seed), latency=latency)
+        self.strategy = Strategy()
+        self.strategy.journal = None
+        self.strategy.broker = IBTWSAPI(creds=creds, ib_factory=lambda: self.ib)
+        self.tasks = []
+        self._waiters = []
+        self._running = asyncio.all_tasks()
+        self.ib.newOrderEvent += lambda trade: self._stamp("new", trade)
+        self.ib.orderModifyEvent += lambda trade: self._stamp("modify", trade)
+        self.ib.execDetailsEvent += lambda trade, fill: self._stamp("exec", trade)
+
+    async def start(self, call=True, put=False):
+        s = self.strategy
+        await s.broker.connect()
+        # The simulator's own grid; get_strike_index would cache it under the live session's date
+        s.strikes = StrikeIndex(self.ib.market.strikes)
+        atm = s.strikes.nearest(self.ib.market.spot)
+        for leg in s.legs:
+            leg.strike = s.strikes.step(atm, leg.offset)
+            if leg.hedge_offset is not None:
+                leg.hedge_strike = s.strikes.step(atm, leg.hedge_offset)
+        if put:
+            await s.place_leg_order(s.leg("put"))
+        if call:
+            await s.place_leg_order(s.leg("call"))
+
+    def run(self, *coros):
+        self.tasks += [asyncio.ensure_future(c) for c in coros]
+
+    def expect(self, kind, predicate):
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((kind, predicate, future))
+        return future
+
+    def _stamp(self, kind, trade):
+        now = time.perf_counter()
+        for waiter in list(self._waiters):
+            if waiter[0] == kind and waiter[1](trade) and not waiter[2].done():
+                waiter[2].set_result(now)
+                self._waiters.remove(waiter)
+
+    async def close(self):
+        self.strategy.should_continue = False
+        self.strategy._wake.set()
+        self.strategy.broker.disconnect()
+        # Everything the scenario started, including leg actions, stop workers and the simulated market
+        started = asyncio.all_tasks() - self._running - {asyncio.current_task()}
+        for task in started:
+            task.cancel()
+        await asyncio.gather(*started, return_exceptions=True)
+
+
+async def _until(condition, timeout=30.0):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise TimeoutError("Benchmark condition not reached")
+        await asyncio.sleep(0.0005)
+    return time.perf_counter()
+
+
+async def _entry(h, out):
+    sell = h.expect("new", lambda t: t.order.action == "SELL")
+    stop = h.expect("new", lambda t: t.order.orderType == "STP")
+    t0 = time.perf_counter()
+    await h.start(call=True)
+    out["entry"].append(await sell - t0)
+    out["entry_protected"].append(await stop - t0)
+
+
+async def _trailing(h, out):
+    await h.start(call=True)
+    s, call = h.strategy, h.strategy.leg("call")
+    h.run(s.run_legs())
+    await asyncio.sleep(np.random.uniform(0, call.check_time))
+    level = call.fill * (1 - call.entry_price_changes_by / 100) - 0.05
+    tightened = h.expect("modify", lambda t: t.order.orderId == call.stp_id)
+    t0 = time.perf_counter()
+    h.ib.set_quote(call.strike, "C", max(level - 0.1, 0.0), level)
+    out["trailing_tighten"].append(await tightened - t0)
+
+
+async def _stop_out(h, out):
+    await h.start(call=True, put=True)
+    s, call, put = h.strategy, h.strategy.leg("call"), h.strategy.leg("put")
+    detected = {}
+    register = s._register_stop_loss_hit
+
+    async def stamped(leg):
+        detected.setdefault(leg, time.perf_counter())
+        return await register(leg)
+
+    s._register_stop_loss_hit = stamped
+    h.run(s.run_legs())
+    executed = h.expect("exec", lambda t: t.order.orderId == call.stp_id)
+    moved = h.expect("modify", lambda t: t.order.orderId == put.stp_id)
+    price = call.sl_price + 0.1
+    h.ib.set_quote(call.strike, "C", price - 0.1, price)
+    t_exec = await executed
+    await _until(lambda: "call" in detected)
+    out["stop_out_detection"].append(detected["call"] - t_exec)
+    out["move_to_cost"].append(await moved - t_exec)
+
+
+async def _re_entry(h, out):
+    await h.start(call=True)
+    s, call = h.strategy, h.strategy.leg("call")
+    h.run(s.run_legs())
+    price = call.sl_price + 0.1
+    h.ib.set_quote(call.strike, "C", price - 0.1, price)
+    await _until(lambda: not call.placed)
+    reentered = h.expect("new", lambda t: t.order.action == "SELL")
+    t0 = time.perf_counter()
+    h.ib.set_quote(call.strike, "C", max(call.fill - 0.2, 0.0), max(call.fill - 0.1, 0.05))
+    out["re_entry"].append(await reentered - t0)
+
+
+async def _eod_close(h, out):
+    await h.start(call=True, put=True)
+    t0 = time.perf_counter()
+    await h.strategy.close_all_positions(test=True)
+    t_flat = await _until(lambda: not h.ib.positions())
+    out["eod_close"].append(t_flat - t0)
+
+
+async def _greeks(h, out):
+    # Every listed strike of both rights, two hours before expiry
+    market = h.ib.market
+    frame = pd.DataFrame([(k, r) + market.quote(k, r) for k in market.strikes for r in ("C", "P")],
+                         columns=["strike", "right", "bid", "ask", "mid"])
+    t0 = time.perf_counter()
+    chain_greeks(frame, 2 * 3600 / YEAR_SECONDS)
+    out["greeks_chain"].append(time.perf_counter() - t0)
+
+
+SCENARIOS = {
+    "entry": _entry,
+    "trailing_tighten": _trailing,
+    "stop_out": _stop_out,
+    "re_entry": _re_entry,
+    "eod_close": _eod_close,
+    "greeks": _greeks,
+}
+
+
+async def run_benchmarks(samples: int = 10, latency: float = 0.005, only=None) -> dict:
+    """
+    Runs every scenario ``samples`` times against FakeIB and returns the raw latencies in seconds per path
+    """
+    credentials.enable_logging = False
+    credentials.number_of_re_entry = max(credentials.number_of_re_entry, 1)
+    notifier.enabled = False
+    out = {path: [] for path in PATHS}
+    for name, scenario in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        for i in range(samples):
+            h = Harness(latency, seed=i)
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    await asyncio.wait_for(scenario(h, out), 60)
+                finally:
+                    # Inside the redirect: the strategy's tasks print while they wind down
+                    await h.close()
+    return out
+
+
+def summarize(values) -> dict:
+    if not values:
+        return {"n": 0}
+    ms = np.asarray(values) * 1000
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Paths whose p50 or p99 got more than ``tolerance`` (fraction) slower than the baseline
+    """
+    regressions = []
+    for path, now in current["results"].items():
+        before = baseline.get("results", {}).get(path)
+        if not before or not now.get("n") or not before.get("n"):
+            continue
+        for stat in ("p50_ms", "p99_ms"):
+            if now[stat] > before[stat] * (1 + tolerance):
+                regressions.append(f"{path} {stat}: {before[stat]} -> {now[stat]}")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tick-to-order latency benchmarks against the IB simulator")
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated broker latency in seconds")
+    parser.add_argument("--only", nargs="*", choices=list(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument("--out", default=os.path.join(credentials.cache_dir, "bench_results.json"),
+                        help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    raw = asyncio.get_event_loop().run_until_complete(
+        run_benchmarks(samples=args.samples, latency=args.latency, only=args.only))
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "latency_s": args.latency,
+        "samples": args.samples,
+        "results": {path: summarize(raw[path]) for path in PATHS},
+    }
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    for path, stats in report["results"].items():
+        print(f"{path:20s} {stats}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,170 @@
+import asyncio
+
+from ib_insync import Position
+
+import credentials
+from metrics import metrics
+from new_broker import IBTWSAPI, INSTRUMENTED
+
+
+class BrokerView(IBTWSAPI):
+    """
+    One strategy's broker on a BrokerHub connection.\n
+    The IB client, quote book, contract registry, chain engine and stop-out detector are
+    the hub's, so strategies share market data lines and contract lookups. Orders sent
+    through the view are claimed by order id; fills, positions and open orders it reports
+    are this strategy's own, not the whole account's.\n
+    """
+
+    def __init__(self, hub, name: str, account: str = ""):
+        super().__init__(hub.broker.CREDS, ib_factory=hub.broker.ib_factory)
+        self.hub = hub
+        self.name = name
+        self.account = account
+        self.order_ids = set()
+        # conId -> [contract, net quantity] from this view's own executions
+        self._positions = {}
+
+    async def connect(self) -> bool:
+        shared = await self.hub.connect()
+        self.client = self.ib = shared.client
+        self.data_client = shared.data_client
+        self.pacing = shared.pacing
+        self.quote_book = shared.quote_book
+        self.stop_outs = shared.stop_outs
+        self.stops = shared.stops
+        self.contracts = shared.contracts
+        self.chain = shared.chain
+        self.recorder = shared.recorder
+        if credentials.enable_metrics:
+            metrics.instrument(self, INSTRUMENTED)
+        print(f"{self.name} attached to shared connection")
+
+    def _place(self, contract, order):
+        trade = super()._place(contract, order)
+        self.order_ids.add(trade.order.orderId)
+        self.hub.claim(trade.order.orderId, self)
+        return trade
+
+    def on_fill(self, fill):
+        if fill.contract.secType == "BAG":
+            # Combo orders are booked through their leg executions
+            return
+        shares = fill.execution.shares if fill.execution.side == "BOT" else -fill.execution.shares
+        entry = self._positions.setdefault(fill.contract.conId, [fill.contract, 0.0])
+        entry[1] += shares
+
+    def held(self, con_id) -> float:
+        """
+        Quantity of ``con_id`` this view holds, from its own executions
+        """
+        entry = self._positions.get(con_id)
+        return entry[1] if entry is not None else 0.0
+
+    async def adopt(self, order_ids, positions, fills):
+        # After a restart the hub knows none of our orders: claim them and book their executions again
+        ids = {order_id for order_id in order_ids if order_id}
+        for order_id in ids:
+            self.order_ids.add(order_id)
+            self.hub.claim(order_id, self)
+        for fill in fills:
+            if fill.execution.orderId in ids:
+                self.hub._route(fill)
+        return await self.get_positions()
+
+    async def get_positions(self):
+        return [Position(self.account, contract, qty, 0.0) for contract, qty in self._positions.values() if qty]
+
+    async def refresh_positions(self):
+        # Already exact: booked from this view's own executions
+        return await self.get_positions()
+
+    async def open_trades(self):
+        return [t for t in self.client.openTrades() if t.order.orderId in self.order_ids]
+
+    async def get_open_orders(self):
+        return await self.open_trades()
+
+    def disconnect(self):
+        # The connections belong to the hub
+        pass
+
+    def stop_recording(self):
+        self.hub.release(self)
+
+    def stop_metrics(self):
+        # Recording and metrics are shared; the hub stops them when the last view is released
+        pass
+
+
+class BrokerHub:
+    """
+    Runs many Strategy instances over one IB connection.\n
+    ``view(name)`` hands each strategy its own BrokerView; the first view to connect opens
+    the connection, the rest attach to it. Executions are routed to the view that placed
+    the order, by order id.\n
+    """
+
+    def __init__(self, creds: dict, ib_factory=None):
+        self.broker = IBTWSAPI(creds, ib_factory=ib_factory)
+        self.views = []
+        self._owners = {}
+        self._exec_ids = set()
+        self._connecting = None
+
+    def view(self, name: str, account: str = "") -> BrokerView:
+        view = BrokerView(self, name, account)
+        self.views.append(view)
+        return view
+
+    async def connect(self) -> IBTWSAPI:
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        await self._connecting
+        return self.broker
+
+    async def _connect(self):
+        await self.broker.connect()
+        self.broker.client.execDetailsEvent += self._on_exec_details
+        self.broker.resync_listeners.append(self._on_resync)
+        # Other strategies trade the same contracts: "went flat" is the owning view's booking
+        self.broker.stop_outs.holding = self._holding
+
+    def claim(self, order_id, view):
+        self._owners[order_id] = view
+
+    def owner(self, order_id):
+        return self._owners.get(order_id)
+
+    def _holding(self, order_id, con_id):
+        view = self._owners.get(order_id)
+        return view.held(con_id) if view is not None else None
+
+    def _on_exec_details(self, trade, fill):
+        self._route(fill)
+
+    def _on_resync(self, fills):
+        for fill in fills:
+            self._route(fill)
+
+    def _route(self, fill):
+        if fill.execution.execId in self._exec_ids:
+            return
+        self._exec_ids.add(fill.execution.execId)
+        view = self._owners.get(fill.execution.orderId)
+        if view is not None:
+            view.on_fill(fill)
+
+    def release(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if not self.views:
+            self.broker.stop_recording()
+            self.broker.stop_metrics()
+
+
+async def run_strategies(strategies):
+    """
+    Runs every strategy's session concurrently in this event loop
+    """
+    await asyncio.gather(*(strategy.main() for strategy in strategies))
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+from pacing import DATA
+
+
+async def measure_offset(client, samples: int = 5, resolution: float = 1.0, spacing: float = 0.27, pacing=None):
+    """
+    Offset in seconds of the TWS server clock from ours (server = local + offset) and its uncertainty.\n
+    TWS reports whole seconds, so one reply only says the server time was somewhere in
+    [reply, reply + resolution) while the request was in flight. Each sample bounds the
+    offset to an interval; samples ``spacing`` seconds apart land at different phases of
+    the server second and their intersection narrows it well below a second.\n
+    """
+    low, high = -float("inf"), float("inf")
+    for i in range(samples):
+        if i:
+            await asyncio.sleep(spacing)
+        if pacing is not None:
+            await pacing.acquire(DATA)
+        sent = time.time()
+        server = (await client.reqCurrentTimeAsync()).timestamp()
+        received = time.time()
+        low = max(low, server - received)
+        high = min(high, server + resolution - sent)
+    if low > high:
+        # Inconsistent samples (our clock stepped meanwhile): trust the last one
+        low, high = server - received, server + resolution - sent
+    return (low + high) / 2, (high - low) / 2
@@ -0,0 +1,106 @@
+import credentials
+
+from ib_insync import Option
+from pacing import DATA
+
+
+class ContractRegistry:
+    """
+    Qualifies each option contract once per session and hands back the cached
+    qualified contract afterwards.\n
+    Contracts are keyed by (symbol, expiry, strike, right, tradingClass) and by conId.\n
+    """
+
+    def __init__(self, client, pacing=None):
+        self.client = client
+        self.pacing = pacing
+        self._by_key = {}
+        self._by_con_id = {}
+
+    def __len__(self):
+        return len(self._by_key)
+
+    @staticmethod
+    def key(symbol, expiry, strike, right, trading_class=None):
+        return symbol, str(expiry), float(strike), right.upper()[0], trading_class or credentials.tradingClass
+
+    @staticmethod
+    def build(symbol, expiry, strike, right, trading_class=None, exchange="SMART"):
+        return Option(
+            symbol=symbol,
+            lastTradeDateOrContractMonth=expiry,
+            strike=strike,
+            right=right,
+            exchange=exchange,
+            currency="USD",
+            multiplier='100',
+            tradingClass=trading_class or credentials.tradingClass
+        )
+
+    def register(self, contract):
+        """
+        Stores a contract that already came back qualified (e.g. from reqContractDetails)\n
+        """
+        key = self.key(contract.symbol, contract.lastTradeDateOrContractMonth, contract.strike, contract.right,
+                       contract.tradingClass or None)
+        self._by_key.setdefault(key, contract)
+        self._by_con_id.setdefault(contract.conId, contract)
+        return self._by_key[key]
+
+    def by_con_id(self, con_id):
+        return self._by_con_id.get(con_id)
+
+    async def option(self, symbol, expiry, strike, right, trading_class=None, exchange="SMART"):
+        """
+        Returns the qualified option, qualifying it with TWS only the first time it is asked for\n
+        """
+        key = self.key(symbol, expiry, strike, right, trading_class)
+        contract = self._by_key.get(key)
+        if contract is None:
+            if self.pacing is not None:
+                # Two legs asking for the same new contract at once share one qualification
+                return await self.pacing.merge(("qualify",) + key, lambda: self._qualify_one(
+                    key, symbol, expiry, strike, right, trading_class, exchange))
+            contract = await self._qualify_one(key, symbol, expiry, strike, right, trading_class, exchange)
+        return contract
+
+    async def _qualify_one(self, key, symbol, expiry, strike, right, trading_class, exchange):
+        contract = self.build(symbol, expiry, strike, right, trading_class, exchange)
+        await self._qualify([(key, contract)])
+        if not contract.conId:
+            raise ValueError("Failed to qualify contract with IBKR.")
+        return contract
+
+    async def qualify(self, contract):
+        """
+        Returns the cached qualified version of an option contract built elsewhere\n
+        """
+        if contract.conId and contract.conId in self._by_con_id:
+            return self._by_con_id[contract.conId]
+        return await self.option(contract.symbol, contract.lastTradeDateOrContractMonth, contract.strike,
+                                 contract.right, contract.tradingClass or None, contract.exchange or "SMART")
+
+    async def prequalify(self, symbol, expiry, strikes, rights=("C", "P"), trading_class=None) -> int:
+        """
+        Qualifies every (strike, right) in one batch so later orders never wait on contract details\n
+        Returns how many contracts were newly qualified.\n
+        """
+        pending = []
+        for strike in strikes:
+            for right in rights:
+                key = self.key(symbol, expiry, strike, right, trading_class)
+                if key not in self._by_key:
+                    pending.append((key, self.build(symbol, expiry, strike, right, trading_class)))
+        await self._qualify(pending)
+        return sum(1 for _, c in pending if c.conId)
+
+    async def _qualify(self, pending):
+        if not pending:
+            return
+        if self.pacing is not None:
+            await self.pacing.acquire(DATA, cost=len(pending))
+        await self.client.qualifyContractsAsync(*[c for _, c in pending])
+        for key, contract in pending:
+            if contract.conId:
+                self._by_key[key] = contract
+                self._by_con_id[contract.conId] = contract
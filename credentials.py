@@ -1,6 +1,21 @@
 # Default Values #close_hedges
 port = 7497
+use_simulator = False  # Run against the in-process IB simulator (ib_simulator.FakeIB) instead of TWS
 host = "127.0.0.1"
+client_id = 14  # TWS API client id of the order connection
+separate_data_connection = True  # Stream market data over a second connection so quotes never queue ahead of orders
+data_client_id = 15  # TWS API client id of the market data connection
+auto_reconnect = True  # Reconnect dropped connections with backoff and resync orders, positions and quotes
+reconnect_timeout = 10  # Seconds each reconnect attempt may take
+pacing_rate = 45  # Messages per second sent to TWS (its limit is 50)
+pacing_order_reserve = 5  # Messages of that budget data requests must leave free for orders
+stop_coalesce = 0.05  # Seconds stop changes are gathered before one amend is sent
+stop_ack_timeout = 5  # Seconds to wait for TWS to acknowledge a stop placement or amend
+option_min_tick = 0.05  # Option price increment below option_tick_break
+option_tick_break = 3.0  # Premium from which option_tick_above applies
+option_tick_above = 0.10  # Option price increment at and above option_tick_break
+combo_orders = None  # None: one order per contract; "vertical": each leg with its hedge; "all": every leg at once
+native_trailing = None  # None trails client-side; "adjust" or "trail" let TWS move the stop (Strategy.stop_adjustment)
 data_type = 4
 instrument = "SPX"
 tradingClass = "SPXW"  # SPXW is for weekly (regular) and SPX is for AM
@@ -8,12 +23,40 @@ exchange = "CBOE"
 currency = "USD"
 close_positions = False
 enable_logging = True
+log_level = "INFO"  # Set to "DEBUG" to also log every premium sample
+log_async = True  # Format and write log records on a background thread
+log_format = "text"  # "text" or "jsonl" (one JSON event per line)
+log_rotate_bytes = 0  # Rotate the log file at this size (0 = no size rotation)
+log_rotate_when = None  # Or rotate on time, e.g. "midnight" or "H" (None = no time rotation)
+log_backup_count = 5  # Rotated log files to keep
+enable_journal = True  # Journal leg state so a restarted session resumes instead of entering again
+journal_dir = "journal"  # One <date>.jsonl per session (per strategy name when several share a connection)
+journal_fsync_every = 0.2  # Seconds between journal flushes; a crash loses at most this window
 calc_values = True
 active_close_hedges = False
 close_hedges = True
 # if active_close_hedges is false then don't open the hedges at all if true
 # And close_hedges is true then close and open hedges accordingly
 # And if close-hedges is False then just open the hedges but don't close them
+max_market_data_lines = 90  # Streaming quote lines the quote book may keep open at once
+quote_stale_after = 5  # Seconds without a tick before a quote is flagged as stale
+record_ticks = False  # Record quote updates of the index, traded legs and strike window for research/replay
+record_dir = "ticks"  # Recordings go to <record_dir>/<date>/
+record_strike_window = 10  # Listed strikes either side of ATM to record (each needs two market data lines)
+cache_dir = "cache"  # Where the daily strike grid cache is kept
+chain_concurrency = 50  # Option chain snapshots allowed in flight at once
+fill_timeout = 10  # Seconds to wait for a market order fill event before giving up
+clock_sync_samples = 5  # reqCurrentTime samples per clock offset measurement
+server_clock_resolution = 1.0  # TWS reports whole seconds
+clock_resync_lead = 30  # Seconds before a timed action the clock offset is measured again
+fast_flatten = True  # Exit by cancelling everything and sending every closing order at once
+flatten_fill_timeout = 2  # Seconds a flatten attempt waits for fills before retrying what is left
+flatten_retries = 3  # Extra flatten attempts for positions still open
+stop_out_poll_time = 30  # Seconds between fallback position checks; stop executions are picked up from events
+enable_metrics = False  # Time every broker call (per method and leg); off means the broker is not wrapped at all
+metrics_port = 0  # Serve Prometheus text on 127.0.0.1:<port>/metrics (0 = no endpoint)
+metrics_file = "metrics.prom"  # Also dump the metrics here every metrics_dump_every seconds (None = no file)
+metrics_dump_every = 60  # Seconds between metrics file dumps
 WEBHOOK_URL = "https://discord.com/api/webhooks/1479071097134649496/P4FPegjWst-GJJbbl6ULBwZP1o1FQOwNDmK6thSHOXfnOfJf9vEpJEWF10dCAEoVAU4y"
 
 # Changeable Values
@@ -23,10 +66,19 @@ number_of_re_entry = 0  # Re-entry attempts allowed for the first stopped leg (s
 opposite_leg_move_to_cost = True  # When one ATM leg stops out, move the other leg's stop to entry (cost)
 # If True, skip move-to-cost when the opposite leg's trailing SL has tightened at least once
 opposite_leg_move_to_cost_respect_trailing = True
-OTM_CALL_HEDGE = 20  # How far away the call hedge is (10 means that its $50 away from current price)
-OTM_PUT_HEDGE = 40  # How far away the put hedge is (10 means that its $50 away from current price)
-ATM_CALL = 2  # How far away call position is (2 means that its $10 away from current price)
-ATM_PUT = 2  # How far away put position is (2 means that its $10 away from current price)
+OTM_CALL_HEDGE = 20  # How many listed strikes away the call hedge is (10 on a 5-point grid is $50)
+OTM_PUT_HEDGE = 40  # How many listed strikes away the put hedge is (10 on a 5-point grid is $50)
+ATM_CALL = 2  # How many listed strikes away the call position is (2 on a 5-point grid is $10)
+ATM_PUT = 2  # How many listed strikes away the put position is (2 on a 5-point grid is $10)
+call_delta = None  # Pick the short call by |delta| (e.g. 0.15) instead of ATM_CALL
+put_delta = None  # Pick the short put by |delta| instead of ATM_PUT
+call_hedge_delta = None  # Pick the call hedge by |delta| (e.g. 0.05) instead of OTM_CALL_HEDGE
+put_hedge_delta = None  # Pick the put hedge by |delta| instead of OTM_PUT_HEDGE
+greeks_strike_window = 40  # Listed strikes each side of ATM snapshotted for delta / premium selection
+risk_free_rate = 0.04  # Discount rate for the greeks (0DTE barely cares)
+expiry_hour = 16  # Hour (US/Eastern) the options expire, for time to expiry
+reselect_on_reentry = False  # Re-pick delta / premium strikes from a fresh chain on every re-entry
+greeks_reselect_window = 8  # Listed strikes each side of the leg's current strike snapshotted on re-entry
 call_sl = 70  # From where the call stop loss should start from (15 here means 15% of entry price)
 call_entry_price_changes_by = 50  # What % should call entry premium price should change by to update the trailing %
 call_change_sl_by = 50  # What % of entry price should call sl change when trailing stop loss updates
@@ -52,3 +104,10 @@ call_check_time = 1
 call_reentry_time = 5
 put_check_time = 1
 put_reentry_time = 5
+# Short legs to trade; None keeps the call/put pair above. Each dict takes legs.Leg's arguments, e.g. an iron condor:
+# [{"name": "call", "right": "C", "offset": 2, "hedge_offset": 20},
+#  {"name": "put", "right": "P", "offset": -2, "hedge_offset": -40}]
+legs = None
+# Run several strategies on one connection; None runs the single strategy above. Each entry has a "name",
+# optional "legs" (as above) and optional "account", e.g. [{"name": "narrow"}, {"name": "wide", "legs": [...]}]
+strategies = None
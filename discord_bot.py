@@ -5,6 +5,13 @@ import credentials
 # Replace this with your webhook URL
 WEBHOOK_URL = credentials.WEBHOOK_URL
 
+# Discord rejects message content longer than this
+MAX_MESSAGE_LENGTH = 2000
+
+
+def _format(content: str) -> str:
+    return f"@everyone\n{'.' * 100}\n{content}"
+
 
 async def send_discord_message(content: str) -> bool:
     """
@@ -19,7 +26,7 @@ async def send_discord_message(content: str) -> bool:
     """
     try:
         async with aiohttp.ClientSession() as session:
-            full_message = f"@everyone\n{'.' * 100}\n{content}"  # Single message
+            full_message = _format(content)  # Single message
 
             async with session.post(WEBHOOK_URL, json={"content": full_message}) as response:
                 if response.status == 204:
@@ -31,3 +38,124 @@ async def send_discord_message(content: str) -> bool:
     except Exception as e:
         print(f"Error sending message: {str(e)}")
         return False
+
+
+class DiscordNotifier:
+    """
+    Background webhook sender so callers never wait on Discord.
+
+    Messages go into a bounded queue and a single worker posts them over one pooled
+    session. Whatever has queued up while a post was in flight is coalesced into the
+    next message, HTTP 429 responses are retried after the advertised delay, and
+    messages that arrive while the queue is full are dropped and reported as a count.
+
+    Args:
+        webhook_url (str): Where to post; point it at a local HTTP server in tests
+        max_queue (int): Messages held before new ones are dropped
+    """
+
+    def __init__(self, webhook_url: str = None, max_queue: int = 200, max_retries: int = 5):
+        self.webhook_url = webhook_url or WEBHOOK_URL
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.enabled = True
+        self.dropped = 0
+        self.sent = 0
+        self._queue = None
+        self._session = None
+        self._worker = None
+
+    def notify(self, content: str) -> None:
+        """
+        Queue a message and return immediately.
+        """
+        if not self.enabled:
+            return
+        if self._worker is None or self._worker.done():
+            self._start()
+        try:
+            self._queue.put_nowait(str(content))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def flush(self) -> None:
+        """
+        Wait until everything queued so far has been posted (or given up on).
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                for content in self._coalesce(batch):
+                    await self._post(content)
+            except Exception as e:
+                print(f"Error sending message: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _coalesce(self, batch):
+        if self.dropped:
+            # A new list: the caller marks one task done per dequeued message in batch
+            batch = batch + [f"({self.dropped} notifications dropped, queue was full)"]
+            self.dropped = 0
+        limit = MAX_MESSAGE_LENGTH - len(_format(""))
+        chunk = ""
+        for content in batch:
+            content = content[:limit]
+            if chunk and len(chunk) + len(content) + 1 > limit:
+                yield chunk
+                chunk = ""
+            chunk = f"{chunk}\n{content}" if chunk else content
+        if chunk:
+            yield chunk
+
+    async def _post(self, content: str) -> bool:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1, keepalive_timeout=300))
+        delay = 1.0
+        for _ in range(self.max_retries):
+            async with self._session.post(self.webhook_url, json={"content": _format(content)}) as response:
+                if response.status in (200, 204):
+                    self.sent += 1
+                    return True
+                if response.status != 429:
+                    print(f"Failed to send message. Status code: {response.status}")
+                    return False
+                try:
+                    delay = float((await response.json()).get("retry_after", delay))
+                except Exception:
+                    delay = float(response.headers.get("Retry-After", delay))
+            await asyncio.sleep(delay)
+            delay *= 2
+        print("Failed to send message. Still rate limited after retries")
+        return False
+
+
+notifier = DiscordNotifier()
+
+
+def notify(content: str) -> None:
+    """
+    Queue a message on the shared notifier without waiting for Discord.
+    """
+    notifier.notify(content)
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from ib_insync import MarketOrder
+
+from pacing import ORDERS
+
+
+class FlattenReport:
+    __slots__ = ("seconds", "attempts", "cancelled", "orders", "residual")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.attempts = 0
+        self.cancelled = 0
+        self.orders = 0
+        self.residual = {}  # conId -> quantity still held
+
+    @property
+    def flat(self) -> bool:
+        return not self.residual
+
+    def __str__(self):
+        state = "flat" if self.flat else f"NOT flat, still holding {self.residual}"
+        return (f"Flatten: {state} in {self.seconds * 1000:.0f} ms, {self.cancelled} orders cancelled, "
+                f"{self.orders} closing orders over {self.attempts} attempt(s)")
+
+
+class FlattenEngine:
+    """
+    Gets a broker flat as fast as TWS allows.\n
+    Every working order is cancelled and every closing market order submitted at once,
+    with no wait in between; fills are awaited on their events for ``fill_timeout``
+    seconds. What each closing order left is worked out from its own fills, not from a
+    position re-read (on a BrokerView positions follow the routed executions, which may
+    come after the Filled status), and closed again up to ``retries`` more times.
+    Positions re-read between attempts only add what had no closing order, e.g. a stop
+    that executed before its cancel arrived. The report carries the time to flat.\n
+    """
+
+    def __init__(self, broker, fill_timeout: float = 2.0, retries: int = 3):
+        self.broker = broker
+        self.fill_timeout = fill_timeout
+        self.retries = retries
+
+    async def run(self, con_ids=None, shorts=True, longs=True, cancel=True) -> FlattenReport:
+        """
+        Flattens the positions in ``con_ids`` (None: every option position), limited to short and/or long ones
+        """
+        report = FlattenReport()
+        started = time.perf_counter()
+        if cancel:
+            working = await self.broker.open_trades()
+            report.cancelled = len(working)
+            await asyncio.gather(*(self._cancel(trade) for trade in working))
+        contracts, residual, stuck = {}, {}, set()
+        for p in await self.broker.get_positions():
+            if self._wanted(p, con_ids, shorts, longs):
+                contracts[p.contract.conId] = p.contract
+                residual[p.contract.conId] = p.position
+        while report.attempts <= self.retries:
+            closing = [(con_id, qty) for con_id, qty in residual.items() if qty and con_id not in stuck]
+            if not closing:
+                break
+            report.attempts += 1
+            trades = await asyncio.gather(*(self._close(contracts[con_id], qty) for con_id, qty in closing))
+            report.orders += len(trades)
+            await asyncio.gather(*(self.broker.wait_for_fill(t, timeout=self.fill_timeout) for t in trades))
+            unfilled = [t for t in trades if not t.isDone()]
+            await asyncio.gather(*(self._cancel(t) for t in unfilled))
+            # Until a cancel is confirmed the order can still fill; its fills are final only then
+            await asyncio.gather(*(self.broker.wait_for_fill(t, timeout=self.fill_timeout) for t in unfilled))
+            for (con_id, qty), trade in zip(closing, trades):
+                filled = self._filled(trade)
+                residual[con_id] = qty + filled if qty < 0 else qty - filled
+                if not trade.isDone():
+                    # Still working at the broker: closing it again could flip the position
+                    stuck.add(con_id)
+            if report.attempts <= self.retries:
+                for p in await self.broker.refresh_positions():
+                    if p.contract.conId not in contracts and self._wanted(p, con_ids, shorts, longs):
+                        contracts[p.contract.conId] = p.contract
+                        residual[p.contract.conId] = p.position
+        report.seconds = time.perf_counter() - started
+        report.residual = {con_id: qty for con_id, qty in residual.items() if qty}
+        return report
+
+    @staticmethod
+    def _wanted(position, con_ids, shorts, longs) -> bool:
+        if position.contract.secType != "OPT" or not position.position:
+            return False
+        if con_ids is not None and position.contract.conId not in con_ids:
+            return False
+        return shorts if position.position < 0 else longs
+
+    @staticmethod
+    def _filled(trade) -> float:
+        return max(trade.orderStatus.filled, sum(f.execution.shares for f in trade.fills))
+
+    async def _cancel(self, trade):
+        order_id = trade.order.orderId
+        self.broker.stops.forget(order_id)
+        self.broker.stop_outs.unwatch(order_id)
+        if trade.isDone():
+            return
+        await self.broker.pacing.acquire(ORDERS)
+        self.broker.client.cancelOrder(trade.order)
+
+    async def _close(self, contract, quantity):
+        contract = await self.broker.contracts.qualify(contract)
+        order = MarketOrder("BUY" if quantity < 0 else "SELL", abs(quantity))
+        await self.broker.pacing.acquire(ORDERS)
+        return self.broker._place(contract, order)
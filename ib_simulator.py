@@ -0,0 +1,569 @@
+import asyncio
+import itertools
+import math
+import random
+from datetime import datetime, timezone
+
+import credentials
+
+from eventkit import Event
+from ib_insync import (CommissionReport, ContractDetails, Execution, Fill, OptionChain, OrderStatus, Position,
+                       Ticker, Trade, TradeLogEntry, util)
+from ib_insync.util import UNSET_DOUBLE
+
+# Adjustable stop fields a modification carries over
+ADJUST_FIELDS = ("triggerPrice", "adjustedOrderType", "adjustedStopPrice", "adjustedTrailingAmount",
+                 "adjustableTrailingUnit")
+# conId the simulator gives the index itself; options are numbered from OPTION_CON_ID_BASE
+INDEX_CON_ID = 416904
+OPTION_CON_ID_BASE = 900000000
+
+
+class SimMarket:
+    """
+    Synthetic index and option quotes.\n
+    The index follows a seeded random walk; option premiums are intrinsic value plus a
+    time value that decays with distance from the money, quoted on a 0.05 grid with a
+    spread of ``spread`` ticks. Deterministic for a given ``seed``.\n
+    """
+
+    def __init__(self, spot: float = 5400.0, width: float = 300.0, step: float = 5.0, vol: float = 0.5,
+                 time_value: float = 12.0, spread: int = 2, seed: int = 0):
+        self.spot = spot
+        self.strikes = [round(spot - width + i * step, 2) for i in range(int(2 * width / step) + 1)]
+        self.vol = vol
+        self.time_value = time_value
+        self.spread = spread
+        self._rng = random.Random(seed)
+
+    def advance(self, dt: float):
+        self.spot += self._rng.gauss(0, self.vol * math.sqrt(dt))
+
+    def index_quote(self):
+        return self.spot - 0.5, self.spot + 0.5, self.spot
+
+    def quote(self, strike, right):
+        intrinsic = max(self.spot - strike, 0) if right == "C" else max(strike - self.spot, 0)
+        mid = intrinsic + self.time_value * math.exp(-abs(strike - self.spot) / 40)
+        bid = max(round(mid / 0.05) * 0.05 - 0.05 * (self.spread // 2), 0.0)
+        ask = bid + 0.05 * self.spread
+        return round(bid, 2), round(ask, 2), round(mid, 2)
+
+
+class TapeMarket:
+    """
+    Quotes replayed from a replay.TickTape, starting at its first tick
+    """
+
+    def __init__(self, tape, underlying_key=(0.0, '')):
+        self.tape = tape
+        self.underlying_key = underlying_key
+        self.now = tape.start
+        self.strikes = tape.strikes()
+
+    def advance(self, dt: float):
+        self.now += dt
+
+    def index_quote(self):
+        q = self.tape.quote(self.underlying_key, self.now)
+        return q["bid"], q["ask"], q["last"]
+
+    def quote(self, strike, right):
+        q = self.tape.quote((float(strike), right), self.now)
+        return q["bid"], q["ask"], q["last"]
+
+
+class _ClientShim:
+    """
+    The bits of ib_insync's low-level ``IB.client`` the broker layer touches
+    """
+
+    def __init__(self, order_ids):
+        self._order_ids = order_ids
+
+    def getReqId(self):
+        return next(self._order_ids)
+
+
+class FakeIB:
+    """
+    In-process stand-in for ``ib_insync.IB`` covering what IBTWSAPI uses: contract details,
+    sec-def params, streaming and snapshot market data, placing/modifying/cancelling orders
+    (plain, adjustable and trailing stops included),
+    positions, open orders and fills, with the same Trade/Ticker objects and events.\n
+    Acks and fills arrive ``latency`` seconds after the request; market fills are taken at
+    the touch plus ``slippage``. Faults can be injected with ``inject_disconnect``,
+    ``partial_fill_ratio``, ``reject_modifications`` and ``reject_orders``.\n
+    Plug it in with ``IBTWSAPI(creds, ib_factory=lambda: FakeIB(market))``.\n
+    """
+
+    def __init__(self, market=None, latency: float = 0.01, slippage: float = 0.0, tick_interval: float = 0.25,
+                 commission: float = 0.65, stop_trigger: str = "ask"):
+        self.market = market or SimMarket()
+        self.latency = latency
+        self.slippage = slippage
+        self.tick_interval = tick_interval
+        self.commission = commission
+        self.stop_trigger = stop_trigger
+
+        self.partial_fill_ratio = 0.0
+        self.reject_modifications = False
+        self.reject_orders = False
+        self.clock_offset = 0.0
+        self._down_until = None
+
+        self.connectedEvent = Event("connectedEvent")
+        self.disconnectedEvent = Event("disconnectedEvent")
+        self.pendingTickersEvent = Event("pendingTickersEvent")
+        self.newOrderEvent = Event("newOrderEvent")
+        self.orderModifyEvent = Event("orderModifyEvent")
+        self.openOrderEvent = Event("openOrderEvent")
+        self.orderStatusEvent = Event("orderStatusEvent")
+        self.execDetailsEvent = Event("execDetailsEvent")
+        self.commissionReportEvent = Event("commissionReportEvent")
+        self.positionEvent = Event("positionEvent")
+        self.errorEvent = Event("errorEvent")
+
+        self._order_ids = itertools.count(1)
+        self._exec_ids = itertools.count(1)
+        self.client = _ClientShim(self._order_ids)
+        self._connected = False
+        self._market_task = None
+        self._tickers = {}
+        self._streaming = set()
+        self._trades = {}
+        self._positions = {}
+        self._contracts = {}
+        self._overrides = {}
+
+    # Connection
+
+    def connect(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, **kwargs):
+        if self._down_until is not None and asyncio.get_event_loop().time() < self._down_until:
+            raise ConnectionRefusedError("Simulated gateway is down")
+        self._down_until = None
+        self._connected = True
+        if self._market_task is None or self._market_task.done():
+            self._market_task = asyncio.ensure_future(self._run_market())
+        self.connectedEvent.emit()
+        return self
+
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, **kwargs):
+        return self.connect(host, port, clientId, timeout)
+
+    def disconnect(self):
+        if self._connected:
+            self._connected = False
+            self._streaming.clear()
+            self.disconnectedEvent.emit()
+
+    def isConnected(self) -> bool:
+        return self._connected
+
+    def inject_disconnect(self, duration: float = None):
+        """
+        Drops the connection; with ``duration`` the gateway accepts reconnects again after that long
+        """
+        self.disconnect()
+        if duration is not None:
+            self._down_until = asyncio.get_event_loop().time() + duration
+
+    sleep = staticmethod(util.sleep)
+
+    def reqCurrentTime(self) -> datetime:
+        # Whole seconds, like TWS
+        return datetime.fromtimestamp(int(datetime.now(timezone.utc).timestamp() + self.clock_offset), timezone.utc)
+
+    async def reqCurrentTimeAsync(self) -> datetime:
+        await asyncio.sleep(self.latency)
+        return self.reqCurrentTime()
+
+    # Contracts
+
+    def _con_id(self, contract):
+        if contract.secType in ("IND", "STK"):
+            return INDEX_CON_ID
+        if contract.secType == "OPT" and contract.strike and contract.right:
+            strikes = self.market.strikes
+            if float(contract.strike) not in strikes:
+                return 0
+            i = strikes.index(float(contract.strike))
+            return OPTION_CON_ID_BASE + 2 * i + (0 if contract.right.upper()[0] == "C" else 1)
+        return 0
+
+    def _qualify(self, contract) -> bool:
+        self._check()
+        con_id = self._con_id(contract)
+        if not con_id:
+            self.errorEvent.emit(-1, 200, "No security definition has been found for the request", contract)
+            return False
+        contract.conId = con_id
+        if contract.secType == "OPT":
+            contract.right = contract.right.upper()[0]
+            contract.tradingClass = contract.tradingClass or credentials.tradingClass
+            contract.multiplier = contract.multiplier or "100"
+            contract.localSymbol = f"{contract.tradingClass} {contract.lastTradeDateOrContractMonth[2:]}" \
+                                   f"{contract.right}{int(contract.strike * 1000):08d}"
+        self._contracts[con_id] = contract
+        return True
+
+    def qualifyContracts(self, *contracts):
+        return [c for c in contracts if self._qualify(c)]
+
+    async def qualifyContractsAsync(self, *contracts):
+        await asyncio.sleep(self.latency)
+        return self.qualifyContracts(*contracts)
+
+    def reqContractDetails(self, contract):
+        self._check()
+        if contract.secType != "OPT":
+            return [ContractDetails(contract=contract)] if self._qualify(contract) else []
+        rights = [contract.right.upper()[0]] if contract.right else ["C", "P"]
+        strikes = [float(contract.strike)] if contract.strike else self.market.strikes
+        details = []
+        for strike in strikes:
+            for right in rights:
+                c = type(contract)(symbol=contract.symbol,
+                                   lastTradeDateOrContractMonth=contract.lastTradeDateOrContractMonth or credentials.date,
+                                   strike=strike, right=right, exchange=contract.exchange or "SMART",
+                                   currency="USD", multiplier="100",
+                                   tradingClass=contract.tradingClass or credentials.tradingClass)
+                if self._qualify(c):
+                    details.append(ContractDetails(contract=c, minTick=0.05))
+        return details
+
+    async def reqContractDetailsAsync(self, contract):
+        await asyncio.sleep(self.latency)
+        return self.reqContractDetails(contract)
+
+    def reqSecDefOptParams(self, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        self._check()
+        return [OptionChain(exchange="CBOE", underlyingConId=underlyingConId, tradingClass=tc, multiplier="100",
+                            expirations=[credentials.date], strikes=list(self.market.strikes))
+                for tc in (underlyingSymbol, credentials.tradingClass)]
+
+    # Market data
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    def ticker(self, contract):
+        return self._tickers.get(contract.conId or id(contract))
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False,
+                   mktDataOptions=None):
+        self._check()
+        if not contract.conId:
+            self._qualify(contract)
+        key = contract.conId or id(contract)
+        ticker = self._tickers.get(key)
+        if ticker is None:
+            ticker = Ticker(contract=contract)
+            self._tickers[key] = ticker
+        if not snapshot:
+            self._streaming.add(key)
+        asyncio.get_event_loop().call_later(self.latency, self._update_ticker, ticker)
+        return ticker
+
+    def cancelMktData(self, contract):
+        self._streaming.discard(contract.conId or id(contract))
+
+    async def reqTickersAsync(self, *contracts, regulatorySnapshot=False):
+        tickers = [self.reqMktData(c, snapshot=True) for c in contracts]
+        await asyncio.sleep(self.latency * 2)
+        return tickers
+
+    def reqTickers(self, *contracts, regulatorySnapshot=False):
+        return util.run(self.reqTickersAsync(*contracts))
+
+    def set_quote(self, strike, right, bid, ask, last=None):
+        """
+        Pins an option's quote (until ``clear_quote``) and publishes it straight away
+        """
+        self._overrides[(float(strike), right)] = (bid, ask, (bid + ask) / 2 if last is None else last)
+        self.publish()
+
+    def clear_quote(self, strike, right):
+        self._overrides.pop((float(strike), right), None)
+
+    def _quote(self, contract):
+        if contract.secType == "OPT":
+            pinned = self._overrides.get((float(contract.strike), contract.right))
+            return pinned or self.market.quote(float(contract.strike), contract.right)
+        return self.market.index_quote()
+
+    def _update_ticker(self, ticker):
+        ticker.bid, ticker.ask, ticker.last = self._quote(ticker.contract)
+        ticker.close = ticker.close if not util.isNan(ticker.close) else ticker.last
+        ticker.time = datetime.now(timezone.utc)
+        ticker.updateEvent.emit(ticker)
+        self.pendingTickersEvent.emit({ticker})
+
+    async def _run_market(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.market.advance(self.tick_interval)
+            self.publish()
+
+    def publish(self):
+        """
+        Pushes the current quotes to every streaming ticker and triggers any stop they cross
+        """
+        updated = set()
+        for key in list(self._streaming):
+            ticker = self._tickers[key]
+            ticker.bid, ticker.ask, ticker.last = self._quote(ticker.contract)
+            ticker.time = datetime.now(timezone.utc)
+            ticker.updateEvent.emit(ticker)
+            updated.add(ticker)
+        if updated:
+            self.pendingTickersEvent.emit(updated)
+        self._check_stops()
+
+    # Orders
+
+    def placeOrder(self, contract, order):
+        self._check()
+        existing = self._trades.get(order.orderId) if order.orderId else None
+        if existing is not None and not existing.isDone():
+            return self._modify(existing, order)
+        if not order.orderId:
+            order.orderId = next(self._order_ids)
+        if not contract.conId and contract.secType != "BAG":
+            self._qualify(contract)
+        status = OrderStatus(orderId=order.orderId, status=OrderStatus.PendingSubmit,
+                             remaining=order.totalQuantity)
+        trade = Trade(contract=contract, order=order, orderStatus=status, fills=[],
+                      log=[TradeLogEntry(datetime.now(timezone.utc), OrderStatus.PendingSubmit, '')])
+        self._trades[order.orderId] = trade
+        self.newOrderEvent.emit(trade)
+        asyncio.get_event_loop().call_later(self.latency, self._ack, trade)
+        return trade
+
+    def _modify(self, trade, order):
+        if self.reject_modifications:
+            asyncio.get_event_loop().call_later(
+                self.latency, self.errorEvent.emit, order.orderId, 201, "Order rejected - simulated", trade.contract)
+            return trade
+        trade.order.totalQuantity = order.totalQuantity
+        trade.order.auxPrice = order.auxPrice
+        trade.order.lmtPrice = order.lmtPrice
+        trade.order.trailingPercent = order.trailingPercent
+        for field in ADJUST_FIELDS:
+            setattr(trade.order, field, getattr(order, field))
+        self.orderModifyEvent.emit(trade)
+        asyncio.get_event_loop().call_later(self.latency, self._modified, trade)
+        return trade
+
+    def _modified(self, trade):
+        self.openOrderEvent.emit(trade)
+        self._set_status(trade, OrderStatus.Submitted, 'Modify')
+
+    def _ack(self, trade):
+        if self.reject_orders:
+            self.errorEvent.emit(trade.order.orderId, 201, "Order rejected - simulated", trade.contract)
+            self._set_status(trade, OrderStatus.Inactive, "Rejected")
+            return
+        self.openOrderEvent.emit(trade)
+        self._set_status(trade, OrderStatus.Submitted)
+        if trade.order.orderType == "MKT" and trade.contract.secType == "BAG":
+            self._execute_combo(trade)
+        elif trade.order.orderType == "MKT":
+            self._execute(trade, self._touch(trade))
+        else:
+            self._check_stops()
+
+    def _touch(self, trade):
+        bid, ask, _ = self._quote(trade.contract)
+        return ask + self.slippage if trade.order.action == "BUY" else bid - self.slippage
+
+    def _check_stops(self):
+        for trade in list(self._trades.values()):
+            order = trade.order
+            if order.orderType not in ("STP", "TRAIL") or trade.orderStatus.status != OrderStatus.Submitted:
+                continue
+            bid, ask, last = self._quote(trade.contract)
+            level = {"ask": ask if order.action == "BUY" else bid, "last": last}[self.stop_trigger]
+            if order.orderType == "STP":
+                self._adjust(trade, level)
+            stop = order.auxPrice if order.orderType == "STP" else self._trail(order, level)
+            if order.action == "BUY" and level >= stop:
+                self._execute(trade, max(stop, ask) + self.slippage)
+            elif order.action == "SELL" and level <= stop:
+                self._execute(trade, min(stop, bid) - self.slippage)
+
+    def _adjust(self, trade, level):
+        """
+        Applies an adjustable stop's adjustment once the trigger price is reached
+        """
+        order = trade.order
+        if not order.adjustedOrderType or order.triggerPrice in (None, UNSET_DOUBLE):
+            return
+        if (level > order.triggerPrice) if order.action == "BUY" else (level < order.triggerPrice):
+            return
+        order.orderType = order.adjustedOrderType
+        if order.orderType == "TRAIL":
+            order.trailStopPrice = order.adjustedStopPrice
+            order.auxPrice = order.adjustedTrailingAmount
+        else:
+            order.auxPrice = order.adjustedStopPrice
+        order.triggerPrice = UNSET_DOUBLE
+        order.adjustedOrderType = ""
+        self.openOrderEvent.emit(trade)
+
+    @staticmethod
+    def _trail(order, level):
+        # auxPrice is the trailing amount; the stop only ever moves in the position's favour
+        if order.action == "BUY":
+            order.trailStopPrice = min(order.trailStopPrice, level + order.auxPrice)
+        else:
+            order.trailStopPrice = max(order.trailStopPrice, level - order.auxPrice)
+        return order.trailStopPrice
+
+    def _execute(self, trade, price):
+        remaining = trade.order.totalQuantity - trade.orderStatus.filled
+        qty = remaining
+        if self.partial_fill_ratio and not trade.fills and remaining > 1:
+            qty = max(1, int(remaining * self.partial_fill_ratio))
+        self._record_fill(trade, qty, price)
+        if trade.orderStatus.filled < trade.order.totalQuantity:
+            trade.order.orderType = "MKT"
+            asyncio.get_event_loop().call_later(self.latency, lambda: self._execute(trade, self._touch(trade)))
+
+    def _execute_combo(self, trade):
+        """
+        Fills every leg of a combo market order at its own touch; the combo fills at the net per unit
+        """
+        order = trade.order
+        net = 0.0
+        booked = []
+        for combo_leg in trade.contract.comboLegs:
+            contract = self._contracts[combo_leg.conId]
+            buy = (combo_leg.action == "BUY") == (order.action == "BUY")
+            bid, ask, _ = self._quote(contract)
+            price = ask + self.slippage if buy else bid - self.slippage
+            net += (price if combo_leg.action == "BUY" else -price) * combo_leg.ratio
+            qty = order.totalQuantity * combo_leg.ratio
+            booked.append(self._book(trade, contract, buy, qty, price, qty, price))
+        status = trade.orderStatus
+        status.filled, status.remaining, status.avgFillPrice, status.lastFillPrice = \
+            order.totalQuantity, 0, round(net, 2), round(net, 2)
+        self._set_status(trade, OrderStatus.Filled, 'Fill')
+        for fill, report, held in booked:
+            self._emit_fill(trade, fill, report, held)
+        trade.filledEvent.emit(trade)
+
+    def _record_fill(self, trade, qty, price):
+        status = trade.orderStatus
+        filled = status.filled + qty
+        avg = (status.avgFillPrice * status.filled + price * qty) / filled
+        fill, report, held = self._book(trade, trade.contract, trade.order.action == "BUY", qty, price, filled, avg)
+        status.filled, status.remaining, status.avgFillPrice, status.lastFillPrice = \
+            filled, trade.order.totalQuantity - filled, avg, price
+
+        done = filled >= trade.order.totalQuantity
+        self._set_status(trade, OrderStatus.Filled if done else OrderStatus.Submitted, 'Fill')
+        self._emit_fill(trade, fill, report, held)
+        if done:
+            trade.filledEvent.emit(trade)
+
+    def _book(self, trade, contract, buy, qty, price, cum_qty, avg):
+        exec_id = f"sim.{next(self._exec_ids)}"
+        now = datetime.now(timezone.utc)
+        execution = Execution(execId=exec_id, time=now, acctNumber="SIM", exchange="CBOE",
+                              side="BOT" if buy else "SLD", shares=qty, price=price,
+                              orderId=trade.order.orderId, cumQty=cum_qty, avgPrice=avg)
+        report = CommissionReport(execId=exec_id, commission=self.commission * qty, currency="USD")
+        fill = Fill(contract, execution, report, now)
+        trade.fills.append(fill)
+
+        held = self._positions.get(contract.conId, 0) + (qty if buy else -qty)
+        self._positions[contract.conId] = held
+        return fill, report, held
+
+    def _emit_fill(self, trade, fill, report, held):
+        trade.fillEvent.emit(trade, fill)
+        self.execDetailsEvent.emit(trade, fill)
+        trade.commissionReportEvent.emit(trade, fill, report)
+        self.commissionReportEvent.emit(trade, fill, report)
+        self.positionEvent.emit(Position("SIM", fill.contract, held, fill.execution.avgPrice))
+
+    def _set_status(self, trade, status, message=''):
+        trade.orderStatus.status = status
+        trade.log.append(TradeLogEntry(datetime.now(timezone.utc), status, message))
+        trade.statusEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+        if status in (OrderStatus.Cancelled, OrderStatus.ApiCancelled):
+            trade.cancelledEvent.emit(trade)
+
+    def cancelOrder(self, order, manualCancelOrderTime=''):
+        self._check()
+        trade = self._trades.get(order.orderId)
+        if trade is None or trade.isDone():
+            self.errorEvent.emit(order.orderId, 10148, "OrderId that needs to be cancelled can not be cancelled",
+                                 None)
+            return trade
+        self._set_status(trade, OrderStatus.PendingCancel)
+        asyncio.get_event_loop().call_later(self.latency, self._set_status, trade, OrderStatus.Cancelled)
+        return trade
+
+    def trades(self):
+        return list(self._trades.values())
+
+    def openTrades(self):
+        return [t for t in self._trades.values() if not t.isDone()]
+
+    def openOrders(self):
+        return [t.order for t in self.openTrades()]
+
+    def reqOpenOrders(self):
+        self._check()
+        return self.openTrades()
+
+    async def reqOpenOrdersAsync(self):
+        await asyncio.sleep(self.latency)
+        return self.reqOpenOrders()
+
+    def reqCompletedOrders(self, apiOnly=False):
+        return [t for t in self._trades.values() if t.isDone()]
+
+    def fills(self):
+        return [fill for trade in self._trades.values() for fill in trade.fills]
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        await asyncio.sleep(self.latency)
+        self._check()
+        return self.fills()
+
+    def reqGlobalCancel(self):
+        for trade in self.openTrades():
+            self.cancelOrder(trade.order)
+
+    # Account
+
+    def positions(self, account=''):
+        return [Position("SIM", self._contracts.get(con_id), qty, 0.0)
+                for con_id, qty in self._positions.items() if qty]
+
+    def reqPositions(self):
+        return self.positions()
+
+    async def reqPositionsAsync(self):
+        await asyncio.sleep(self.latency)
+        return self.positions()
+
+    def accountSummary(self, account=''):
+        return []
+
+    def _check(self):
+        if not self._connected:
+            raise ConnectionError("Not connected")
+
+
+def shared(market=None, **kwargs):
+    """
+    An ib_factory that hands out one FakeIB for every connection, so the order and
+    market data connections of IBTWSAPI trade against the same simulated market
+    """
+    sim = FakeIB(market, **kwargs)
+    return lambda: sim
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class StateJournal:
+    """
+    Append-only JSON Lines journal of a strategy's state transitions.\n
+    ``record`` only appends a line to a deque; a background thread writes whatever
+    has accumulated every ``fsync_every`` seconds with one write and one fsync, so a
+    crash loses at most that window. Leg records carry only the fields that changed
+    since the last one. ``load`` folds the journal back into the latest state.\n
+    """
+
+    def __init__(self, path: str, fsync_every: float = 0.2):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.written = 0
+        self._lines = deque()
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, event: str, **fields):
+        fields["e"] = event
+        fields["t"] = round(time.time(), 3)
+        self._lines.append(json.dumps(fields, separators=(",", ":")))
+        if self._thread is None:
+            self._start()
+
+    def record_leg(self, name: str, state: dict):
+        """
+        Journals the fields of leg ``name`` that differ from what was journaled last
+        """
+        last = self._last.setdefault(name, {})
+        changed = {k: v for k, v in state.items() if last.get(k, ...) != v}
+        if changed:
+            last.update(changed)
+            self.record("leg", n=name, **changed)
+
+    def _start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="state-journal", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        with open(self.path, "a") as f:
+            while not self._stop.wait(self.fsync_every):
+                self._flush(f)
+            self._flush(f)
+
+    def _flush(self, f):
+        n = len(self._lines)
+        if not n:
+            return
+        f.write("".join(self._lines.popleft() + "\n" for _ in range(n)))
+        f.flush()
+        os.fsync(f.fileno())
+        self.written += n
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._stop.clear()
+
+    def load(self) -> dict:
+        """
+        Latest state from the journal: {"legs": {name: fields}, "first_sl_leg", "closed", "started"}.\n
+        A torn last line (crash mid-write) is ignored.\n
+        """
+        state = {"legs": {}, "first_sl_leg": None, "closed": False, "started": None}
+        if not os.path.exists(self.path):
+            return state
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                event = entry.pop("e", None)
+                if event == "leg":
+                    state["legs"].setdefault(entry.pop("n"), {}).update(
+                        {k: v for k, v in entry.items() if k != "t"})
+                elif event == "first_sl":
+                    state["first_sl_leg"] = entry["leg"]
+                elif event == "session":
+                    state["started"] = entry["t"]
+                elif event == "closed":
+                    state["closed"] = True
+        self._last = {name: dict(fields) for name, fields in state["legs"].items()}
+        return state
@@ -0,0 +1,119 @@
+import credentials
+
+LEG_FIELDS = ("name", "right", "offset", "quantity", "sl", "entry_price_changes_by", "change_sl_by", "check_time",
+              "reentry_time", "hedge_offset", "hedge_quantity", "strike", "hedge_strike", "delta", "premium",
+              "hedge_delta", "hedge_premium")
+# Live state the journal keeps, enough to resume managing the leg after a restart
+STATE_FIELDS = ("strike", "hedge_strike", "order_id", "fill", "sl_price", "stp_id", "placed", "trail_activated",
+                "trail_level", "reentries", "hedge_id", "hedge_fill", "done")
+
+
+class Leg:
+    """
+    Configuration and live state of one short option leg and its optional long hedge.\n
+    ``offset``/``hedge_offset`` are listed strikes away from the ATM strike (negative is below);
+    with calc_values off the fixed ``strike``/``hedge_strike`` are used instead. A leg
+    without a hedge offset or strike never opens a hedge. A target ``delta``/``premium``
+    (``hedge_delta``/``hedge_premium``) picks the strike from the chain's greeks instead
+    of the offset.\n
+    """
+
+    __slots__ = LEG_FIELDS + ("contract", "order_id", "fill", "sl_price", "stp_id", "placed", "trail_activated",
+                              "trail_level", "reentries", "hedge_id", "hedge_fill", "stopped", "due", "done", "task")
+
+    def __init__(self, name, right, offset, quantity=1, sl=70, entry_price_changes_by=50, change_sl_by=50,
+                 check_time=1, reentry_time=5, hedge_offset=None, hedge_quantity=1, strike=None, hedge_strike=None,
+                 delta=None, premium=None, hedge_delta=None, hedge_premium=None):
+        self.name = name
+        self.right = right.upper()[0]
+        self.offset = offset
+        self.quantity = quantity
+        self.sl = sl
+        self.entry_price_changes_by = entry_price_changes_by
+        self.change_sl_by = change_sl_by
+        self.check_time = check_time
+        self.reentry_time = reentry_time
+        self.hedge_offset = hedge_offset
+        self.hedge_quantity = hedge_quantity
+        self.strike = strike
+        self.hedge_strike = hedge_strike
+        self.delta = delta
+        self.premium = premium
+        self.hedge_delta = hedge_delta
+        self.hedge_premium = hedge_premium
+        self.contract = None
+        self.order_id = None
+        self.fill = None
+        self.sl_price = None
+        self.stp_id = None
+        self.placed = False
+        self.trail_activated = False
+        self.trail_level = 1  # Ladder rung the next trailing step waits for
+        self.reentries = 0
+        self.hedge_id = None
+        self.hedge_fill = None
+        self.stopped = False  # Set by the stop-out callback, handled by the next scheduler pass
+        self.due = 0.0  # Loop time of the next trail / re-entry check
+        self.done = False  # Flat with no re-entries left
+        self.task = None  # The scheduler's action for this leg while one is running
+
+    @property
+    def label(self) -> str:
+        return self.name.capitalize()
+
+    @property
+    def has_hedge(self) -> bool:
+        return self.hedge_offset is not None or self.hedge_strike is not None
+
+    @property
+    def by_greeks(self) -> bool:
+        return self.delta is not None or self.premium is not None
+
+    @property
+    def hedge_by_greeks(self) -> bool:
+        return self.hedge_delta is not None or self.hedge_premium is not None
+
+    def next_rung(self):
+        """
+        (trigger, stop) of the next trailing step: once the ask is at or below trigger, the stop moves to stop
+        """
+        trigger = self.fill - self.trail_level * (self.entry_price_changes_by / 100) * self.fill
+        return trigger, self.sl_price - self.fill * (self.change_sl_by / 100)
+
+    def snapshot(self) -> dict:
+        return {field: getattr(self, field) for field in STATE_FIELDS}
+
+    def restore(self, state: dict):
+        for field in STATE_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+
+    def __repr__(self):
+        return f"Leg({self.name} {self.right} {self.strike} x{self.quantity})"
+
+
+def default_legs():
+    """
+    The original pair: one short put and one short call, each with its hedge, from the per-leg credentials
+    """
+    return [
+        Leg("put", "P", -credentials.ATM_PUT, credentials.put_position, credentials.put_sl,
+            credentials.put_entry_price_changes_by, credentials.put_change_sl_by, credentials.put_check_time,
+            credentials.put_reentry_time, -credentials.OTM_PUT_HEDGE, credentials.put_hedge_quantity,
+            credentials.put_strike, credentials.put_hedge, delta=credentials.put_delta,
+            hedge_delta=credentials.put_hedge_delta),
+        Leg("call", "C", credentials.ATM_CALL, credentials.call_position, credentials.call_sl,
+            credentials.call_entry_price_changes_by, credentials.call_change_sl_by, credentials.call_check_time,
+            credentials.call_reentry_time, credentials.OTM_CALL_HEDGE, credentials.call_hedge_quantity,
+            credentials.call_strike, credentials.call_hedge, delta=credentials.call_delta,
+            hedge_delta=credentials.call_hedge_delta),
+    ]
+
+
+def configured_legs():
+    """
+    Legs from credentials.legs (a list of dicts keyed like Leg's arguments), or the default call/put pair
+    """
+    if not credentials.legs:
+        return default_legs()
+    return [Leg(**spec) for spec in credentials.legs]
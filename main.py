@@ -1,30 +1,19 @@
 from new_broker import IBTWSAPI
+import ib_simulator
 import credentials
 import asyncio
-from ib_insync import *
 import nest_asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 from pytz import timezone
-from discord_bot import send_discord_message
-import os
+from discord_bot import notifier
+from strategy_log import setup_logging
+from legs import Leg, configured_legs
+from broker_hub import BrokerHub, run_strategies
+from journal import StateJournal
+from greeks import chain_greeks, pick_strike, years_to
 import logging
-
-
-def setup_logging():
-    os.makedirs('logs', exist_ok=True)
-
-    eastern = timezone('US/Eastern')
-    current_date = datetime.now(eastern).strftime('%Y-%m-%d')
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s: %(message)s',
-        handlers=[
-            logging.FileHandler(f'logs/strategy_log_{current_date}.txt', mode='w'),
-            logging.StreamHandler()
-        ]
-    )
-    return logging.getLogger(__name__)
+import math
+import time
 
 
 nest_asyncio.apply()
@@ -32,74 +21,108 @@ nest_asyncio.apply()
 creds = {
     "host": credentials.host,
     "port": credentials.port,
-    "client_id": 14
+    "client_id": credentials.client_id
 }
 
 
 class Strategy:
 
-    def __init__(self):
+    def __init__(self, broker=None, legs=None, name=None):
         self.close_and_open_hedges_with_position = False
-        self.atm_call_id = None
-        self.atm_put_id = None
-        self.otm_call_id = None
-        self.otm_put_id = None
-        self.otm_put_fill = None
-        self.otm_call_fill = None
-        self.call_contract = None
-        self.put_contract = None
-        self.call_stp_id = None
-        self.put_stp_id = None
-        self.atm_put_sl = None
-        self.atm_call_sl = None
-        self.atm_call_fill = None
-        self.atm_put_fill = None
-        self.otm_closest_call = credentials.call_hedge
-        self.otm_closest_put = credentials.put_hedge
-        self.call_target_price = credentials.call_strike
-        self.put_target_price = credentials.put_strike
-        self.broker = IBTWSAPI(creds=creds)
+        self.name = name
+        self.legs = legs or configured_legs()
+        # A BrokerHub view when several strategies share one connection, else a connection of our own
+        self.broker = broker or IBTWSAPI(creds=creds,
+                                         ib_factory=ib_simulator.shared() if credentials.use_simulator else None)
         self.strikes = None
-        self.call_percent = credentials.call_sl
-        self.put_percent = credentials.put_sl
-        self.call_rentry = 0
-        self.put_rentry = 0
-        self.call_order_placed = False
-        self.put_order_placed = False
         self.first_sl_leg = None
-        self.call_trail_activated = False
-        self.put_trail_activated = False
+        # Seconds the TWS server clock is ahead of ours, from sync_clock
+        self.clock_offset = 0.0
         self._sl_state_lock = asyncio.Lock()
+        # Wakes the leg scheduler early (stop-outs, shutdown)
+        self._wake = asyncio.Event()
         self.should_continue = True
         self.testing = False
         self.reset = False
         self.func_test = False
         self.enable_logging = credentials.enable_logging
         self.logger = setup_logging() if self.enable_logging else None
-
-    async def dprint(self, phrase):
+        # None trails client-side; "adjust" / "trail" hand the ladder to TWS (see stop_adjustment)
+        self.native_trailing = credentials.native_trailing
+        # None sends one order per contract; "vertical" / "all" use combo orders (see enter_legs)
+        self.combo_orders = credentials.combo_orders
+        self.fast_flatten = credentials.fast_flatten
+        self.journal = None
+        if credentials.enable_journal:
+            suffix = f"_{name}" if name else ""
+            self.journal = StateJournal(f"{credentials.journal_dir}/{credentials.date}{suffix}.jsonl",
+                                        fsync_every=credentials.journal_fsync_every)
+
+    def leg(self, name):
+        return next(leg for leg in self.legs if leg.name == name)
+
+    def _journal_leg(self, leg):
+        if self.journal:
+            self.journal.record_leg(leg.name, leg.snapshot())
+
+    def _close_journal(self, finished):
+        if self.journal:
+            if finished:
+                self.journal.record("closed")
+            self.journal.close()
+
+    def now(self):
+        """
+        Session clock (US/Eastern), corrected to the TWS server clock. The replay engine swaps this for its
+        virtual clock.
+        """
+        return datetime.now(timezone('US/Eastern')) + timedelta(seconds=self.clock_offset)
+
+    async def sync_clock(self):
+        offset, uncertainty = await self.broker.clock_offset()
+        self.clock_offset = offset
+        await self.lprint("[CLOCK] TWS clock is %+.1f ms from ours (+/- %.1f ms)", offset * 1000, uncertainty * 1000,
+                          event="clock_sync")
+
+    async def wait_until(self, target, label):
+        """
+        Sleeps until ``target`` on the session clock with a deadline timer, re-measuring the clock offset
+        ``clock_resync_lead`` seconds before, and logs how late it actually fired
+        """
+        lead = (target - self.now()).total_seconds() - credentials.clock_resync_lead
+        if lead > 0:
+            await asyncio.sleep(lead)
+            await self.sync_clock()
+        delay = (target - self.now()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        skew = (self.now() - target).total_seconds()
+        await self.lprint("[TIMER] %s fired at %s, skew %+.1f ms", label, self.now().time(), skew * 1000,
+                          event="timer")
+        return skew
+
+    async def dprint(self, phrase, **event):
+        if self.name:
+            phrase = f"[{self.name}] {phrase}"
         print(phrase)
         if self.enable_logging:
-            self.logger.info(phrase)
-        await send_discord_message(phrase)
-
-    async def lprint(self, phrase):
-        if self.enable_logging:
-            self.logger.info(phrase)
-
-    def _may_move_put_sl_to_cost(self):
+            self.logger.info(phrase, extra=event)
+        notifier.notify(phrase)
+
+    async def lprint(self, phrase, *args, level=logging.INFO, **event):
+        """
+        Logs ``phrase % args`` with optional structured fields (leg, event, prices, order_id).
+        Formatting is left to the logging backend, so disabled levels cost a level check only.
+        """
+        if self.enable_logging and self.logger.isEnabledFor(level):
+            self.logger.log(level, f"[{self.name}] {phrase}" if self.name else phrase, *args, extra=event)
+
+    def _may_move_sl_to_cost(self, leg):
         if not credentials.opposite_leg_move_to_cost:
             return False
         if not credentials.opposite_leg_move_to_cost_respect_trailing:
             return True
-        return not self.put_trail_activated
-
-    def _may_move_call_sl_to_cost(self):
-        if not credentials.opposite_leg_move_to_cost:
-            return False
-        if not credentials.opposite_leg_move_to_cost_respect_trailing:
-            return True
-        return not self.call_trail_activated
+        return not leg.trail_activated
 
     def _first_sl_reentry_lock_enabled(self):
         return credentials.restrict_reentry_to_first_stopped_leg
@@ -110,26 +133,39 @@ class Strategy:
         async with self._sl_state_lock:
             if self.first_sl_leg is None:
                 self.first_sl_leg = leg
+                if self.journal:
+                    self.journal.record("first_sl", leg=leg)
             return self.first_sl_leg
 
+    def _stop_out_callback(self, leg):
+        def on_stop_out(order_id, source):
+            print(f"{leg.label} stop order {order_id} executed")
+            leg.stopped = True
+            self._wake.set()
+
+        return on_stop_out
+
     def _is_reentry_blocked(self, leg):
         if not self._first_sl_reentry_lock_enabled():
             return False
-        opposite_leg = "put" if leg == "call" else "call"
-        return self.first_sl_leg == opposite_leg
+        return self.first_sl_leg is not None and self.first_sl_leg != leg.name
 
     async def main(self):
-        await send_discord_message("." * 100)
+        notifier.notify("." * 100)
         await self.dprint("\n1. Testing connection...")
         await self.broker.connect()
         await self.dprint(f"Connection status: {self.broker.is_connected()}")
+        await self.sync_clock()
 
         if self.reset:
             await self.close_all_positions(test=True)
+            self._close_journal(finished=True)
+            await notifier.close()
             return
 
         if self.func_test:
             await self.broker.cancel_hedge()
+            await notifier.close()
             return
 
         if credentials.active_close_hedges and credentials.close_hedges:
@@ -137,8 +173,9 @@ class Strategy:
         else:
             self.close_and_open_hedges_with_position = False
 
-        while True:
-            current_time = datetime.now(timezone('US/Eastern'))
+        resumed = await self.resume()
+        while not resumed:
+            current_time = self.now()
             start_time = current_time.replace(
                 hour=credentials.entry_hour,
                 minute=credentials.entry_minute,
@@ -151,681 +188,745 @@ class Strategy:
                 microsecond=0)
             await self.dprint(f"Current Time: {current_time}")
             if (start_time <= current_time <= closing_time) or self.testing:
-                self.strikes = await self.broker.fetch_strikes(credentials.instrument, credentials.exchange,
-                                                               secType="IND")
+                self.strikes = await self.broker.get_strike_index(credentials.instrument, credentials.exchange,
+                                                                  credentials.tradingClass, credentials.date)
                 current_price = await self.broker.current_price(credentials.instrument, credentials.exchange)
                 current_price = int(current_price)
 
-                closest_strike = min(self.strikes, key=lambda x: abs(x - current_price))
+                closest_strike = self.strikes.nearest(current_price)
 
                 await self.dprint("\n\nNew Trading Session Start\n")
                 await self.dprint(f"CURRENT PRICE: {current_price}")
 
                 await self.dprint(f"CLOSEST CURRENT PRICE: {closest_strike}")
 
+                for leg in self.legs:
+                    if credentials.calc_values:
+                        leg.strike = closest_strike
+                        if leg.offset:
+                            leg.strike = self.strikes.step(closest_strike, leg.offset)
+                        if leg.hedge_offset is not None:
+                            leg.hedge_strike = self.strikes.step(closest_strike, leg.hedge_offset)
                 if credentials.calc_values:
-                    self.otm_closest_call = closest_strike + (credentials.OTM_CALL_HEDGE * 5)
-                await self.dprint(f"CALL HEDGE STRIKE PRICE: {self.otm_closest_call}")
-
-                if credentials.calc_values:
-                    self.otm_closest_put = closest_strike - (credentials.OTM_PUT_HEDGE * 5)
-                await self.dprint(f"PUT HEDGE STRIKE PRICE: {self.otm_closest_put}")
-
-                if credentials.calc_values:
-                    self.call_target_price = closest_strike
-                    if credentials.ATM_CALL > 0:
-                        self.call_target_price += 5 * credentials.ATM_CALL
-                await self.dprint(f"CALL POSITION STRIKE PRICE: {self.call_target_price}")
-
-                if credentials.calc_values:
-                    self.put_target_price = closest_strike
-                    if credentials.ATM_CALL > 0:
-                        self.put_target_price -= 5 * credentials.ATM_CALL
-                await self.dprint(f"PUT POSITION STRIKE PRICE: {self.put_target_price}")
-                if ((credentials.active_close_hedges and not credentials.close_hedges)
-                        or (credentials.close_hedges and credentials.active_close_hedges)):
-                    await self.place_hedge_orders(call=True, put=True)
-
-                await self.place_atm_put_order()
-                await self.place_atm_call_order()
+                    await self.select_strikes(self.legs, closest_strike, hedges=True)
+                for leg in self.legs:
+                    if leg.has_hedge:
+                        await self.dprint(f"{leg.name.upper()} HEDGE STRIKE PRICE: {leg.hedge_strike}")
+                    await self.dprint(f"{leg.name.upper()} POSITION STRIKE PRICE: {leg.strike}")
+
+                by_right = {}
+                for leg in self.legs:
+                    by_right.setdefault(leg.right, []).extend(
+                        [leg.strike, leg.hedge_strike] if leg.has_hedge else [leg.strike])
+                await asyncio.gather(*(
+                    self.broker.contracts.prequalify(credentials.instrument, credentials.date, strikes, rights=(right,))
+                    for right, strikes in by_right.items()
+                ))
+                if credentials.record_ticks:
+                    window = credentials.record_strike_window
+                    await self.broker.record_strike_window(
+                        credentials.instrument, credentials.date,
+                        [self.strikes.step(closest_strike, k) for k in range(-window, window + 1)])
+                if self.journal:
+                    self.journal.record("session", legs=[leg.name for leg in self.legs])
+                    for leg in self.legs:
+                        self._journal_leg(leg)
+                await self.enter_legs(self.legs, hedges=(
+                    (credentials.active_close_hedges and not credentials.close_hedges)
+                    or (credentials.close_hedges and credentials.active_close_hedges)))
                 await self.lprint(
                     "[CONFIG] Linked rules for this session: "
                     f"restrict_reentry_to_first_stopped_leg={self._first_sl_reentry_lock_enabled()} "
                     "(if True, only the first SL-hit leg may re-enter for this session). "
                     f"move_opposite_leg_to_cost={credentials.opposite_leg_move_to_cost} "
-                    f"(if True, when one leg hits SL the other leg's stop can move to entry). "
+                    f"(if True, when one leg hits SL the other legs' stops can move to entry). "
                     f"respect_opposite_trailing={credentials.opposite_leg_move_to_cost_respect_trailing} "
-                    f"(if True, skip that move once the opposite leg's trailing SL has tightened). "
+                    f"(if True, skip that move once the other leg's trailing SL has tightened). "
                     f"max_re_entries_first_stopped_leg={credentials.number_of_re_entry} "
                     "(when first-stop restriction is enabled, only that leg may use these; otherwise each leg uses its own limit)."
                 )
                 break
+            elif current_time < start_time:
+                await self.dprint(f"Market hasn't opened yet, entering at {start_time.time()}")
+                await self.wait_until(start_time, "Entry")
+                continue
             else:
                 await self.dprint("Market hasn't opened yet")
             await asyncio.sleep(10)
 
         await asyncio.gather(
-            self.call_trail_check(),
+            self.run_legs(),
             self.close_all_positions(test=False),
-            self.put_trail_check(),
-            self.put_hedge_check(),
-            self.call_hedge_check(),
         )
 
         if credentials.active_close_hedges and not credentials.close_hedges:
-            await self.close_open_hedges(close_put=True, close_call=True)
-
-    async def close_all_positions(self, test):
-        if credentials.close_positions and not test:
-            return
-        else:
-            while True:
-                current_time = datetime.now(timezone('US/Eastern'))
-                target_time = current_time.replace(
-                    hour=credentials.exit_hour,
-                    minute=credentials.exit_minute,
-                    second=credentials.exit_second,
-                    microsecond=0)
-
-                if current_time >= target_time or test:
-                    self.should_continue = False
-
-                    if self.atm_call_id:
-                        print(f"atm call id: {self.atm_call_id}")
-                        await self.broker.cancel_order(self.call_stp_id)
-                        await self.broker.cancel_order(self.atm_call_id)
-                    if self.atm_put_id:
-                        print(f"atm put id: {self.atm_put_id}")
-                        await self.broker.cancel_order(self.put_stp_id)
-                        await self.broker.cancel_order(self.atm_put_id)
-                    try:
-                        await asyncio.gather(
-                            self.close_call(),
-                            self.close_put(),
-                        )
-                        await self.dprint("All position closed")
-                    except Exception as e:
-                        await self.dprint(e)
-                    break
-
-                await asyncio.sleep(10)
-
-    async def close_call(self):
-        if self.call_order_placed:
-            await self.broker.cancel_call(hedge_strike=self.otm_closest_call, position_strike=self.call_target_price,
-                                          close_hedge=self.close_and_open_hedges_with_position)
+            await self.close_open_hedges(self.legs)
+
+        await self.lprint("%s", self.broker.pacing.report())
+        self._close_journal(finished=True)
+        self.broker.stop_recording()
+        self.broker.stop_metrics()
+        await notifier.close()
+
+    async def resume(self) -> bool:
+        """
+        Warm restart from today's journal.\n
+        Leg state is rebuilt from the journal and checked against the broker in one
+        batched request (open orders, positions, executions): legs that went flat while
+        we were down are handed to the scheduler as stop-outs, missing stops are placed
+        again, and everything else is watched as before. Returns False when there is no
+        unfinished session to resume.\n
+        """
+        if not self.journal:
+            return False
+        state = self.journal.load()
+        if state["closed"] or not state["legs"]:
+            return False
+        started = time.perf_counter()
+        self.first_sl_leg = state["first_sl_leg"]
+        for leg in self.legs:
+            if leg.name in state["legs"]:
+                leg.restore(state["legs"][leg.name])
+        trades, positions, fills = await self.broker.reconcile()
+        # On a shared connection this claims the journaled orders, so positions are this strategy's own
+        positions = await self.broker.adopt(
+            [i for leg in self.legs for i in (leg.order_id, leg.stp_id, leg.hedge_id)], positions, fills)
+        open_orders = {t.order.orderId: t.order for t in trades}
+        held = {
+            (p.contract.right, p.contract.strike): p.position
+            for p in positions
+            if p.contract.secType == 'OPT' and p.contract.symbol == credentials.instrument
+        }
+        for leg in self.legs:
+            short = held.get((leg.right, leg.strike), 0) < 0
+            if not leg.placed:
+                if leg.fill is None and leg.strike is not None and not leg.done:
+                    if short:
+                        await self.dprint(f"{leg.label} strike {leg.strike} is already short at the broker "
+                                          "but was never journaled as filled; not entering it again")
+                        leg.done = True
+                    else:
+                        await self.place_leg_order(leg)
+                continue
+            leg.contract = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                              leg.strike, leg.right)
+            await self.broker.watch_premium(credentials.instrument, credentials.date, leg.strike, leg.right)
+            if not short:
+                # Flattened while we were away; the scheduler runs the usual stop-out handling
+                leg.stopped = True
+                continue
+            stop = open_orders.get(leg.stp_id)
+            if self.native_trailing and stop is not None and not (self.native_trailing == "trail"
+                                                                  and leg.trail_activated):
+                if stop.orderType != "STP" or stop.auxPrice < self.broker.stops.rounded(leg.sl_price):
+                    # TWS took the armed step while we were down
+                    _, step_stop = leg.next_rung()
+                    leg.sl_price = stop.auxPrice if stop.orderType == "STP" else step_stop
+                    leg.trail_activated = True
+                    leg.trail_level += 1
+            adjust = self.stop_adjustment(leg)
+            if stop is None:
+                leg.stp_id = await self.broker.place_stp_order(contract=leg.contract, side="BUY",
+                                                               quantity=leg.quantity, sl=leg.sl_price,
+                                                               adjust=adjust)
+            elif adjust is not None:
+                # Re-arm the next step; TWS may have taken one while we were down
+                await self.broker.modify_stp_order(contract=leg.contract, side="BUY", quantity=leg.quantity,
+                                                   sl=leg.sl_price, order_id=leg.stp_id, adjust=adjust)
+            self._watch_stop(leg)
+            self._journal_leg(leg)
+        await self.dprint(
+            f"Resumed session from journal in {time.perf_counter() - started:.2f}s: "
+            + ", ".join(f"{leg.name} {'open' if leg.placed else 'flat'} sl={leg.sl_price} "
+                        f"re-entries={leg.reentries}" for leg in self.legs)
+        )
+        return True
+
+    async def run_legs(self):
+        """
+        Single scheduler for every leg.\n
+        Each pass starts the action of every leg whose stop fired or whose trailing /
+        re-entry check is due, then sleeps until the earliest due leg, the next fallback
+        position poll, a stop-out or a finished action, whichever comes first. Actions run
+        as tasks, at most one per leg, so one leg's re-entry fill wait never holds up
+        another leg's trailing or stop handling.\n
+        """
+        loop = asyncio.get_event_loop()
+        next_poll = loop.time() + credentials.stop_out_poll_time
+        while self.should_continue:
+            self._wake.clear()
+            if loop.time() >= next_poll:
+                await self._poll_positions()
+                next_poll = loop.time() + credentials.stop_out_poll_time
+            for leg in self.legs:
+                if leg.task is not None:
+                    if not leg.task.done():
+                        continue
+                    task, leg.task = leg.task, None
+                    task.result()  # An action's exception ends the session as it did inline
+                if not self.should_continue:
+                    continue
+                if leg.placed and leg.stopped:
+                    self._dispatch(leg, self._handle_stop_out(leg))
+                elif not leg.done and leg.due <= loop.time():
+                    self._dispatch(leg, self._step(leg))
+            wake_at = min([leg.due for leg in self.legs if not leg.done and leg.task is None] + [next_poll])
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(wake_at - loop.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+        # Let actions already under way finish (a re-entry's stop must not be left unplaced)
+        pending = [leg.task for leg in self.legs if leg.task is not None]
+        for leg in self.legs:
+            leg.task = None
+        await asyncio.gather(*pending)
+
+    def _dispatch(self, leg, action):
+        leg.task = asyncio.ensure_future(action)
+        leg.task.add_done_callback(lambda _: self._wake.set())
+
+    async def _step(self, leg):
+        """
+        One trailing or re-entry check of ``leg``; sets when it is due next
+        """
+        loop = asyncio.get_event_loop()
+        if leg.placed:
+            if self.native_trailing:
+                # TWS moves the stop itself; nothing to sample until the leg stops out
+                leg.due = math.inf
+                return
+            await self._check_trail(leg)
+            leg.due = loop.time() + leg.check_time
+        elif leg.fill is not None:
+            if await self._check_reentry(leg):
+                leg.due = loop.time()
+            else:
+                leg.due = loop.time() + leg.reentry_time
         else:
+            leg.done = True
+            self._journal_leg(leg)
+
+    async def _poll_positions(self):
+        """
+        Fallback for missed stop executions: one positions request covers every open leg
+        """
+        open_legs = [leg for leg in self.legs if leg.placed and not leg.stopped]
+        if not open_legs:
             return
-
-    async def close_put(self):
-        if self.put_order_placed:
-            await self.broker.cancel_put(hedge_strike=self.otm_closest_put, position_strike=self.put_target_price,
-                                         close_hedge=self.close_and_open_hedges_with_position)
+        held = {
+            (p.contract.right, p.contract.strike)
+            for p in await self.broker.get_positions()
+            if p.contract.secType == 'OPT' and p.contract.symbol == credentials.instrument
+        }
+        for leg in open_legs:
+            if (leg.right, leg.strike) not in held:
+                leg.stopped = True
+
+    async def _handle_stop_out(self, leg):
+        name, label = leg.name.upper(), leg.label
+        premium_price = await self.broker.get_latest_premium_price(
+            symbol=credentials.instrument,
+            expiry=credentials.date,
+            strike=leg.strike,
+            right=leg.right
+        )
+        await self.lprint("%s Hedge Premium: %s", label, premium_price, level=logging.DEBUG,
+                          leg=leg.name, event="hedge_premium", prices=premium_price)
+        leg.stopped = False
+        controlling_leg = await self._register_stop_loss_hit(leg.name)
+        if not self._first_sl_reentry_lock_enabled():
+            await self.lprint(
+                f"[{name} SL] {label} leg stopped out. First-stop re-entry restriction is disabled, "
+                "so every leg may continue managing re-entry independently."
+            )
+        elif controlling_leg == leg.name:
+            await self.lprint(
+                f"[{name} SL] {label} leg stopped out first. "
+                f"Re-entry: only {label} allowed, up to {credentials.number_of_re_entry} times "
+                f"(completed so far: {leg.reentries}). Re-entry of the other legs is blocked for this session."
+            )
         else:
-            return
-
-    async def place_hedge_orders(self, call, put):
-        if call:
-            spx_contract_call = Option(
-                symbol=credentials.instrument,
-                lastTradeDateOrContractMonth=credentials.date,
-                strike=self.otm_closest_call,
-                right='C',
-                exchange="SMART",
-                currency="USD",
-                multiplier='100',
-                tradingClass=credentials.tradingClass
+            await self.lprint(
+                f"[{name} SL] {label} leg stopped out, but {controlling_leg.capitalize()} had already stopped out "
+                f"first. Re-entry: only {controlling_leg.capitalize()} is allowed; {label} will not re-enter."
             )
-            try:
-                await self.dprint("Placing Hedge Call Order")
-                m, self.otm_call_fill, self.otm_call_id = await self.broker.place_market_order(
-                    contract=spx_contract_call,
-                    qty=credentials.call_hedge_quantity, side="BUY")
-
-                while self.should_continue:
-                    open_orders = await self.broker.get_open_orders()
-                    matching_order = next((trade for trade in open_orders if trade.order.orderId == self.otm_call_id),
-                                          None)
-
-                    if matching_order:
-                        self.otm_call_fill = matching_order.orderStatus.avgFillPrice
-                        if self.otm_call_fill > 0:
-                            print(f"Call hedge {self.otm_call_fill} is filled.")
-                            break
-                        else:
-                            print("Call hedge still open but not filled")
-                    else:
-                        print(
-                            f"Call hedge {self.otm_call_fill} is no longer in open orders — might be cancelled or filled.")
-                        break
-
-                    await asyncio.sleep(1)
+        for other in self.legs:
+            if other is not leg:
+                await self._move_to_cost(other)
+        self.broker.stop_outs.unwatch(leg.stp_id)
+        leg.placed = False
+        leg.stp_id = None
+        leg.due = 0.0
+        self._journal_leg(leg)
+        await self.broker.unwatch_premium(credentials.instrument, credentials.date, leg.strike, leg.right)
+        if self.close_and_open_hedges_with_position:
+            await self.close_open_hedges([leg])
+        await self.dprint(
+            f"[{name}] Stop loss triggered - Executing market buy"
+            f"\nCurrent Premium: {premium_price['mid']}"
+            f"\nStop Loss Level: {leg.sl_price}"
+            f"\nStrike Price: {leg.strike}"
+            f"\nPosition Size: {leg.quantity}",
+            leg=leg.name, event="stop_out", prices=premium_price
+        )
 
-            except Exception as e:
-                await self.dprint(f"Error placing call hedge order: {str(e)}")
-
-        if put:
-            spx_contract_put = Option(
-                symbol=credentials.instrument,
-                lastTradeDateOrContractMonth=credentials.date,
-                strike=self.otm_closest_put,
-                right='P',
-                exchange="SMART",
-                currency="USD",
-                multiplier='100',
-                tradingClass=credentials.tradingClass
+    async def _move_to_cost(self, leg):
+        name, label = leg.name.upper(), leg.label
+        if self.native_trailing == "trail" and leg.placed and leg.trail_activated:
+            await self.lprint(
+                f"[MOVE-TO-COST] {label} stop not changed: it is already a broker trailing stop."
             )
-            try:
-                await self.dprint("Placing Hedge Put Order")
-                n, self.otm_put_fill, self.otm_put_id = await self.broker.place_market_order(contract=spx_contract_put,
-                                                                                             qty=credentials.put_hedge_quantity,
-                                                                                             side="BUY")
-
-                while self.should_continue:
-                    open_orders = await self.broker.get_open_orders()
-                    matching_order = next((trade for trade in open_orders if trade.order.orderId == self.otm_put_id),
-                                          None)
-
-                    if matching_order:
-                        self.otm_put_fill = matching_order.orderStatus.avgFillPrice
-                        if self.otm_put_fill > 0:
-                            print(f"Put Hedge {self.otm_put_fill} is filled.")
-                            break
-                        else:
-                            print("Put Hedge still open but not filled")
-                    else:
-                        print(
-                            f"Put Hedge {self.otm_put_fill} is no longer in open orders — might be cancelled or filled.")
-                        break
-
-                    await asyncio.sleep(1)
-
-            except Exception as e:
-                await self.dprint(f"Error placing put hedge order: {str(e)}")
-
-    async def close_open_hedges(self, close_put=False, close_call=False):
-        if close_call:
-            spx_contract_call = Option(
-                symbol=credentials.instrument,
-                lastTradeDateOrContractMonth=credentials.date,
-                strike=self.otm_closest_call,
-                right='C',
-                exchange="SMART",
-                currency="USD",
-                multiplier='100',
-                tradingClass=credentials.tradingClass
+            return
+        if (
+            self._may_move_sl_to_cost(leg)
+            and leg.placed
+            and leg.stp_id
+            and leg.contract is not None
+            and leg.fill is not None
+        ):
+            leg.sl_price = round(leg.fill, 1)
+            await self.broker.modify_stp_order(
+                contract=leg.contract,
+                side="BUY",
+                quantity=leg.quantity,
+                sl=leg.sl_price,
+                order_id=leg.stp_id,
+                adjust=self.stop_adjustment(leg)
             )
-            qualified_contracts = self.broker.client.qualifyContracts(spx_contract_call)
-            if not qualified_contracts:
-                raise ValueError("Failed to qualify contract with IBKR.")
-            try:
-                await self.broker.place_market_order(contract=spx_contract_call, qty=credentials.call_hedge_quantity,
-                                                     side="SELL")
-                await self.dprint("Closing Call Hedge")
-            except Exception as e:
-                await self.dprint(f"Error closing call hedge: {str(e)}")
-
-        if close_put:
-            spx_contract_put = Option(
-                symbol=credentials.instrument,
-                lastTradeDateOrContractMonth=credentials.date,
-                strike=self.otm_closest_put,
-                right='P',
-                exchange="SMART",
-                currency="USD",
-                multiplier='100',
-                tradingClass=credentials.tradingClass
-                
+            self._journal_leg(leg)
+            await self.lprint(
+                f"[MOVE-TO-COST] {label} stop moved to entry/cost price {leg.sl_price} "
+                f"(allowed because {label} trailing had not started yet, or respect-trailing is False)."
+            )
+            await self.dprint(
+                f"[{name}] Opposite leg SL moved to cost: {leg.sl_price}"
+            )
+        elif (
+            credentials.opposite_leg_move_to_cost
+            and leg.placed
+            and leg.trail_activated
+            and credentials.opposite_leg_move_to_cost_respect_trailing
+        ):
+            await self.lprint(
+                f"[MOVE-TO-COST] {label} stop not changed: {label} trailing SL had already tightened and "
+                "respect_trailing is True."
+            )
+            await self.dprint(
+                f"[{name}] Move-to-cost skipped: {leg.name} trailing SL already adjusted"
+            )
+        elif not credentials.opposite_leg_move_to_cost:
+            await self.lprint(
+                f"[MOVE-TO-COST] {label} stop not changed: move_opposite_leg_to_cost is False in credentials."
+            )
+        elif credentials.opposite_leg_move_to_cost:
+            await self.lprint(
+                f"[MOVE-TO-COST] {label} stop not changed: {label} not open, or no stop order / fill data — "
+                "nothing to modify."
             )
-            qualified_contracts = self.broker.client.qualifyContracts(spx_contract_put)
-            if not qualified_contracts:
-                raise ValueError("Failed to qualify contract with IBKR.")
-            try:
-                await self.broker.place_market_order(contract=spx_contract_put, qty=credentials.put_hedge_quantity,
-                                                     side="SELL")
-                await self.dprint("Closing Put Hedge")
-            except Exception as e:
-                await self.dprint(f"Error closing put hedge: {str(e)}")
 
-    async def place_atm_call_order(self):
+    async def _check_trail(self, leg):
         premium_price = await self.broker.get_latest_premium_price(
             symbol=credentials.instrument,
             expiry=credentials.date,
-            strike=self.call_target_price,
-            right="C"
+            strike=leg.strike,
+            right=leg.right
         )
-        self.call_contract = Option(
+        await self.lprint("%s Sell Leg Premium: %s", leg.label, premium_price, level=logging.DEBUG,
+                          leg=leg.name, event="premium", prices=premium_price)
+        if premium_price['ask'] <= leg.fill - leg.trail_level * (leg.entry_price_changes_by / 100) * leg.fill:
+            leg.sl_price = leg.sl_price - (leg.fill * (leg.change_sl_by / 100))
+            await self.dprint(
+                f"[{leg.name.upper()}] Price dip detected - Adjusting trailing parameters"
+                f"\nFill Price: {leg.fill}"
+                f"\nCurrent Premium: {premium_price['ask']}"
+                f"\nNew SL: {leg.sl_price}"
+                f"\nTemp value: {leg.trail_level}",
+                leg=leg.name, event="trail_tighten", prices=premium_price, order_id=leg.stp_id
+            )
+            await self.broker.modify_stp_order(contract=leg.contract, side="BUY",
+                                               quantity=leg.quantity, sl=leg.sl_price,
+                                               order_id=leg.stp_id)
+            leg.trail_activated = True
+            leg.trail_level += 1
+            self._journal_leg(leg)
+
+    def stop_adjustment(self, leg):
+        """
+        The next trailing step as IB adjustable stop fields, or None when trailing is client-side.\n
+        "adjust": when the ask reaches the step's trigger TWS moves the stop to the step's stop
+        price and we arm the step after it. "trail": the first step turns the stop into a TWS
+        trailing stop (trailing amount = step stop - trigger), which then follows the ask with
+        no further client involvement; it equals the ladder at every step and is tighter in
+        between.\n
+        """
+        if not self.native_trailing or (self.native_trailing == "trail" and leg.trail_activated):
+            return None
+        trigger, stop = leg.next_rung()
+        if trigger <= 0:
+            return {}
+        adjust = {"triggerPrice": trigger, "adjustedOrderType": "STP", "adjustedStopPrice": stop}
+        if self.native_trailing == "trail":
+            adjust.update(adjustedOrderType="TRAIL", adjustedTrailingAmount=round(stop - trigger, 2),
+                          adjustableTrailingUnit=0)
+        return adjust
+
+    def _stop_adjusted_callback(self, leg):
+        async def on_adjusted(order_id, trade):
+            if order_id != leg.stp_id or not leg.placed:
+                return
+            _, stop = leg.next_rung()
+            leg.sl_price = trade.order.auxPrice if trade.order.orderType == "STP" else stop
+            leg.trail_activated = True
+            leg.trail_level += 1
+            self._journal_leg(leg)
+            await self.dprint(
+                f"[{leg.name.upper()}] Broker adjusted the stop"
+                f"\nFill Price: {leg.fill}"
+                f"\nNew SL: {leg.sl_price} ({trade.order.orderType})"
+                f"\nTemp value: {leg.trail_level}",
+                leg=leg.name, event="trail_tighten", order_id=order_id
+            )
+            adjust = self.stop_adjustment(leg)
+            if adjust is not None:
+                await self.broker.modify_stp_order(contract=leg.contract, side="BUY", quantity=leg.quantity,
+                                                   sl=leg.sl_price, order_id=leg.stp_id, adjust=adjust)
+
+        return on_adjusted
+
+    def _watch_stop(self, leg):
+        self.broker.stop_outs.watch(leg.stp_id, leg.contract, self._stop_out_callback(leg))
+        if self.native_trailing:
+            self.broker.stops.on_adjusted(leg.stp_id, self._stop_adjusted_callback(leg))
+
+    async def select_strikes(self, legs, closest_strike, hedges, spot=None):
+        """
+        Re-picks the strike of every leg with a delta / premium target (and its hedge's, with ``hedges``)
+        from one snapshot of the strike window around ``closest_strike``.\n
+        Given the index ``spot`` (re-entry), the forward comes from it instead of put-call parity and
+        only the legs' own right within ``greeks_reselect_window`` strikes of their current strikes is
+        snapshotted.\n
+        """
+        targets = [leg for leg in legs if leg.by_greeks or (hedges and leg.hedge_by_greeks)]
+        if not targets:
+            return
+        now = self.now()
+        expiry = now.replace(hour=credentials.expiry_hour, minute=0, second=0, microsecond=0)
+        t = years_to(expiry, now)
+        if spot is None:
+            window = credentials.greeks_strike_window
+            # Both rights, so the forward can be implied from put-call parity
+            frame = await self.broker.chain.snapshot(credentials.instrument, credentials.date,
+                                                     low=self.strikes.step(closest_strike, -window),
+                                                     high=self.strikes.step(closest_strike, window))
+            forward = None
+        else:
+            window = credentials.greeks_reselect_window
+            near = [leg.strike for leg in targets if leg.strike is not None] + [
+                leg.hedge_strike for leg in targets if hedges and leg.hedge_strike is not None] or [closest_strike]
+            frame = await self.broker.chain.snapshot(credentials.instrument, credentials.date,
+                                                     low=self.strikes.step(min(near), -window),
+                                                     high=self.strikes.step(max(near), window),
+                                                     rights=tuple({leg.right for leg in targets}))
+            forward = spot * math.exp(credentials.risk_free_rate * t)
+        started = time.perf_counter()
+        chain = chain_greeks(frame, t, forward=forward, rate=credentials.risk_free_rate)
+        await self.lprint("[GREEKS] %d options, forward %.2f, evaluated in %.2f ms", len(chain),
+                          chain.attrs['forward'], (time.perf_counter() - started) * 1000, event="greeks")
+        for leg in targets:
+            if leg.by_greeks:
+                strike = pick_strike(chain, leg.right, leg.delta, leg.premium)
+                if strike is not None:
+                    leg.strike = strike
+            if hedges and leg.hedge_by_greeks:
+                strike = pick_strike(chain, leg.right, leg.hedge_delta, leg.hedge_premium)
+                if strike is not None:
+                    leg.hedge_strike = strike
+            row = chain[(chain['strike'] == leg.strike) & (chain['right'] == leg.right)]
+            if not row.empty:
+                await self.dprint(f"{leg.label} strike {leg.strike} by greeks: delta {row['delta'].iloc[0]:.3f} "
+                                  f"iv {row['iv'].iloc[0]:.1%} mid {row['mid'].iloc[0]}")
+
+    async def _check_reentry(self, leg) -> bool:
+        """
+        Re-enters a stopped leg once its premium is back at or below the original fill; True if it did
+        """
+        label = leg.label
+        if self._is_reentry_blocked(leg):
+            await self.lprint(
+                f"[RE-ENTRY] {label} re-entry ending: {self.first_sl_leg.capitalize()} stop was hit first, "
+                f"so only {self.first_sl_leg.capitalize()} may re-enter."
+            )
+            await self.dprint(f"{label} re-entry blocked because {self.first_sl_leg} SL was hit first.")
+            leg.done = True
+            self._journal_leg(leg)
+            return False
+        await self.dprint(f"Checking for {leg.name} re-entry")
+        premium_price = await self.broker.get_latest_premium_price(
             symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=self.call_target_price,
-            right='C',
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
+            expiry=credentials.date,
+            strike=leg.strike,
+            right=leg.right
         )
+        await self.lprint("%s Sell Leg Re-entry Premium: %s", label, premium_price, level=logging.DEBUG,
+                          leg=leg.name, event="reentry_premium", prices=premium_price)
+        if premium_price['ask'] <= leg.fill and leg.reentries < credentials.number_of_re_entry:
+            await self.dprint(
+                f"[{leg.name.upper()}] Entry condition met - Initiating new position"
+                f"\nCurrent Premium: {premium_price['bid']}"
+                f"\nEntry Price: {leg.fill}"
+                f"\nStrike Price: {leg.strike}"
+                f"\nReentry Count: {leg.reentries + 1}"
+            )
+            leg.reentries += 1
+            if credentials.reselect_on_reentry and (leg.by_greeks or leg.hedge_by_greeks):
+                spot = await self.broker.index_price(credentials.instrument, credentials.exchange)
+                await self.select_strikes([leg], self.strikes.nearest(spot), spot=spot,
+                                          hedges=self.close_and_open_hedges_with_position)
+            self._journal_leg(leg)
+            await self.dprint(f"Number of re-entries happened: {leg.reentries}")
+            await self.enter_legs([leg], hedges=self.close_and_open_hedges_with_position)
+            return True
 
-        qualified_contracts = self.broker.client.qualifyContracts(self.call_contract)
-        if not qualified_contracts:
-            raise ValueError("Failed to qualify contract with IBKR.")
-        print('last price is', premium_price['last'])
+        if not leg.reentries < credentials.number_of_re_entry:
+            await self.dprint(f"{label} re-entry limit reached")
+            leg.done = True
+            self._journal_leg(leg)
+        return False
 
+    async def close_all_positions(self, test):
+        if credentials.close_positions and not test:
+            return
+        if not test:
+            await self.wait_until(self.now().replace(
+                hour=credentials.exit_hour,
+                minute=credentials.exit_minute,
+                second=credentials.exit_second,
+                microsecond=0), "Exit")
+        self.should_continue = False
+        # Wake the leg scheduler so it sees should_continue straight away
+        self._wake.set()
+
+        if self.fast_flatten:
+            await self.flatten()
+            return
+        for leg in self.legs:
+            if leg.order_id:
+                print(f"atm {leg.name} id: {leg.order_id}")
+                self.broker.stop_outs.unwatch(leg.stp_id)
+                await self.broker.cancel_order(leg.stp_id)
+                await self.broker.cancel_order(leg.order_id)
         try:
-            k, self.atm_call_fill, self.atm_call_id = await self.broker.place_market_order(contract=self.call_contract,
-                                                                                           qty=credentials.call_position,
-                                                                                           side="SELL")
-            while self.should_continue:
-                open_orders = await self.broker.get_open_orders()
-                matching_order = next((trade for trade in open_orders if trade.order.orderId == self.atm_call_id), None)
-
-                if matching_order:
-                    self.atm_call_fill = matching_order.orderStatus.avgFillPrice
-                    if self.atm_call_fill > 0:
-                        print(f"Call Position {self.atm_call_id} is filled.")
-                        break
-                    else:
-                        print("Call Position still open but not filled")
-                else:
-                    print(
-                        f"Call Position {self.atm_call_id} is no longer in open orders — might be cancelled or filled.")
-                    break
-
-                await asyncio.sleep(1)
-
-            self.call_order_placed = True
-            self.call_trail_activated = False
-            self.atm_call_sl = self.atm_call_fill * (1 + (self.call_percent / 100))
-            await self.dprint(f"Call Order placed at {self.atm_call_fill}")
-            await self.dprint(f"Call Order sl is {self.atm_call_sl}")
-            await asyncio.sleep(1)
-            self.call_stp_id = await self.broker.place_stp_order(contract=self.call_contract, side="BUY",
-                                                                 quantity=credentials.call_position,
-                                                                 sl=self.atm_call_sl)
+            await self.close_legs(self.legs)
+            await self.dprint("All position closed")
         except Exception as e:
-            await self.dprint(f"Error in placing sell side call order: {str(e)}")
-
-    async def call_hedge_check(self):
-        while self.should_continue:
-            if self.call_order_placed:
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.call_target_price,
-                    right="C"
-                )
-                await self.lprint(f"Call Hedge Premium: {premium_price}")
-                open_trades = await self.broker.get_positions()
-
-                call_exists = any(
-                    trade.contract.secType == 'OPT' and trade.contract.right == 'C' and
-                    trade.contract.symbol == credentials.instrument and trade.contract.strike == self.call_target_price
-                    for trade in open_trades
-                )
-
-                if not call_exists and self.should_continue:
-                    controlling_leg = await self._register_stop_loss_hit("call")
-                    if not self._first_sl_reentry_lock_enabled():
-                        await self.lprint(
-                            "[CALL SL] Call leg stopped out. First-stop re-entry restriction is disabled, "
-                            "so Call and Put may continue managing re-entry independently."
-                        )
-                    elif controlling_leg == "call":
-                        await self.lprint(
-                            "[CALL SL] Call leg stopped out first. "
-                            f"Re-entry: only Call allowed, up to {credentials.number_of_re_entry} times "
-                            f"(completed so far: {self.call_rentry}). Put re-entry is blocked for this session."
-                        )
-                    else:
-                        await self.lprint(
-                            "[CALL SL] Call leg stopped out, but Put had already stopped out first. "
-                            "Re-entry: only Put is allowed; Call will not re-enter."
-                        )
-                    if (
-                        self._may_move_put_sl_to_cost()
-                        and self.put_order_placed
-                        and self.put_stp_id
-                        and self.put_contract is not None
-                        and self.atm_put_fill is not None
-                    ):
-                        self.atm_put_sl = round(self.atm_put_fill, 1)
-                        await self.broker.modify_stp_order(
-                            contract=self.put_contract,
-                            side="BUY",
-                            quantity=credentials.put_position,
-                            sl=self.atm_put_sl,
-                            order_id=self.put_stp_id
-                        )
-                        await self.lprint(
-                            f"[MOVE-TO-COST] Put stop moved to entry/cost price {self.atm_put_sl} "
-                            "(allowed because Put trailing had not started yet, or respect-trailing is False)."
-                        )
-                        await self.dprint(
-                            f"[PUT] Opposite leg SL moved to cost: {self.atm_put_sl}"
-                        )
-                    elif (
-                        credentials.opposite_leg_move_to_cost
-                        and self.put_order_placed
-                        and self.put_trail_activated
-                        and credentials.opposite_leg_move_to_cost_respect_trailing
-                    ):
-                        await self.lprint(
-                            "[MOVE-TO-COST] Put stop not changed: Put trailing SL had already tightened and "
-                            "respect_trailing is True."
-                        )
-                        await self.dprint(
-                            "[PUT] Move-to-cost skipped: put trailing SL already adjusted"
-                        )
-                    elif not credentials.opposite_leg_move_to_cost:
-                        await self.lprint(
-                            "[MOVE-TO-COST] Put stop not changed: move_opposite_leg_to_cost is False in credentials."
-                        )
-                    elif credentials.opposite_leg_move_to_cost:
-                        await self.lprint(
-                            "[MOVE-TO-COST] Put stop not changed: Put not open, or no stop order / fill data — "
-                            "nothing to modify."
-                        )
-                    self.call_order_placed = False
-                    self.call_stp_id = None
-                    if self.close_and_open_hedges_with_position:
-                        await self.close_open_hedges(close_call=True, close_put=False)
-                    await self.dprint(
-                        f"[CALL] Stop loss triggered - Executing market buy"
-                        f"\nCurrent Premium: {premium_price['mid']}"
-                        f"\nStop Loss Level: {self.atm_call_sl}"
-                        f"\nStrike Price: {self.call_target_price}"
-                        f"\nPosition Size: {credentials.call_position}"
-                    )
-                    continue
+            await self.dprint(e)
+
+    async def flatten(self):
+        """
+        Exits through the broker's flatten engine: every working order cancelled and the open legs (with
+        their hedges when hedges close with positions) closed concurrently
+        """
+        con_ids = set()
+        for leg in self.legs:
+            self.broker.stop_outs.unwatch(leg.stp_id)
+            if leg.placed:
+                con_ids.add(leg.contract.conId)
+                if self.close_and_open_hedges_with_position and leg.has_hedge:
+                    hedge = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                               leg.hedge_strike, leg.right)
+                    con_ids.add(hedge.conId)
+        report = await self.broker.flatten(con_ids)
+        await self.dprint(str(report))
+        return report
+
+    async def close_legs(self, legs):
+        open_legs = [leg for leg in legs if leg.placed]
+        if self.combo_orders == "all" and open_legs:
+            await self.close_combo(open_legs)
+        elif self.combo_orders:
+            await asyncio.gather(*(self.close_combo([leg]) for leg in open_legs))
+        else:
+            await asyncio.gather(*(self.close_leg(leg) for leg in legs))
+
+    async def close_combo(self, legs):
+        """
+        Buys back ``legs`` (selling their hedges too when hedges close with positions) in one combo order
+        """
+        parts = []
+        for leg in legs:
+            parts.append((leg.contract, "BUY", leg.quantity))
+            if self.close_and_open_hedges_with_position and leg.has_hedge:
+                hedge = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                           leg.hedge_strike, leg.right)
+                parts.append((hedge, "SELL", leg.hedge_quantity))
+        if len(parts) == 1:
+            return await self.close_leg(legs[0])
+        trade, _, _ = await self.broker.place_combo_order(parts)
+        await self._confirm_fill(trade, " + ".join(leg.label for leg in legs) + " exit combo")
+
+    async def close_leg(self, leg):
+        if leg.placed:
+            await self.broker.close_leg(leg.right, leg.strike, leg.quantity, leg.hedge_strike, leg.hedge_quantity,
+                                        close_hedge=self.close_and_open_hedges_with_position)
+
+    async def _confirm_fill(self, trade, label):
+        while True:
+            fill = await self.broker.wait_for_fill(trade)
+            if fill["filled"]:
+                print(f"{label} {fill['order_id']} is filled.")
+                break
+            if trade.isDone() or not self.should_continue:
+                print(f"{label} {fill['order_id']} is {fill['status']} — not filled.")
+                break
+            print(f"{label} still open but not filled")
+        await self.lprint(
+            "%s fill: %s commission: %s latency: %.1f ms", label, fill["avg_price"], fill["commission"],
+            fill["latency"] * 1000, event="fill", order_id=fill["order_id"], prices=fill
+        )
+        return fill["avg_price"]
+
+    async def place_hedge_orders(self, legs):
+        for leg in legs:
+            if not leg.has_hedge:
+                continue
+            contract = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                          leg.hedge_strike, leg.right)
+            try:
+                await self.dprint(f"Placing Hedge {leg.label} Order")
+                m, leg.hedge_fill, leg.hedge_id = await self.broker.place_market_order(
+                    contract=contract,
+                    qty=leg.hedge_quantity, side="BUY")
 
-            await asyncio.sleep(1)
+                leg.hedge_fill = await self._confirm_fill(m, f"{leg.label} hedge")
+                self._journal_leg(leg)
 
-    async def call_trail_check(self):
-        temp_percentage = 1
-        while self.should_continue:
-            if self.call_order_placed:
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.call_target_price,
-                    right="C"
-                )
-                await self.lprint(f"Call Sell Leg Premium: {premium_price}")
-                if premium_price['ask'] <= self.atm_call_fill - temp_percentage * (
-                        credentials.call_entry_price_changes_by / 100) * self.atm_call_fill:
-                    self.atm_call_sl = self.atm_call_sl - (self.atm_call_fill * (credentials.call_change_sl_by / 100))
-                    await self.dprint(
-                        f"[CALL] Price dip detected - Adjusting trailing parameters"
-                        f"\nFill Price: {self.atm_call_fill}"
-                        f"\nCurrent Premium: {premium_price['ask']}"
-                        f"\nNew SL: {self.atm_call_sl}"
-                        f"\nTemp value: {temp_percentage}"
-                    )
-                    await self.broker.modify_stp_order(contract=self.call_contract, side="BUY",
-                                                       quantity=credentials.call_position, sl=self.atm_call_sl,
-                                                       order_id=self.call_stp_id)
-                    self.call_trail_activated = True
-                    temp_percentage += 1
-
-                await asyncio.sleep(credentials.call_check_time)
-            else:
-                if self._is_reentry_blocked("call"):
-                    await self.lprint(
-                        "[RE-ENTRY] Call re-entry task ending: Put stop was hit first, so only Put may re-enter."
-                    )
-                    await self.dprint("Call re-entry blocked because put SL was hit first.")
-                    return
-                await self.dprint("Checking for call re-entry")
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.call_target_price,
-                    right="C"
-                )
-                await self.lprint(f"Call Sell Leg Re-entry Premium: {premium_price}")
-                if premium_price['ask'] <= self.atm_call_fill and self.call_rentry < credentials.number_of_re_entry:
-                    await self.dprint(
-                        f"[CALL] Entry condition met - Initiating new position"
-                        f"\nCurrent Premium: {premium_price['bid']}"
-                        f"\nEntry Price: {self.atm_call_fill}"
-                        f"\nStrike Price: {self.call_target_price}"
-                        f"\nReentry Count: {self.call_rentry + 1}"
-                    )
-                    self.call_rentry += 1
-                    await self.dprint(f"Number of re-entries happened: {self.call_rentry}")
-                    if self.close_and_open_hedges_with_position:
-                        await self.place_hedge_orders(call=True, put=False)
-                    await self.place_atm_call_order()
-                    temp_percentage = 1
-                    self.call_order_placed = True
+            except Exception as e:
+                await self.dprint(f"Error placing {leg.name} hedge order: {str(e)}")
+
+    async def close_open_hedges(self, legs):
+        for leg in legs:
+            if not leg.has_hedge:
+                continue
+            contract = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                          leg.hedge_strike, leg.right)
+            try:
+                await self.broker.place_market_order(contract=contract, qty=leg.hedge_quantity, side="SELL")
+                await self.dprint(f"Closing {leg.label} Hedge")
+            except Exception as e:
+                await self.dprint(f"Error closing {leg.name} hedge: {str(e)}")
+
+    async def enter_legs(self, legs, hedges):
+        """
+        Opens ``legs``, buying their hedges first when ``hedges``: one order per contract, or with
+        credentials.combo_orders one combo order per leg and hedge ("vertical") or for everything ("all")
+        """
+        if self.combo_orders == "all":
+            await self.place_combo_entry(legs, hedges)
+        elif self.combo_orders:
+            await asyncio.gather(*(self.place_combo_entry([leg], hedges) for leg in legs))
+        else:
+            if hedges:
+                await self.place_hedge_orders(legs)
+            for leg in legs:
+                await self.place_leg_order(leg)
+
+    async def place_combo_entry(self, legs, hedges):
+        """
+        Sells ``legs`` (and buys their hedges when ``hedges``) as one combo order: a single placement and
+        fill wait, no legging risk. Each leg's own fill price comes from the combo's leg executions.\n
+        """
+        parts = []
+        hedge_contracts = {}
+        for leg in legs:
+            leg.contract = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                              leg.strike, leg.right)
+            if hedges and leg.has_hedge:
+                hedge_contracts[leg.name] = await self.broker.contracts.option(
+                    credentials.instrument, credentials.date, leg.hedge_strike, leg.right)
+                parts.append((hedge_contracts[leg.name], "BUY", leg.hedge_quantity))
+            parts.append((leg.contract, "SELL", leg.quantity))
+        if len(parts) == 1:
+            return await self.place_leg_order(legs[0])
+        label = " + ".join(leg.label for leg in legs) + " combo"
+        try:
+            await self.dprint(f"Placing {label} order")
+            trade, _, order_id = await self.broker.place_combo_order(parts)
+            await self._confirm_fill(trade, label)
+            prices = self.broker.leg_fill_prices(trade)
+            filled = []
+            for leg in legs:
+                if leg.name in hedge_contracts:
+                    leg.hedge_id = order_id
+                    leg.hedge_fill = prices.get(hedge_contracts[leg.name].conId)
+                if leg.contract.conId not in prices:
+                    await self.dprint(f"{leg.label} was not filled by the {label} order")
                     continue
+                leg.order_id = order_id
+                leg.fill = prices[leg.contract.conId]
+                filled.append(leg)
+            await asyncio.gather(*(self._protect_leg(leg) for leg in filled))
+        except Exception as e:
+            await self.dprint(f"Error placing {label} order: {str(e)}")
 
-                if not self.call_rentry < credentials.number_of_re_entry:
-                    await self.dprint("Call re-entry limit reached")
-                    return
-
-                await asyncio.sleep(credentials.call_reentry_time)
-
-    async def place_atm_put_order(self):
+    async def place_leg_order(self, leg):
         premium_price = await self.broker.get_latest_premium_price(
             symbol=credentials.instrument,
             expiry=credentials.date,
-            strike=self.put_target_price,
-            right="P"
-        )
-        self.put_contract = Option(
-            symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=self.put_target_price,
-            right='P',
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
+            strike=leg.strike,
+            right=leg.right
         )
+        leg.contract = await self.broker.contracts.option(credentials.instrument, credentials.date,
+                                                          leg.strike, leg.right)
 
-        qualified_contracts = self.broker.client.qualifyContracts(self.put_contract)
-        if not qualified_contracts:
-            raise ValueError("Failed to qualify contract with IBKR.")
         print('last price is', premium_price['last'])
 
         try:
-            k, self.atm_put_fill, self.atm_put_id = await self.broker.place_market_order(contract=self.put_contract,
-                                                                                         qty=credentials.put_position,
-                                                                                         side="SELL")
-
-            while self.should_continue:
-                open_orders = await self.broker.get_open_orders()
-                matching_order = next((trade for trade in open_orders if trade.order.orderId == self.atm_put_id), None)
-
-                if matching_order:
-                    self.atm_put_fill = matching_order.orderStatus.avgFillPrice
-                    if self.atm_put_fill > 0:
-                        print(f"Put Position {self.atm_put_id} is filled.")
-                        break
-                    else:
-                        print("Put Position still open but not filled")
-                else:
-                    print(
-                        f"Put Position {self.atm_put_id} is no longer in open orders — might be cancelled or filled."
-                    )
-                    break
-
-                await asyncio.sleep(1)
-
-            self.put_order_placed = True
-            self.put_trail_activated = False
-            self.atm_put_sl = self.atm_put_fill * (1 + (self.put_percent / 100))
-            await self.dprint(f"Put Order placed at {self.atm_put_fill}")
-            await self.dprint(f"Put Order sl is {self.atm_put_sl}")
-            await asyncio.sleep(1)
-            self.put_stp_id = await self.broker.place_stp_order(contract=self.put_contract, side="BUY",
-                                                                quantity=credentials.put_position,
-                                                                sl=self.atm_put_sl)
+            k, leg.fill, leg.order_id = await self.broker.place_market_order(contract=leg.contract,
+                                                                             qty=leg.quantity,
+                                                                             side="SELL")
+            leg.fill = await self._confirm_fill(k, f"{leg.label} Position")
+            await self._protect_leg(leg)
         except Exception as e:
-            await self.dprint(f"Error in placing sell side put order: {str(e)}")
-
-    async def put_hedge_check(self):
-        while self.should_continue:
-            if self.put_order_placed:
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.put_target_price,
-                    right="P"
-                )
-                await self.lprint(f"Put Hedge Premium: {premium_price}")
-                open_trades = await self.broker.get_positions()
-
-                put_exists = any(
-                    trade.contract.secType == 'OPT' and trade.contract.right == 'P' and
-                    trade.contract.symbol == credentials.instrument and trade.contract.strike == self.put_target_price
-                    for trade in open_trades
-                )
-
-                if not put_exists and self.should_continue:
-                    controlling_leg = await self._register_stop_loss_hit("put")
-                    if not self._first_sl_reentry_lock_enabled():
-                        await self.lprint(
-                            "[PUT SL] Put leg stopped out. First-stop re-entry restriction is disabled, "
-                            "so Call and Put may continue managing re-entry independently."
-                        )
-                    elif controlling_leg == "put":
-                        await self.lprint(
-                            "[PUT SL] Put leg stopped out first. "
-                            f"Re-entry: only Put allowed, up to {credentials.number_of_re_entry} times "
-                            f"(completed so far: {self.put_rentry}). Call re-entry is blocked for this session."
-                        )
-                    else:
-                        await self.lprint(
-                            "[PUT SL] Put leg stopped out, but Call had already stopped out first. "
-                            "Re-entry: only Call is allowed; Put will not re-enter."
-                        )
-                    if (
-                        self._may_move_call_sl_to_cost()
-                        and self.call_order_placed
-                        and self.call_stp_id
-                        and self.call_contract is not None
-                        and self.atm_call_fill is not None
-                    ):
-                        self.atm_call_sl = round(self.atm_call_fill, 1)
-                        await self.broker.modify_stp_order(
-                            contract=self.call_contract,
-                            side="BUY",
-                            quantity=credentials.call_position,
-                            sl=self.atm_call_sl,
-                            order_id=self.call_stp_id
-                        )
-                        await self.lprint(
-                            f"[MOVE-TO-COST] Call stop moved to entry/cost price {self.atm_call_sl} "
-                            "(allowed because Call trailing had not started yet, or respect-trailing is False)."
-                        )
-                        await self.dprint(
-                            f"[CALL] Opposite leg SL moved to cost: {self.atm_call_sl}"
-                        )
-                    elif (
-                        credentials.opposite_leg_move_to_cost
-                        and self.call_order_placed
-                        and self.call_trail_activated
-                        and credentials.opposite_leg_move_to_cost_respect_trailing
-                    ):
-                        await self.lprint(
-                            "[MOVE-TO-COST] Call stop not changed: Call trailing SL had already tightened and "
-                            "respect_trailing is True."
-                        )
-                        await self.dprint(
-                            "[CALL] Move-to-cost skipped: call trailing SL already adjusted"
-                        )
-                    elif not credentials.opposite_leg_move_to_cost:
-                        await self.lprint(
-                            "[MOVE-TO-COST] Call stop not changed: move_opposite_leg_to_cost is False in credentials."
-                        )
-                    elif credentials.opposite_leg_move_to_cost:
-                        await self.lprint(
-                            "[MOVE-TO-COST] Call stop not changed: Call not open, or no stop order / fill data — "
-                            "nothing to modify."
-                        )
-                    self.put_order_placed = False
-                    self.put_stp_id = None
-                    if self.close_and_open_hedges_with_position:
-                        await self.close_open_hedges(close_call=False, close_put=True)
-                    await self.dprint(
-                        f"[PUT] Stop loss triggered - Executing market buy"
-                        f"\nCurrent Premium: {premium_price['mid']}"
-                        f"\nStop Loss Level: {self.atm_put_sl}"
-                        f"\nStrike Price: {self.put_target_price}"
-                        f"\nPosition Size: {credentials.put_position}"
-                    )
-                    continue
-
-            await asyncio.sleep(1)
-
-    async def put_trail_check(self):
-        temp_percentage = 1
-        while self.should_continue:
-            if self.put_order_placed:
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.put_target_price,
-                    right="P"
-                )
-                await self.lprint(f"Put Sell Leg Premium: {premium_price}")
-                if premium_price['ask'] <= self.atm_put_fill - temp_percentage * (
-                        credentials.put_entry_price_changes_by / 100) * self.atm_put_fill:
-                    self.atm_put_sl = self.atm_put_sl - (self.atm_put_fill * (credentials.put_change_sl_by / 100))
-                    await self.dprint(
-                        f"[PUT] Price dip detected - Adjusting trailing parameters"
-                        f"\nFill Price: {self.atm_put_fill}"
-                        f"\nCurrent Premium: {premium_price['ask']}"
-                        f"\nNew SL: {self.atm_put_sl}"
-                        f"\nTemp value: {temp_percentage}"
-                    )
-                    await self.broker.modify_stp_order(contract=self.put_contract, side="BUY",
-                                                       quantity=credentials.put_position, sl=self.atm_put_sl,
-                                                       order_id=self.put_stp_id)
-                    self.put_trail_activated = True
-                    temp_percentage += 1
-
-                await asyncio.sleep(credentials.put_check_time)
-            else:
-                if self._is_reentry_blocked("put"):
-                    await self.lprint(
-                        "[RE-ENTRY] Put re-entry task ending: Call stop was hit first, so only Call may re-enter."
-                    )
-                    await self.dprint("Put re-entry blocked because call SL was hit first.")
-                    return
-                await self.dprint("Checking for put re-entry")
-                premium_price = await self.broker.get_latest_premium_price(
-                    symbol=credentials.instrument,
-                    expiry=credentials.date,
-                    strike=self.put_target_price,
-                    right="P"
-                )
-                await self.lprint(f"Put Sell Leg Re-entry Premium: {premium_price}")
-                if premium_price['ask'] <= self.atm_put_fill and self.put_rentry < credentials.number_of_re_entry:
-                    await self.dprint(
-                        f"[PUT] Entry condition met - Initiating new position"
-                        f"\nCurrent Premium: {premium_price['bid']}"
-                        f"\nEntry Price: {self.atm_put_fill}"
-                        f"\nStrike Price: {self.put_target_price}"
-                        f"\nReentry Count: {self.put_rentry + 1}"
-                    )
-                    self.put_rentry += 1
-                    await self.dprint(f"Number of re-entries happened: {self.put_rentry}")
-                    if self.close_and_open_hedges_with_position:
-                        await self.place_hedge_orders(call=False, put=True)
-                    await self.place_atm_put_order()
-                    temp_percentage = 1
-                    self.put_order_placed = True
-                    continue
-
-                if not self.put_rentry < credentials.number_of_re_entry:
-                    await self.dprint("Put re-entry limit reached")
-                    return
-
-                await asyncio.sleep(credentials.put_reentry_time)
+            await self.dprint(f"Error in placing sell side {leg.name} order: {str(e)}")
+
+    async def _protect_leg(self, leg):
+        """
+        Starts managing a freshly filled short leg: stop order, stop-out watch and premium stream
+        """
+        leg.placed = True
+        leg.trail_activated = False
+        leg.trail_level = 1
+        leg.sl_price = leg.fill * (1 + (leg.sl / 100))
+        self._journal_leg(leg)
+        # The fill is confirmed: protect the leg before anything else
+        leg.stp_id = await self.broker.place_stp_order(contract=leg.contract, side="BUY",
+                                                       quantity=leg.quantity,
+                                                       sl=leg.sl_price,
+                                                       adjust=self.stop_adjustment(leg))
+        leg.stopped = False
+        self._watch_stop(leg)
+        self._journal_leg(leg)
+        await self.broker.watch_premium(credentials.instrument, credentials.date, leg.strike, leg.right)
+        await self.dprint(f"{leg.label} Order placed at {leg.fill}")
+        await self.dprint(f"{leg.label} Order sl is {leg.sl_price}")
+
+
+def shared_strategies(specs):
+    """
+    Strategy instances for credentials.strategies, all on one BrokerHub connection
+    """
+    hub = BrokerHub(creds, ib_factory=ib_simulator.shared() if credentials.use_simulator else None)
+    return [
+        Strategy(broker=hub.view(spec["name"], spec.get("account", "")),
+                 legs=[Leg(**leg) for leg in spec["legs"]] if spec.get("legs") else None,
+                 name=spec["name"])
+        for spec in specs
+    ]
 
 
 if __name__ == "__main__":
-    s = Strategy()
-    asyncio.run(s.main())
+    if credentials.strategies:
+        asyncio.run(run_strategies(shared_strategies(credentials.strategies)))
+    else:
+        s = Strategy()
+        asyncio.run(s.main())
@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import os
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LEGS = {"C": "call", "P": "put"}
+
+
+class Histogram:
+    """
+    Cumulative latency histogram in the Prometheus layout (count per upper bound, sum, count)
+    """
+
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+
+class Metrics:
+    """
+    Call counts, error counts and latency histograms per broker method and leg,
+    plus gauges read on demand (event loop queue depth, market data lines).\n
+    Nothing is wrapped until ``instrument`` is called, so with metrics disabled the
+    broker methods run untouched. Exposed as Prometheus text through ``serve``
+    (a tiny local HTTP endpoint) and/or ``dump_every`` (periodic file write).\n
+    """
+
+    def __init__(self, prefix: str = "spx"):
+        self.prefix = prefix
+        self.histograms = {}  # (method, leg) -> Histogram
+        self.gauges = {}  # name -> (help, callable)
+        self._server = None
+        self._dump_task = None
+
+    def observe(self, method: str, leg: str, seconds: float, error: bool = False):
+        hist = self.histograms.get((method, leg))
+        if hist is None:
+            hist = self.histograms[(method, leg)] = Histogram()
+        hist.observe(seconds, error)
+
+    def gauge(self, name: str, help_text: str, read):
+        self.gauges[name] = (help_text, read)
+
+    def instrument(self, obj, methods):
+        """
+        Replaces each named coroutine method of ``obj`` (on the instance only) with a timed wrapper
+        """
+        for name in methods:
+            setattr(obj, name, self._timed(name, getattr(obj, name)))
+
+    def _timed(self, name, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                self.observe(name, _leg(args, kwargs), time.perf_counter() - start, error)
+
+        return wrapper
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_broker_call_seconds Latency of IBTWSAPI calls",
+            f"# TYPE {p}_broker_call_seconds histogram",
+        ]
+        for (method, leg), hist in sorted(self.histograms.items()):
+            labels = f'method="{method}",leg="{leg}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), hist.counts):
+                cumulative += n
+                lines.append(f'{p}_broker_call_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{p}_broker_call_seconds_sum{{{labels}}} {hist.total:.6f}")
+            lines.append(f"{p}_broker_call_seconds_count{{{labels}}} {hist.count}")
+        lines += [f"# HELP {p}_broker_call_errors_total IBTWSAPI calls that raised",
+                  f"# TYPE {p}_broker_call_errors_total counter"]
+        for (method, leg), hist in sorted(self.histograms.items()):
+            lines.append(f'{p}_broker_call_errors_total{{method="{method}",leg="{leg}"}} {hist.errors}')
+        for name, (help_text, read) in self.gauges.items():
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serves ``render()`` to any HTTP GET on host:port (point Prometheus at http://host:port/metrics)
+        """
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.render().encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+                await writer.drain()
+            except Exception:
+                pass
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_server(handle, host, port)
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+    def dump_every(self, path: str, interval: float):
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                self.dump(path)
+
+        self._dump_task = asyncio.ensure_future(run())
+
+    def dump(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def close(self, path: str = None):
+        if self._server:
+            self._server.close()
+            self._server = None
+        if self._dump_task:
+            self._dump_task.cancel()
+            self._dump_task = None
+        if path:
+            self.dump(path)
+
+
+def _leg(args, kwargs) -> str:
+    """
+    "call"/"put" from a contract or right argument, "" when the call is not tied to one
+    """
+    right = kwargs.get("right")
+    if right is None:
+        contract = kwargs.get("contract")
+        for value in (contract,) + args:
+            if isinstance(value, str) and value in LEGS:
+                right = value
+                break
+            if getattr(value, "right", None):
+                right = value.right
+                break
+    return LEGS.get(right, "") if right else ""
+
+
+def loop_queue_depth() -> int:
+    """
+    Callbacks ready to run on the event loop right now (how far behind the loop is)
+    """
+    loop = asyncio.get_event_loop()
+    return len(getattr(loop, "_ready", ()))
+
+
+metrics = Metrics()
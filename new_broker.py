@@ -1,4 +1,5 @@
 import asyncio
+import math
 import time
 
 import pytz
@@ -8,15 +9,51 @@ import credentials
 from ib_insync import *
 import pandas as pd
 
+from quote_book import QuoteBook
+from stop_out import StopOutDetector
+from contracts import ContractRegistry
+from option_chain import ChainSnapshotEngine
+from strike_index import StrikeIndex
+from tick_recorder import TickRecorder
+from metrics import metrics, loop_queue_depth
+from reconnect import ConnectionSupervisor
+from pacing import PacingGovernor, ORDERS, DATA
+from stop_manager import StopManager
+from flatten import FlattenEngine
+from clock_sync import measure_offset
+
+# Broker calls timed when credentials.enable_metrics is on
+INSTRUMENTED = ("get_latest_premium_price", "place_market_order", "place_combo_order", "place_stp_order",
+                "modify_stp_order", "get_open_orders", "get_positions", "cancel_order", "current_price",
+                "get_option_chain")
+
 
 #util.logToConsole('DEBUG')
 
 class IBTWSAPI:
 
-    def __init__(self, creds: dict):
+    def __init__(self, creds: dict, ib_factory=None):
 
         self.client = None
+        # Market data connection; the same object as client unless separate_data_connection is on
+        self.data_client = None
+        self.supervisors = []
+        # Called with the executions fetched by resync (they do not arrive as execDetailsEvent)
+        self.resync_listeners = []
         self.CREDS = creds
+        # Builds the IB client on connect; swap in ib_simulator.FakeIB to run without TWS
+        self.ib_factory = ib_factory or IB
+        self.quote_book = None
+        self.stop_outs = None
+        self.stops = None
+        self.contracts = None
+        self.chain = None
+        self.recorder = None
+        self.fills = {}
+        # Account orders are sent for ("" = the TWS default account)
+        self.account = ""
+        # Every message to TWS takes a token; orders go ahead of data requests
+        self.pacing = PacingGovernor(rate=credentials.pacing_rate, reserve=credentials.pacing_order_reserve)
 
     def _create_contract(self, contract: str, symbol: str, exchange: str, expiry: str = ..., strike: int = ...,
                          right: str = ...):
@@ -40,11 +77,90 @@ class IBTWSAPI:
         """
         # try:
         host, port = credentials.host, credentials.port
-        self.client = IB()
+        self.client = self.ib_factory()
         self.ib = self.client
         self.client.connect(host=host, port=port, clientId=self.CREDS["client_id"], timeout=60)
+        self.data_client = self.client
+        if credentials.separate_data_connection:
+            self.data_client = self.ib_factory()
+            if self.data_client is not self.client:
+                self.data_client.connect(host=host, port=port, clientId=credentials.data_client_id, timeout=60)
+        separate = self.data_client is not self.client
+        self.quote_book = QuoteBook(self.data_client, max_lines=credentials.max_market_data_lines,
+                                    stale_after=credentials.quote_stale_after)
+        self.stop_outs = StopOutDetector(self.client)
+        self.stops = StopManager(self.client, pacing=self.pacing, coalesce=credentials.stop_coalesce,
+                                 ack_timeout=credentials.stop_ack_timeout, min_tick=credentials.option_min_tick,
+                                 tick_break=credentials.option_tick_break, tick_above=credentials.option_tick_above)
+        self.contracts = ContractRegistry(self.data_client, pacing=self.pacing)
+        self.chain = ChainSnapshotEngine(self.data_client, self.contracts, concurrency=credentials.chain_concurrency,
+                                         pacing=self.pacing)
+        if credentials.record_ticks:
+            self.recorder = TickRecorder(self.data_client, f"{credentials.record_dir}/{credentials.date}")
+            self.recorder.start()
+        if credentials.auto_reconnect:
+            self.supervisors = [ConnectionSupervisor(self.client, "Order", self.CREDS["client_id"],
+                                                     lambda: self.resync(orders=True, data=not separate))]
+            if separate:
+                self.supervisors.append(ConnectionSupervisor(self.data_client, "Market data",
+                                                             credentials.data_client_id,
+                                                             lambda: self.resync(orders=False, data=True)))
+        if credentials.enable_metrics:
+            await self.start_metrics()
         print("Connected")
 
+    async def resync(self, orders=True, data=True):
+        """
+        One batched pass after a reconnect\n
+        Quote lines are re-requested; open orders, positions and executions are fetched
+        together and watched stops that executed (or went flat) meanwhile are fired.\n
+        """
+        if data:
+            await self.pacing.acquire(DATA, cost=len(self.quote_book) + 1)
+            self.data_client.reqMarketDataType(1)
+            self.quote_book.resubscribe()
+        if orders:
+            trades, positions, fills = await self.reconcile()
+            for listener in self.resync_listeners:
+                listener(fills)
+            missing = self.stop_outs.resync([t.order.orderId for t in trades], positions, fills)
+            print(f"Resynced {len(trades)} open orders, {len(positions)} positions, {len(fills)} executions")
+            for order_id in missing:
+                print(f"Stop order {order_id} is no longer open at the broker")
+
+    async def clock_offset(self):
+        """
+        (offset, uncertainty) in seconds of the TWS server clock from the local clock\n
+        """
+        return await measure_offset(self.client, samples=credentials.clock_sync_samples,
+                                    resolution=credentials.server_clock_resolution, pacing=self.pacing)
+
+    async def reconcile(self):
+        """
+        Open orders, positions and executions from the broker, fetched together\n
+        """
+        await self.pacing.acquire(ORDERS, cost=3)
+        return await asyncio.gather(self.client.reqOpenOrdersAsync(),
+                                    self.client.reqPositionsAsync(),
+                                    self.client.reqExecutionsAsync())
+
+    async def adopt(self, order_ids, positions, fills):
+        """
+        Takes over orders placed before a restart; returns the positions that are this broker's own\n
+        """
+        # Every order on this connection is ours
+        return positions
+
+    def disconnect(self):
+        for supervisor in self.supervisors:
+            supervisor.close()
+        self.supervisors = []
+        if self.data_client is not None and self.data_client is not self.client:
+            self.data_client.disconnect()
+        if self.client is not None:
+            # Never connected (e.g. a bench scenario that only needs the simulated market)
+            self.client.disconnect()
+
     def is_connected(self) -> bool:
         """
         Get the connection status\n
@@ -69,7 +185,29 @@ class IBTWSAPI:
     async def get_positions(self):
         return self.client.positions()
 
+    async def refresh_positions(self):
+        """
+        Positions straight from TWS rather than the client's event-maintained copy
+        """
+        await self.pacing.acquire(ORDERS)
+        return await self.client.reqPositionsAsync()
+
+    async def open_trades(self):
+        # Kept current by order events; no request to TWS
+        return self.client.openTrades()
+
+    async def flatten(self, con_ids=None, shorts=True, longs=True, cancel=True):
+        """
+        Cancels working orders and closes positions concurrently; see flatten.FlattenEngine. Returns its report\n
+        """
+        return await FlattenEngine(self, fill_timeout=credentials.flatten_fill_timeout,
+                                   retries=credentials.flatten_retries).run(con_ids, shorts, longs, cancel)
+
     async def get_open_orders(self):
+        return await self.pacing.merge("open_orders", self._request_open_orders)
+
+    async def _request_open_orders(self):
+        await self.pacing.acquire(DATA)
         x = self.client.reqOpenOrders()
         self.client.sleep(7)
         return x
@@ -122,9 +260,10 @@ class IBTWSAPI:
         current_datetime = dt.datetime.now(pytz.timezone("UTC"))
         return {k: sorted(ens[k]) for k in sorted(ens.keys()) if k > current_datetime.date()}
 
-    async def fetch_strikes(self, symbol, exchange, secType='STK'):
+    async def fetch_strikes(self, symbol, exchange, secType='STK', trading_class=None):
         """ STK: Stocks like AAPL
             IND: SPX and stuff
+            trading_class picks the chain (defaults to the symbol, e.g. SPXW instead of SPX)
         """
 
         if secType == 'IND':
@@ -135,53 +274,174 @@ class IBTWSAPI:
         else:
             raise ValueError(f"Unsupported secType: {secType}. Use 'IND' or 'STK'.")
 
-        qc = self.client.qualifyContracts(contract)
+        qc = self.data_client.qualifyContracts(contract)
 
-        self.client.reqMarketDataType(4)
+        self.data_client.reqMarketDataType(4)
 
-        chains = self.client.reqSecDefOptParams(contract.symbol, '', contract.secType, contract.conId)
-        chain = next(c for c in chains if c.tradingClass == symbol and c.exchange == "CBOE")
+        chains = self.data_client.reqSecDefOptParams(contract.symbol, '', contract.secType, contract.conId)
+        chain = next(c for c in chains if c.tradingClass == (trading_class or symbol) and c.exchange == "CBOE")
         strikes = chain.strikes
 
         return strikes
 
+    async def get_strike_index(self, symbol, exchange, trading_class, date, secType='IND') -> StrikeIndex:
+        """
+        Returns the strike grid of the session expiry ``date``, from the on-disk daily cache when it exists\n
+        The grid comes from the expiry's own contract details (which the chain engine keeps for its
+        snapshots), not reqSecDefOptParams: that lists the union of strikes over every expiry of the
+        trading class, including strikes that do not trade on ``date``.\n
+        """
+        path = StrikeIndex.cache_path(credentials.cache_dir, symbol, trading_class, date)
+        index = StrikeIndex.load(path)
+        if index is None:
+            contracts = await self.chain.chain_contracts(symbol, date, trading_class)
+            index = StrikeIndex(c.strike for c in contracts)
+            index.save(path)
+        return index
+
+    async def wait_for_fill(self, trade, timeout: float = None, placed_at: float = None) -> dict:
+        """
+        Waits on the trade's status events until it is filled or cancelled\n
+        Resolves as soon as the event arrives, or after ``timeout`` seconds. Commission is the sum of
+        the commission reports received by then.\n
+        """
+        if timeout is None:
+            timeout = credentials.fill_timeout
+        if placed_at is None:
+            placed_at = time.perf_counter()
+
+        if not trade.isDone():
+            done = asyncio.get_event_loop().create_future()
+
+            def on_status(t):
+                if t.isDone() and not done.done():
+                    done.set_result(True)
+
+            trade.statusEvent += on_status
+            try:
+                await asyncio.wait_for(done, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                trade.statusEvent -= on_status
+
+        result = {
+            "order_id": trade.order.orderId,
+            "status": trade.orderStatus.status,
+            "filled": trade.orderStatus.status == OrderStatus.Filled,
+            "avg_price": trade.orderStatus.avgFillPrice,
+            "commission": sum(f.commissionReport.commission for f in trade.fills if f.commissionReport),
+            "latency": time.perf_counter() - placed_at
+        }
+        self.fills[trade.order.orderId] = result
+        return result
+
+    def _place(self, contract, order):
+        """
+        Sends a strategy order, tagged with ``account``. broker_hub.BrokerView hooks in here to claim the order id
+        """
+        if self.account:
+            order.account = self.account
+        return self.client.placeOrder(contract, order)
+
     async def place_market_order(self, contract, qty, side):
         buy_order = MarketOrder(side, qty)
         print(contract)
         print(buy_order)
-        buy_trade = self.client.placeOrder(contract, buy_order)
+        await self.pacing.acquire(ORDERS)
+        placed_at = time.perf_counter()
+        buy_trade = self._place(contract, buy_order)
         print("waiting for order to be placed")
-        n = 1
-        while True:
-            if buy_trade.isDone():
-                print("Order placed successfully")
-                fill_price = buy_trade.orderStatus.avgFillPrice
-                order_id = buy_trade.order.orderId
-                print("Order ID:", order_id)
-                print("Fill price:", fill_price)
-                return buy_trade, fill_price, order_id
-            else:
-                print(f"Waiting...{contract.right}... {n} seconds")
-                n += 1
-                if n == 10:
-                    return 0, 0, buy_trade.order.orderId
-                await asyncio.sleep(1)
+        fill = await self.wait_for_fill(buy_trade, placed_at=placed_at)
+        order_id = buy_trade.order.orderId
+        if fill["filled"]:
+            print("Order placed successfully")
+            print("Order ID:", order_id)
+            print("Fill price:", fill["avg_price"])
+            print(f"Fill latency: {fill['latency'] * 1000:.1f} ms")
+            return buy_trade, fill["avg_price"], order_id
+        print(f"{contract.right} order {order_id} not filled after {fill['latency']:.1f} seconds ({fill['status']})")
+        return buy_trade, 0, order_id
+
+    async def place_combo_order(self, legs, side="BUY"):
+        """
+        Sends several option legs as one BAG market order with a single fill wait\n
+        ``legs`` are (contract, action, quantity) for a BUY of the combo; ``side="SELL"`` reverses every
+        leg. Quantities become leg ratios over their common divisor. Returns (trade, net fill price, order_id)
+        like place_market_order; the per-leg prices are in ``leg_fill_prices(trade)``.\n
+        """
+        size = math.gcd(*(int(qty) for _, _, qty in legs))
+        bag = Contract(secType="BAG", symbol=legs[0][0].symbol, currency="USD", exchange="SMART",
+                       comboLegs=[ComboLeg(conId=contract.conId, ratio=int(qty) // size, action=action,
+                                           exchange="SMART") for contract, action, qty in legs])
+        order = MarketOrder(side, size)
+        # SPX legs route to CBOE, where the combo is filled as a whole
+        order.smartComboRoutingParams = [TagValue("NonGuaranteed", "0")]
+        await self.pacing.acquire(ORDERS)
+        placed_at = time.perf_counter()
+        trade = self._place(bag, order)
+        print(f"Combo {side} {size}x " + " / ".join(f"{action} {int(qty) // size} {c.right}{c.strike}"
+                                                    for c, action, qty in legs))
+        fill = await self.wait_for_fill(trade, placed_at=placed_at)
+        if fill["filled"]:
+            print(f"Combo {fill['order_id']} filled at net {fill['avg_price']} in {fill['latency'] * 1000:.1f} ms")
+            return trade, fill["avg_price"], fill["order_id"]
+        print(f"Combo order {fill['order_id']} not filled after {fill['latency']:.1f} seconds ({fill['status']})")
+        return trade, 0, fill["order_id"]
+
+    @staticmethod
+    def leg_fill_prices(trade) -> dict:
+        """
+        Average fill price per leg conId of a combo trade, from its leg executions\n
+        """
+        filled = {}
+        for fill in trade.fills:
+            if fill.contract.secType == "BAG":
+                continue
+            qty, value = filled.get(fill.contract.conId, (0.0, 0.0))
+            filled[fill.contract.conId] = (qty + fill.execution.shares,
+                                           value + fill.execution.shares * fill.execution.price)
+        return {con_id: value / qty for con_id, (qty, value) in filled.items() if qty}
 
     async def current_price(self, symbol, exchange='CBOE'):
         spx_contract = Index(symbol, exchange)
+        if self.recorder:
+            await self.data_client.qualifyContractsAsync(spx_contract)
+            self.recorder.track(spx_contract)
 
-        market_data = self.client.reqMktData(spx_contract)
-        self.ib.sleep(2)
+        await self.pacing.acquire(DATA)
+        market_data = self.data_client.reqMktData(spx_contract)
+        self.data_client.sleep(2)
 
         print(market_data)
         while util.isNan(market_data.last):
-            self.ib.sleep(3)
+            self.data_client.sleep(3)
         if market_data.close > 0:
             return market_data.last
         else:
             print("Market data is not subscribed or unavailable for", symbol)
             return None
 
+    async def index_price(self, symbol, exchange='CBOE'):
+        """
+        Latest index level from a streaming line kept in the quote book; only the first call waits for a tick\n
+        """
+        key = QuoteBook.key(symbol, "", 0.0, "IND")
+        if key not in self.quote_book:
+            await self.pacing.acquire(DATA)
+            self.quote_book.subscribe(key, Index(symbol, exchange))
+        ticker = self.quote_book.ticker(key)
+        deadline = time.monotonic() + 5
+        while util.isNan(ticker.last) and time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(ticker.updateEvent, deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        if util.isNan(ticker.last):
+            # No stream yet (e.g. a data line could not be had): fall back to the blocking request
+            return await self.current_price(symbol, exchange)
+        return ticker.last
+
     async def get_stock_price(self, symbol, exchange='SMART'):
         stock_contract = Stock(symbol, exchange, 'USD')
         self.client.qualifyContracts(stock_contract)
@@ -197,34 +457,14 @@ class IBTWSAPI:
             print(f"Market data is not subscribed or unavailable for {symbol}.")
             return None
 
-    async def get_option_chain(self, symbol: str, exp_list: list) -> dict:
+    async def get_option_chain(self, symbol: str, exp_list: list, low=None, high=None, deadline: float = 5.0) -> dict:
         """
+        Returns {expiry: DataFrame} with strike, right, bid, ask, mid, last, close, volume and time\n
+        ``low``/``high`` limit the strike window that gets snapshotted\n
         """
         exps = {}
-        df = pd.DataFrame(columns=['strike', 'kind', 'close', 'last'])
-        self.client.reqMarketDataType(1)
         for i in exp_list:
-            cds = self.client.reqContractDetails(Option(symbol, i, exchange='SMART'))
-            # print(cds)
-            options = [cd.contract for cd in cds]
-            # print(options)
-            l = []
-            for x in options:
-                # print(x)
-                contract = Option(symbol, i, x.strike, x.right, "SMART", currency="USD")
-                # print(contract)
-                snapshot = self.client.reqMktData(contract, "", True, False)
-                l.append([x.strike, x.right, snapshot])
-            # print(snapshot)
-
-            while util.isNan(snapshot.bid):
-                self.client.sleep()
-            for ii in l:
-                df = df.append(
-                    {'strike': ii[0], 'kind': ii[1], 'close': ii[2].close, 'last': ii[2].last, 'bid': ii[2].bid,
-                     'ask': ii[2].ask, 'mid': (ii[2].bid + ii[2].ask) / 2, 'volume': ii[2].volume}, ignore_index=True)
-                exps[i] = df
-
+            exps[i] = await self.chain.snapshot(symbol, i, low=low, high=high, deadline=deadline)
         return exps
 
     async def get_candle_data(self, contract: str, symbol: str, timeframe: str, period: str = '2d',
@@ -396,9 +636,11 @@ class IBTWSAPI:
         """
         Cancel open order\n
         """
-        orders = self.client.reqOpenOrders()
-        for order in orders:
+        # The client keeps open trades up to date from order events, no need to ask TWS again
+        self.stops.forget(order_id)
+        for order in self.client.openTrades():
             if order.orderStatus.orderId == order_id:
+                await self.pacing.acquire(ORDERS)
                 self.client.cancelOrder(order=order.orderStatus)
 
     async def check_positions(self):
@@ -406,110 +648,38 @@ class IBTWSAPI:
         return x
 
     async def cancel_hedge(self):
-        positions = await self.get_positions()
-        for position in positions:
-            if position.position > 0:
-                print(position)
-                action = "SELL"
-                quantity = abs(position.position)
-                contract = Option(
-                    symbol=position.contract.symbol,
-                    lastTradeDateOrContractMonth=position.contract.lastTradeDateOrContractMonth,
-                    strike=position.contract.strike,
-                    right=position.contract.right,
-                    exchange="SMART",
-                    currency="USD",
-                    multiplier='100',
-                    tradingClass=credentials.tradingClass
-                )
-                try:
-                    buy_order = MarketOrder(action, quantity)
-                    buy_trade = self.client.placeOrder(contract, buy_order)
-
-                    self.client.sleep(1)
-                except Exception as e:
-                    raise e
-                # await self.place_market_order(contract=contract, qty=quantity, side=action)
-                print(f"Closing position: {action} {quantity} {position.contract.localSymbol} at market")
+        """
+        Sells every long option position (the hedges) at market and waits until they are gone\n
+        """
+        print(await self.flatten(shorts=False, cancel=False))
 
-    async def cancel_call(self, hedge_strike, position_strike, close_hedge):
-        hedge_contract = Option(
-            symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=hedge_strike,
-            right="C",
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
-        )
-        contract = Option(
-            symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=position_strike,
-            right="C",
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
-        )
+    async def close_leg(self, right, position_strike, quantity, hedge_strike=None, hedge_quantity=0,
+                        close_hedge=False):
+        """
+        Buys back a short leg at market and, with ``close_hedge``, sells its long hedge\n
+        """
+        name = "Call" if right == "C" else "Put"
+        contract = await self.contracts.option(credentials.instrument, credentials.date, position_strike, right)
+        await self.place_market_order(contract=contract, qty=quantity, side="BUY")
+        print(f"{name} position closed")
+        if close_hedge and hedge_strike is not None:
+            hedge_contract = await self.contracts.option(credentials.instrument, credentials.date, hedge_strike, right)
+            await self.place_market_order(contract=hedge_contract, qty=hedge_quantity, side="SELL")
+            print(f"{name} hedge closed")
 
-        await self.place_market_order(contract=contract, qty=credentials.call_position, side="BUY")
-        print("Call positions closed")
-        if close_hedge:
-            await self.place_market_order(contract=hedge_contract, qty=credentials.call_hedge_quantity, side="SELL")
-            print("Call hedge closed")
+    async def cancel_call(self, hedge_strike, position_strike, close_hedge):
+        await self.close_leg("C", position_strike, credentials.call_position, hedge_strike,
+                             credentials.call_hedge_quantity, close_hedge)
 
     async def cancel_put(self, hedge_strike, position_strike, close_hedge):
-        hedge_contract = Option(
-            symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=hedge_strike,
-            right="P",
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
-        )
-        contract = Option(
-            symbol=credentials.instrument,
-            lastTradeDateOrContractMonth=credentials.date,
-            strike=position_strike,
-            right="P",
-            exchange="SMART",
-            currency="USD",
-            multiplier='100',
-            tradingClass=credentials.tradingClass
-        )
-
-        await self.place_market_order(contract=contract, qty=credentials.put_position, side="BUY")
-        print("Put position closed")
-        if close_hedge:
-            await self.place_market_order(contract=hedge_contract, qty=credentials.put_hedge_quantity, side="SELL")
-            print("Put hedge closed")
+        await self.close_leg("P", position_strike, credentials.put_position, hedge_strike,
+                             credentials.put_hedge_quantity, close_hedge)
 
     async def cancel_positions(self):
-        positions = await self.get_positions()
-        for position in positions:
-            if position.position < 0:
-                print(position)
-                action = "BUY"
-                quantity = abs(position.position)
-                contract = Option(
-                    symbol=position.contract.symbol,
-                    lastTradeDateOrContractMonth=position.contract.lastTradeDateOrContractMonth,
-                    strike=position.contract.strike,
-                    right=position.contract.right,
-                    exchange="SMART",
-                    currency="USD",
-                    multiplier='100',
-                    tradingClass=credentials.tradingClass
-                )
-                buy_order = MarketOrder(action, quantity)
-                buy_trade = self.client.placeOrder(contract, buy_order)
-                self.client.sleep(1)
-                # await self.place_market_order(contract=contract, qty=quantity, side=action)
-                print(f"Closing position: {action} {quantity} {position.contract.localSymbol} at market")
+        """
+        Buys back every short option position at market and waits until they are gone\n
+        """
+        print(await self.flatten(longs=False, cancel=False))
 
     async def query_order(self, order_id: int) -> dict:
         """
@@ -548,33 +718,90 @@ class IBTWSAPI:
         """
         self.app = app
 
-    async def get_latest_premium_price(self, symbol, expiry, strike, right, exchange="SMART", print_data=False):
+    async def _premium_key(self, symbol, expiry, strike, right, exchange="SMART"):
+        """
+        Makes sure the option is streaming in the quote book and returns its key\n
+        """
+        key = QuoteBook.key(symbol, expiry, strike, right)
+        if key not in self.quote_book:
+            # Concurrent first requests for one option share a single subscription
+            await self.pacing.merge(("premium",) + key,
+                                    lambda: self._subscribe_premium(key, symbol, expiry, strike, right, exchange))
+        return key
+
+    async def _subscribe_premium(self, key, symbol, expiry, strike, right, exchange):
+        option_contract = await self.contracts.option(symbol, expiry, strike, right, exchange=exchange)
+
+        await self.pacing.acquire(DATA, cost=2)
+        self.data_client.reqMarketDataType(1)
+        self.quote_book.subscribe(key, option_contract)
+        self.quote_book.release(key)
+        if self.recorder:
+            self.recorder.track(option_contract)
+        await self.quote_book.wait_for_quote(key, timeout=5)
+
+    async def watch_premium(self, symbol, expiry, strike, right, exchange="SMART"):
+        """
+        Pins the option's subscription so it is never evicted while a leg is on it\n
+        """
+        key = await self._premium_key(symbol, expiry, strike, right, exchange)
+        self.quote_book.subscribe(key, None)
+        return key
 
-        option_contract = Option(
-            symbol=symbol,
-            lastTradeDateOrContractMonth=expiry,
-            strike=strike,
-            right=right,
-            exchange=exchange,
-            currency="USD",  # Add currency to disambiguate
-            multiplier="100",  # Ensure the multiplier matches
-            tradingClass=credentials.tradingClass
-        )
+    async def unwatch_premium(self, symbol, expiry, strike, right):
+        self.quote_book.release(QuoteBook.key(symbol, expiry, strike, right))
 
-        self.client.qualifyContracts(option_contract)
+    async def record_strike_window(self, symbol, expiry, strikes, rights=("C", "P")):
+        """
+        Streams and records every (strike, right) in ``strikes`` for the session\n
+        """
+        if not self.recorder:
+            return
+        await self.contracts.prequalify(symbol, expiry, strikes, rights=rights)
+        self.data_client.reqMarketDataType(1)
+        for strike in strikes:
+            for right in rights:
+                contract = await self.contracts.option(symbol, expiry, strike, right)
+                await self.pacing.acquire(DATA)
+                self.quote_book.subscribe(QuoteBook.key(symbol, expiry, strike, right), contract)
+                self.recorder.track(contract)
+
+    async def start_metrics(self):
+        metrics.instrument(self, INSTRUMENTED)
+        metrics.gauge("loop_queue_depth", "Callbacks waiting on the event loop", loop_queue_depth)
+        metrics.gauge("loop_tasks", "Pending asyncio tasks", lambda: len(asyncio.all_tasks()))
+        metrics.gauge("market_data_lines", "Streaming quote lines open", lambda: self.quote_book.lines_in_use)
+        metrics.gauge("market_data_lines_max", "Streaming quote line budget", lambda: self.quote_book.max_lines)
+        metrics.gauge("pacing_tokens", "Messages TWS would accept right now", lambda: self.pacing.usage()["tokens"])
+        metrics.gauge("pacing_last_second", "Messages sent in the last second",
+                      lambda: self.pacing.usage()["last_second"])
+        metrics.gauge("pacing_queued_orders", "Order messages waiting for budget",
+                      lambda: self.pacing.usage()["queued_orders"])
+        metrics.gauge("pacing_queued_data", "Data requests waiting for budget",
+                      lambda: self.pacing.usage()["queued_data"])
+        metrics.gauge("stop_amends", "Stop amends sent", lambda: self.stops.amends)
+        metrics.gauge("stop_changes_coalesced", "Stop changes folded into another amend", lambda: self.stops.coalesced)
+        metrics.gauge("stop_changes_skipped", "Stop changes that rounded to the working price",
+                      lambda: self.stops.skipped)
+        if credentials.metrics_port:
+            await metrics.serve(credentials.metrics_port)
+        if credentials.metrics_file:
+            metrics.dump_every(credentials.metrics_file, credentials.metrics_dump_every)
+
+    def stop_metrics(self):
+        if credentials.enable_metrics:
+            metrics.close(credentials.metrics_file)
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.stop()
+            print(f"Recorded {self.recorder.recorded} quote updates to {self.recorder.directory}")
 
-        self.client.reqMarketDataType(1)
-        market_data = self.client.reqMktData(option_contract, '', snapshot=True)
-        self.ib.sleep(5)
+    async def get_latest_premium_price(self, symbol, expiry, strike, right, exchange="SMART", print_data=False):
+        key = await self._premium_key(symbol, expiry, strike, right, exchange)
+        premium_price = self.quote_book.quote(key)
         if print_data:
-            print("market data is", market_data)
-
-        premium_price = {
-            "bid": market_data.bid,
-            "ask": market_data.ask,
-            "last": market_data.last,
-            "mid": (market_data.bid + market_data.ask) / 2 if market_data.bid and market_data.ask else None
-        }
+            print("market data is", self.quote_book.ticker(key))
         return premium_price
 
     async def modify_option_trail_percent(self, trade, new_trailing_percent=0.14):
@@ -606,25 +833,32 @@ class IBTWSAPI:
 
         return new_trade
 
-    async def place_stp_order(self, contract, side, quantity, sl):
-        details = self.client.reqContractDetails(contract)
-        contract = details[0].contract
-        stop_order = StopOrder(side, quantity, round(sl, 1))
-        print(stop_order)
-        trade = self.client.placeOrder(contract, stop_order)
-        self.client.sleep(2)
-        print(f"done {trade.orderStatus.status}")
+    async def place_stp_order(self, contract, side, quantity, sl, adjust=None):
+        """
+        Places a stop and returns its order id once TWS has acknowledged it\n
+        ``adjust`` optionally makes it an adjustable stop (see Strategy.stop_adjustment).\n
+        """
+        contract = await self.contracts.qualify(contract)
+        trade = await self.stops.place(contract, side, quantity, sl, self._place, adjust=adjust)
+        print(f"Stop {trade.order.action} {trade.order.totalQuantity} @ {trade.order.auxPrice}: "
+              f"{trade.orderStatus.status}")
 
         return trade.order.orderId
 
-    async def modify_stp_order(self, contract, quantity, side, sl, order_id):
-
-        option_details = self.client.reqContractDetails(contract)
-        if not option_details:
-            print("Invalid contract. Please check the option details.")
-
-        stop_order = StopOrder(side, quantity, sl, orderId=order_id)
-        trade = self.client.placeOrder(option_details[0].contract, stop_order)
-
-        self.client.sleep(1)
-        print(f"Order status: {trade.orderStatus.status}")
+    async def modify_stp_order(self, contract, quantity, side, sl, order_id, adjust=None):
+        """
+        Moves a working stop in place through the stop manager\n
+        Changes arriving close together are sent as one amend; returns False if TWS rejected it.\n
+        """
+        if not self.stops.knows(order_id) and not self.stops.adopt(order_id, self._place):
+            # Not a stop we can see (e.g. placed by another session): replace it by order id as before
+            contract = await self.contracts.qualify(contract)
+            await self.pacing.acquire(ORDERS)
+            self._place(contract, StopOrder(side, quantity, self.stops.rounded(sl), orderId=order_id))
+            self.stops.adopt(order_id, self._place)
+            return True
+        ok = await self.stops.amend(order_id, sl, quantity, adjust=adjust)
+        trade = self.stops.trade(order_id)
+        print(f"Stop {order_id} {'moved' if ok else 'NOT moved'} to {self.stops.rounded(sl)}"
+              + (f": {trade.orderStatus.status}" if trade else ""))
+        return ok
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+import credentials
+
+from ib_insync import Option
+from pacing import DATA
+
+CHAIN_COLUMNS = ['strike', 'right', 'bid', 'ask', 'mid', 'last', 'close', 'volume', 'time']
+
+
+class ChainSnapshotEngine:
+    """
+    Snapshots a whole strike window of an option chain in parallel.\n
+    One reqContractDetails per expiry, then every contract's snapshot is requested
+    concurrently (at most ``concurrency`` in flight) and the engine waits for all of
+    them or the deadline, whichever comes first. The result is built column by column
+    into a single DataFrame.\n
+    """
+
+    def __init__(self, client, contracts=None, concurrency: int = 50, pacing=None):
+        self.client = client
+        self.contracts = contracts
+        self.pacing = pacing
+        self.concurrency = concurrency
+        self._details = {}
+
+    async def chain_contracts(self, symbol, expiry, trading_class=None):
+        """
+        Returns every qualified contract of the expiry, asking TWS only once per session\n
+        """
+        key = (symbol, expiry, trading_class or credentials.tradingClass)
+        if key not in self._details:
+            if self.pacing is not None:
+                await self.pacing.acquire(DATA)
+            cds = await self.client.reqContractDetailsAsync(
+                Option(symbol, expiry, exchange='SMART', tradingClass=key[2]))
+            contracts = [cd.contract for cd in cds]
+            if self.contracts is not None:
+                contracts = [self.contracts.register(c) for c in contracts]
+            self._details[key] = sorted(contracts, key=lambda c: (c.strike, c.right))
+        return self._details[key]
+
+    async def snapshot(self, symbol, expiry, low=None, high=None, rights=("C", "P"), deadline: float = 5.0,
+                       trading_class=None) -> pd.DataFrame:
+        """
+        Snapshots every contract with ``low <= strike <= high`` and returns one row per contract\n
+        Rows whose snapshot did not arrive before the deadline carry NaN prices.\n
+        """
+        contracts = [
+            c for c in await self.chain_contracts(symbol, expiry, trading_class)
+            if c.right in rights and (low is None or c.strike >= low) and (high is None or c.strike <= high)
+        ]
+        tickers = await self._snapshot_all(contracts, deadline)
+        return self.to_frame(contracts, tickers)
+
+    async def _snapshot_all(self, contracts, deadline):
+        self.client.reqMarketDataType(1)
+        sem = asyncio.Semaphore(self.concurrency)
+        end = time.monotonic() + deadline
+
+        async def snap(contract):
+            async with sem:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if self.pacing is not None:
+                    await self.pacing.acquire(DATA)
+                    remaining = end - time.monotonic()
+                try:
+                    tickers = await asyncio.wait_for(self.client.reqTickersAsync(contract), remaining)
+                    return tickers[0] if tickers else None
+                except asyncio.TimeoutError:
+                    # Keep whatever partial quote arrived before the deadline
+                    return self.client.ticker(contract)
+
+        return await asyncio.gather(*[snap(c) for c in contracts])
+
+    @staticmethod
+    def to_frame(contracts, tickers) -> pd.DataFrame:
+        n = len(contracts)
+        strike = np.fromiter((c.strike for c in contracts), dtype=float, count=n)
+        right = np.array([c.right for c in contracts], dtype=object)
+        fields = {}
+        for name in ('bid', 'ask', 'last', 'close', 'volume'):
+            fields[name] = np.fromiter(
+                (getattr(t, name) if t is not None else np.nan for t in tickers), dtype=float, count=n)
+        ts = np.fromiter(
+            (t.time.timestamp() if t is not None and t.time else np.nan for t in tickers), dtype=float, count=n)
+
+        bid, ask = fields['bid'], fields['ask']
+        # IB reports -1 when there is no bid/ask
+        bid[bid < 0] = np.nan
+        ask[ask < 0] = np.nan
+        mid = (bid + ask) / 2
+
+        return pd.DataFrame({
+            'strike': strike,
+            'right': right,
+            'bid': bid,
+            'ask': ask,
+            'mid': mid,
+            'last': fields['last'],
+            'close': fields['close'],
+            'volume': fields['volume'],
+            'time': pd.to_datetime(ts, unit='s', utc=True)
+        }, columns=CHAIN_COLUMNS)
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import deque
+
+# Lanes; orders are always served first
+ORDERS = 0
+DATA = 1
+
+
+class PacingGovernor:
+    """
+    Token bucket for every message sent to TWS, with an order lane and a data lane.\n
+    Tokens refill at ``rate`` per second up to ``burst``. Order placement, modification
+    and cancellation are served first and may use the whole bucket; data requests only
+    take a token while more than ``reserve`` are left, so quote and contract traffic can
+    never drain the budget a stop change needs. ``merge`` lets identical data requests
+    in flight share one call. ``usage()`` reports the current budget.\n
+    """
+
+    def __init__(self, rate: float = 45.0, burst: float = None, reserve: float = 5.0):
+        self.rate = rate
+        self.burst = burst or rate
+        self.reserve = reserve
+        self.sent = [0, 0]
+        self.merged = 0
+        self.max_wait = [0.0, 0.0]
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._queues = (deque(), deque())
+        self._inflight = {}
+        self._recent = deque()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        return now
+
+    def _floor(self, lane):
+        return 1 if lane == ORDERS else 1 + self.reserve
+
+    def _take(self, lane, cost, now):
+        self._tokens -= cost
+        self.sent[lane] += cost
+        self._recent.append((now, cost))
+        while self._recent[0][0] < now - 1:
+            self._recent.popleft()
+
+    async def acquire(self, lane: int = DATA, cost: int = 1):
+        """
+        Waits until ``cost`` messages may be sent in ``lane``
+        """
+        cost = min(cost, self.burst - (self.reserve if lane == DATA else 0))
+        now = self._refill()
+        if not self._queues[ORDERS] and (lane == ORDERS or not self._queues[DATA]) \
+                and self._tokens >= cost + self._floor(lane) - 1:
+            self._take(lane, cost, now)
+            return
+        future = asyncio.get_event_loop().create_future()
+        self._queues[lane].append((future, cost, now))
+        self._schedule()
+        await future
+
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        lane = ORDERS if self._queues[ORDERS] else DATA
+        _, cost, _ = self._queues[lane][0]
+        missing = cost + self._floor(lane) - 1 - self._tokens
+        self._timer = asyncio.get_event_loop().call_later(max(missing / self.rate, 0), self._drain)
+
+    def _drain(self):
+        self._timer = None
+        now = self._refill()
+        for lane in (ORDERS, DATA):
+            queue = self._queues[lane]
+            while queue and (lane == ORDERS or not self._queues[ORDERS]):
+                future, cost, queued_at = queue[0]
+                if future.cancelled():
+                    queue.popleft()
+                    continue
+                if self._tokens < cost + self._floor(lane) - 1:
+                    break
+                queue.popleft()
+                self._take(lane, cost, now)
+                self.max_wait[lane] = max(self.max_wait[lane], now - queued_at)
+                future.set_result(None)
+        if self._queues[ORDERS] or self._queues[DATA]:
+            self._schedule()
+
+    async def merge(self, key, factory):
+        """
+        Runs ``factory()`` once per ``key`` at a time; callers asking while it is in flight share the result
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.merged += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(factory())
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._inflight.pop(key) if self._inflight.get(key) is f else None)
+        return await asyncio.shield(future)
+
+    def usage(self) -> dict:
+        now = self._refill()
+        while self._recent and self._recent[0][0] < now - 1:
+            self._recent.popleft()
+        last_second = sum(cost for _, cost in self._recent)
+        return {
+            "rate": self.rate,
+            "tokens": round(self._tokens, 1),
+            "last_second": last_second,
+            "utilisation": round(last_second / self.rate, 2),
+            "orders_sent": self.sent[ORDERS],
+            "data_sent": self.sent[DATA],
+            "merged": self.merged,
+            "queued_orders": len(self._queues[ORDERS]),
+            "queued_data": len(self._queues[DATA]),
+            "max_order_wait": round(self.max_wait[ORDERS], 4),
+            "max_data_wait": round(self.max_wait[DATA], 4),
+        }
+
+    def report(self) -> str:
+        u = self.usage()
+        return (f"Pacing: {u['last_second']}/{u['rate']:g} msg in the last second, {u['tokens']} tokens left, "
+                f"{u['orders_sent']} order / {u['data_sent']} data messages, {u['merged']} merged, "
+                f"max wait {u['max_order_wait'] * 1000:.1f} ms orders / {u['max_data_wait'] * 1000:.1f} ms data")
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from ib_insync import util
+
+
+class QuoteBook:
+    """
+    Keeps one streaming market data subscription per option contract and serves
+    the latest bid/ask/last/mid from memory.\n
+    Subscriptions are reference counted; entries nobody holds any more are kept
+    warm and only cancelled (least recently used first) when the number of open
+    lines would exceed ``max_lines``.\n
+    """
+
+    def __init__(self, client, max_lines: int = 90, stale_after: float = 5.0):
+        self.client = client
+        self.max_lines = max_lines
+        self.stale_after = stale_after
+        # key -> [contract, ticker, refcount]; ordered from least to most recently used
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(symbol, expiry, strike, right):
+        return symbol, str(expiry), float(strike), right.upper()[0]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def lines_in_use(self) -> int:
+        return len(self._entries)
+
+    def subscribe(self, key, contract):
+        """
+        Starts streaming ``contract`` under ``key`` (or reuses the running
+        subscription) and takes a reference on it.\n
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._evict(room_for=1)
+            ticker = self.client.reqMktData(contract, '', snapshot=False)
+            entry = [contract, ticker, 0]
+            self._entries[key] = entry
+        entry[2] += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def release(self, key):
+        """
+        Drops one reference. The line stays open until it has to make room.\n
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > 0:
+            entry[2] -= 1
+
+    def ticker(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def wait_for_quote(self, key, timeout: float = 5.0) -> bool:
+        """
+        Waits until the subscription under ``key`` has produced a bid or ask.\n
+        """
+        ticker = self.ticker(key)
+        if ticker is None:
+            return False
+        deadline = time.monotonic() + timeout
+        while not self._has_quote(ticker):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(ticker.updateEvent, remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def quote(self, key) -> dict:
+        """
+        Returns the latest premium for ``key`` without touching the network.\n
+        """
+        ticker = self.ticker(key)
+        if ticker is None:
+            return None
+        bid, ask = ticker.bid, ticker.ask
+        ts = ticker.time.timestamp() if ticker.time else None
+        return {
+            "bid": bid,
+            "ask": ask,
+            "last": ticker.last,
+            "mid": (bid + ask) / 2 if bid and ask else None,
+            "time": ts,
+            "stale": ts is None or (time.time() - ts) > self.stale_after
+        }
+
+    def resubscribe(self):
+        """
+        Re-requests every open line, e.g. after the data connection came back\n
+        """
+        for entry in self._entries.values():
+            entry[1] = self.client.reqMktData(entry[0], '', snapshot=False)
+
+    def unsubscribe_all(self):
+        for contract, _, _ in self._entries.values():
+            self.client.cancelMktData(contract)
+        self._entries.clear()
+
+    def _evict(self, room_for: int):
+        while len(self._entries) + room_for > self.max_lines:
+            victim = next((k for k, e in self._entries.items() if e[2] == 0), None)
+            if victim is None:
+                print(f"Quote book is at {self.max_lines} lines with every line in use")
+                return
+            contract, _, _ = self._entries.pop(victim)
+            self.client.cancelMktData(contract)
+
+    @staticmethod
+    def _has_quote(ticker) -> bool:
+        return any(not util.isNan(v) and v > 0 for v in (ticker.bid, ticker.ask))
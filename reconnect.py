@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+
+import credentials
+
+log = logging.getLogger("strategy")
+
+
+class ConnectionSupervisor:
+    """
+    Brings one IB connection back after it drops.\n
+    On ``disconnectedEvent`` it retries ``connectAsync`` with exponential backoff
+    (``initial_delay`` doubling up to ``max_delay``), then awaits ``on_restored()``
+    so the broker can resync in one pass. The time from the drop to the end of the
+    resync is kept in ``last_recovery`` and logged.\n
+    """
+
+    def __init__(self, client, name: str, client_id: int, on_restored, initial_delay: float = 1.0,
+                 max_delay: float = 30.0):
+        self.client = client
+        self.name = name
+        self.client_id = client_id
+        self.on_restored = on_restored
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.disconnects = 0
+        self.last_recovery = None
+        self._task = None
+        self._closed = False
+        self.client.disconnectedEvent += self._on_disconnected
+
+    @property
+    def recovering(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _on_disconnected(self):
+        if self._closed or self.recovering:
+            return
+        self.disconnects += 1
+        self._task = asyncio.ensure_future(self._recover(time.perf_counter()))
+
+    async def _recover(self, dropped_at):
+        print(f"{self.name} connection lost, reconnecting")
+        log.warning("%s connection lost, reconnecting", self.name)
+        delay = self.initial_delay
+        while not self._closed:
+            try:
+                await self.client.connectAsync(credentials.host, credentials.port, clientId=self.client_id,
+                                               timeout=credentials.reconnect_timeout)
+                break
+            except Exception as e:
+                print(f"{self.name} reconnect failed ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+        if self._closed:
+            return
+        await self.on_restored()
+        self.last_recovery = time.perf_counter() - dropped_at
+        print(f"{self.name} connection restored and resynced in {self.last_recovery:.2f}s")
+        log.warning("%s connection restored and resynced in %.2fs", self.name, self.last_recovery)
+
+    def close(self):
+        """
+        Stops supervising, so an intentional disconnect is not reconnected
+        """
+        self._closed = True
+        self.client.disconnectedEvent -= self._on_disconnected
+        if self.recovering:
+            self._task.cancel()
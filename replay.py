@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import itertools
+import os
+import selectors
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pytz import timezone
+
+import credentials
+from contracts import ContractRegistry
+from discord_bot import notifier
+from new_broker import IBTWSAPI
+from strike_index import StrikeIndex
+from tick_recorder import session_frame
+
+from ib_insync import MarketOrder, OrderStatus, Position, Trade
+
+EASTERN = timezone('US/Eastern')
+
+# Key the underlying index quotes are stored under in a tape
+UNDERLYING = (0.0, '')
+
+
+class TickTape:
+    """
+    Recorded quotes, one sorted array set per (strike, right).\n
+    Build it from a frame with columns time (epoch seconds), strike, right, bid, ask, last.
+    Underlying index rows use strike 0 and an empty right.\n
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        frame = frame.sort_values('time', kind='stable')
+        frame = frame.assign(right=frame['right'].fillna('').astype(str), strike=frame['strike'].fillna(0.0))
+        self._series = {}
+        for (strike, right), group in frame.groupby(['strike', 'right'], sort=False):
+            self._series[(float(strike), right)] = (
+                group['time'].to_numpy(dtype=float),
+                group['bid'].to_numpy(dtype=float),
+                group['ask'].to_numpy(dtype=float),
+                group['last'].to_numpy(dtype=float)
+            )
+        self.times = np.unique(frame['time'].to_numpy(dtype=float))
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    @classmethod
+    def from_recording(cls, directory):
+        """
+        Tape from a TickRecorder session directory
+        """
+        return cls(session_frame(directory))
+
+    @property
+    def start(self) -> float:
+        return float(self.times[0])
+
+    @property
+    def end(self) -> float:
+        return float(self.times[-1])
+
+    def strikes(self):
+        return sorted({k[0] for k in self._series if k != UNDERLYING})
+
+    def quote(self, key, t) -> dict:
+        series = self._series.get(key)
+        i = -1 if series is None else int(np.searchsorted(series[0], t, side='right')) - 1
+        if i < 0:
+            return {"bid": np.nan, "ask": np.nan, "last": np.nan, "mid": None, "time": None, "stale": True}
+        ts, bid, ask, last = series[0][i], series[1][i], series[2][i], series[3][i]
+        return {
+            "bid": bid,
+            "ask": ask,
+            "last": last,
+            "mid": (bid + ask) / 2 if bid and ask else None,
+            "time": ts,
+            "stale": (t - ts) > credentials.quote_stale_after
+        }
+
+    def next_time(self, t):
+        """
+        First recorded tick strictly after ``t``, or None at the end of the tape
+        """
+        i = int(np.searchsorted(self.times, t, side='right'))
+        return float(self.times[i]) if i < len(self.times) else None
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """
+    Never waits: a select with a timeout moves the virtual clock forward instead
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._map = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = selectors.SelectorKey(fileobj, fd, events, data)
+        self._map[fileobj] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self._map.pop(fileobj)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Replay stalled: every task is waiting and nothing is scheduled")
+        if timeout > 0:
+            self._loop.advance(timeout)
+        return []
+
+    def get_map(self):
+        return self._map
+
+    def close(self):
+        self._map.clear()
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop on a virtual clock: sleeps and timeouts complete instantly in wall time.\n
+    ``time()`` counts seconds from ``start`` rather than the epoch: at epoch magnitudes one
+    float step is larger than asyncio's clock resolution, so a timer the clock was moved
+    onto would never count as due. ``epoch()`` and ``datetime()`` give the session time.\n
+    """
+
+    def __init__(self, start: float):
+        self.start = start
+        self._now = 0.0
+        super().__init__(selector=_VirtualSelector(self))
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def epoch(self) -> float:
+        return self.start + self._now
+
+    def datetime(self):
+        return datetime.fromtimestamp(self.epoch(), EASTERN)
+
+
+class _SimQualifier:
+    """
+    Stands in for the IB client when the contract registry qualifies contracts
+    """
+
+    def __init__(self):
+        self._con_ids = itertools.count(1)
+
+    async def qualifyContractsAsync(self, *contracts):
+        for c in contracts:
+            if not c.conId:
+                c.conId = next(self._con_ids)
+        return list(contracts)
+
+
+class _SimStopOuts:
+
+    def __init__(self):
+        self._watches = {}
+
+    def watch(self, order_id, contract, callback):
+        self._watches[order_id] = callback
+
+    def unwatch(self, order_id):
+        self._watches.pop(order_id, None)
+
+    def is_watching(self, order_id) -> bool:
+        return order_id in self._watches
+
+    def fire(self, order_id, source):
+        callback = self._watches.pop(order_id, None)
+        if callback is not None:
+            result = callback(order_id, source)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+
+
+class ReplayBroker(IBTWSAPI):
+    """
+    IBTWSAPI fed from a TickTape under the virtual clock.\n
+    Market orders fill at the touch (ask for BUY, bid for SELL) plus ``slippage`` after
+    ``fill_latency`` virtual seconds. A BUY stop triggers when the ``trigger`` price
+    (ask, last or mid) reaches the stop and fills at the worse of stop and ask.\n
+    Everything else, e.g. close_leg, is the real IBTWSAPI code.\n
+    """
+
+    def __init__(self, tape: TickTape, loop: VirtualEventLoop, fill_latency: float = 0.05, slippage: float = 0.0,
+                 trigger: str = "ask"):
+        super().__init__(creds={"client_id": 0})
+        self.tape = tape
+        self.loop = loop
+        self.fill_latency = fill_latency
+        self.slippage = slippage
+        self.trigger = trigger
+        self.ledger = []
+        self._positions = {}
+        self._stops = {}
+        self._order_ids = itertools.count(1)
+        self._stop_task = None
+
+    async def connect(self) -> bool:
+        self.contracts = ContractRegistry(_SimQualifier())
+        self.stop_outs = _SimStopOuts()
+        self._stop_task = asyncio.ensure_future(self._watch_stops())
+        print("Connected to replay")
+        return True
+
+    def is_connected(self) -> bool:
+        return True
+
+    def disconnect(self):
+        if self._stop_task is not None:
+            self._stop_task.cancel()
+            self._stop_task = None
+
+    async def get_strike_index(self, symbol, exchange, trading_class, date, secType='IND') -> StrikeIndex:
+        return StrikeIndex(self.tape.strikes())
+
+    async def clock_offset(self):
+        # The virtual clock is the session clock
+        return 0.0, 0.0
+
+    async def current_price(self, symbol, exchange='CBOE'):
+        q = self.tape.quote(UNDERLYING, self.loop.epoch())
+        return q["last"] if not np.isnan(q["last"]) else q["mid"]
+
+    async def index_price(self, symbol, exchange='CBOE'):
+        return await self.current_price(symbol, exchange)
+
+    async def get_latest_premium_price(self, symbol, expiry, strike, right, exchange="SMART", print_data=False):
+        return self.tape.quote((float(strike), right), self.loop.epoch())
+
+    async def watch_premium(self, symbol, expiry, strike, right, exchange="SMART"):
+        return float(strike), right
+
+    async def unwatch_premium(self, symbol, expiry, strike, right):
+        pass
+
+    async def get_positions(self):
+        return [Position("REPLAY", c, qty, 0.0) for c, qty in self._positions.values() if qty != 0]
+
+    async def place_market_order(self, contract, qty, side):
+        order_id = next(self._order_ids)
+        await asyncio.sleep(self.fill_latency)
+        q = self.tape.quote((float(contract.strike), contract.right), self.loop.epoch())
+        price = q["ask"] + self.slippage if side == "BUY" else q["bid"] - self.slippage
+        self._fill(contract, side, qty, price, order_id, "market")
+        trade = Trade(contract=contract, order=MarketOrder(side, qty, orderId=order_id),
+                      orderStatus=OrderStatus(orderId=order_id, status=OrderStatus.Filled, filled=qty,
+                                              avgFillPrice=price))
+        return trade, price, order_id
+
+    async def wait_for_fill(self, trade, timeout: float = None, placed_at: float = None) -> dict:
+        return {
+            "order_id": trade.order.orderId,
+            "status": trade.orderStatus.status,
+            "filled": trade.orderStatus.status == OrderStatus.Filled,
+            "avg_price": trade.orderStatus.avgFillPrice,
+            "commission": 0.0,
+            "latency": self.fill_latency
+        }
+
+    async def place_stp_order(self, contract, side, quantity, sl, adjust=None):
+        order_id = next(self._order_ids)
+        self._stops[order_id] = [contract, side, quantity, round(sl, 1)]
+        return order_id
+
+    async def modify_stp_order(self, contract, quantity, side, sl, order_id, adjust=None):
+        if order_id in self._stops:
+            self._stops[order_id] = [contract, side, quantity, sl]
+
+    async def cancel_order(self, order_id: int) -> None:
+        self._stops.pop(order_id, None)
+
+    async def _watch_stops(self):
+        while True:
+            nxt = self.tape.next_time(self.loop.epoch())
+            if nxt is None:
+                return
+            await asyncio.sleep(nxt - self.loop.epoch())
+            for order_id, (contract, side, qty, stop) in list(self._stops.items()):
+                q = self.tape.quote((float(contract.strike), contract.right), self.loop.epoch())
+                level = q[self.trigger] if self.trigger != "mid" else (q["mid"] or np.nan)
+                if side == "BUY" and level >= stop:
+                    price = max(stop, q["ask"]) + self.slippage
+                elif side == "SELL" and level <= stop:
+                    price = min(stop, q["bid"]) - self.slippage
+                else:
+                    continue
+                del self._stops[order_id]
+                self._fill(contract, side, qty, price, order_id, "stop")
+                self.stop_outs.fire(order_id, None)
+
+    def _fill(self, contract, side, qty, price, order_id, kind):
+        signed = qty if side == "BUY" else -qty
+        entry = self._positions.setdefault(contract.conId, [contract, 0])
+        entry[1] += signed
+        self.ledger.append({
+            "time": self.loop.datetime(),
+            "order_id": order_id,
+            "kind": kind,
+            "right": contract.right,
+            "strike": contract.strike,
+            "action": side,
+            "qty": qty,
+            "price": price,
+            "cash": -signed * price * 100
+        })
+
+    def ledger_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.ledger, columns=["time", "order_id", "kind", "right", "strike", "action", "qty",
+                                                  "price", "cash"])
+
+    def open_value(self) -> float:
+        """
+        Mark-to-mid value of whatever is still open at the end of the tape
+        """
+        value = 0.0
+        for contract, qty in self._positions.values():
+            if qty:
+                q = self.tape.quote((float(contract.strike), contract.right), self.loop.epoch())
+                value += qty * (q["mid"] or 0.0) * 100
+        return value
+
+
+class ReplayResult:
+
+    def __init__(self, ledger: pd.DataFrame, open_value: float, wall_seconds: float):
+        self.ledger = ledger
+        self.open_value = open_value
+        self.wall_seconds = wall_seconds
+
+    @property
+    def pnl(self) -> float:
+        return float(self.ledger["cash"].sum()) + self.open_value
+
+
+def run_replay(tape: TickTape, fill_latency: float = 0.05, slippage: float = 0.0, trigger: str = "ask",
+               strategy_factory=None, log: bool = False) -> ReplayResult:
+    """
+    Runs the real Strategy over ``tape`` from its first to its last tick and returns the trade ledger
+    """
+    from main import Strategy
+
+    wall_start = time.perf_counter()
+    loop = VirtualEventLoop(tape.start)
+    asyncio.set_event_loop(loop)
+    notifier.enabled = False
+    strategy = None
+    try:
+        strategy = (strategy_factory or Strategy)()
+        strategy.enable_logging = strategy.enable_logging and log
+        strategy.journal = None  # A replayed day must not resume, or leave, a live session's journal
+        strategy.native_trailing = None  # Replayed stops are plain stops; trail client-side
+        strategy.combo_orders = None  # The tape has no combo quotes
+        strategy.fast_flatten = False  # Exit through close_leg, which ReplayBroker fills from the tape
+        strategy.broker = ReplayBroker(tape, loop, fill_latency=fill_latency, slippage=slippage, trigger=trigger)
+        strategy.now = loop.datetime
+        loop.run_until_complete(strategy.main())
+        broker = strategy.broker
+        return ReplayResult(broker.ledger_frame(), broker.open_value(), time.perf_counter() - wall_start)
+    finally:
+        notifier.enabled = True
+        if strategy is not None and isinstance(strategy.broker, ReplayBroker):
+            strategy.broker.disconnect()
+        # Let cancelled tasks (the stop watcher, a leg action cut short) unwind before the loop goes
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded quotes through Strategy")
+    parser.add_argument("tape", help="CSV with time, strike, right, bid, ask, last, or a recorded session directory")
+    parser.add_argument("--out", help="Write the trade ledger to this CSV")
+    parser.add_argument("--latency", type=float, default=0.05, help="Virtual fill latency in seconds")
+    parser.add_argument("--slippage", type=float, default=0.0, help="Premium slippage per fill")
+    parser.add_argument("--trigger", default="ask", choices=["ask", "last", "mid"])
+    args = parser.parse_args()
+
+    tape = TickTape.from_recording(args.tape) if os.path.isdir(args.tape) else TickTape.from_csv(args.tape)
+    result = run_replay(tape, fill_latency=args.latency, slippage=args.slippage,
+                        trigger=args.trigger)
+    print(result.ledger.to_string())
+    print(f"P&L: {result.pnl:.2f} (replayed in {result.wall_seconds:.2f}s)")
+    if args.out:
+        result.ledger.to_csv(args.out, index=False)
@@ -0,0 +1,242 @@
+import asyncio
+
+from ib_insync import OrderStatus, StopOrder
+
+from pacing import ORDERS
+
+# TWS codes on an order id that are notices, not rejections
+NOTICE_CODES = {399, 2109, 2148}
+# Adjustable stop fields that are prices and get tick-rounded
+ADJUST_PRICES = ("triggerPrice", "adjustedStopPrice")
+
+
+def tick_round(price: float, min_tick: float = 0.05, tick_break: float = 3.0, tick_above: float = 0.10) -> float:
+    """
+    Rounds an option price to a valid tick: ``min_tick`` below ``tick_break``, ``tick_above`` from there up\n
+    """
+    tick = min_tick if price < tick_break else tick_above
+    return round(round(price / tick) * tick, 2)
+
+
+class _Stop:
+    __slots__ = ("trade", "send", "target", "adjust", "waiters", "worker", "on_adjusted")
+
+    def __init__(self, trade, send):
+        self.trade = trade
+        self.send = send  # The broker's _place, so amends carry the same account / ownership
+        self.target = trade.order.auxPrice
+        self.adjust = {}  # Adjustable stop fields the order should carry
+        self.waiters = []
+        self.worker = None
+        self.on_adjusted = None
+
+
+class StopManager:
+    """
+    Owns the live Trade of every protective stop and amends it in place.\n
+    A stop price change is rounded to the option tick and queued on its order; one
+    worker per order waits ``coalesce`` seconds, sends a single amend carrying the
+    latest price and waits for TWS to acknowledge it (openOrder or error event), so rapid
+    trail steps and a move-to-cost collapse into one message and never race each other.
+    Changes that round to the price already working are skipped. Orders are
+    independent: an amend waiting on one leg's stop never holds up another's.\n
+    A stop may also carry an IB adjustment (``triggerPrice`` / ``adjustedOrderType`` /
+    ``adjustedStopPrice`` / ``adjustedTrailingAmount``) that TWS applies on its own;
+    ``on_adjusted`` callbacks hear about it from the order's openOrder update.\n
+    """
+
+    def __init__(self, client, pacing=None, coalesce: float = 0.05, ack_timeout: float = 5.0, **ticks):
+        self.client = client
+        self.pacing = pacing
+        self.coalesce = coalesce
+        self.ack_timeout = ack_timeout
+        self.ticks = ticks
+        self.amends = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.unacknowledged = 0
+        self._stops = {}
+        self.client.openOrderEvent += self._on_open_order
+
+    def __len__(self):
+        return len(self._stops)
+
+    def rounded(self, price: float) -> float:
+        return tick_round(price, **self.ticks)
+
+    def _adjustment(self, adjust):
+        return {k: self.rounded(v) if k in ADJUST_PRICES else v for k, v in adjust.items()}
+
+    async def place(self, contract, side, quantity, sl, send, adjust=None):
+        """
+        Sends a new stop through ``send(contract, order)`` and waits for its acknowledgement. Returns the Trade
+        """
+        order = StopOrder(side, quantity, self.rounded(sl))
+        adjust = self._adjustment(adjust or {})
+        for field, value in adjust.items():
+            setattr(order, field, value)
+        if self.pacing is not None:
+            await self.pacing.acquire(ORDERS)
+        trade = send(contract, order)
+        stop = _Stop(trade, send)
+        stop.adjust = adjust
+        self._stops[trade.order.orderId] = stop
+        await self._ack(trade)
+        return trade
+
+    def on_adjusted(self, order_id, callback):
+        """
+        ``callback(order_id, trade)`` runs when TWS itself moves or converts the stop (plain function or coroutine)
+        """
+        stop = self._stops.get(order_id)
+        if stop is not None:
+            stop.on_adjusted = callback
+
+    def adopt(self, order_id, send):
+        """
+        Takes over a stop this manager did not place (e.g. after a restart) from the client's open trades
+        """
+        for trade in self.client.openTrades():
+            if trade.order.orderId == order_id and trade.order.orderType == "STP":
+                self._stops[order_id] = _Stop(trade, send)
+                return True
+        return False
+
+    def forget(self, order_id):
+        stop = self._stops.pop(order_id, None)
+        if stop is not None:
+            self._release(stop, False)
+
+    def knows(self, order_id) -> bool:
+        return order_id in self._stops
+
+    def trade(self, order_id):
+        stop = self._stops.get(order_id)
+        return stop.trade if stop is not None else None
+
+    async def amend(self, order_id, sl, quantity=None, adjust=None) -> bool:
+        """
+        Moves the stop to ``sl`` (and ``quantity`` / ``adjust`` fields if given). Resolves once TWS
+        acknowledged the amend that carried this change, or a later one that superseded it. Returns
+        False if it was rejected or the order is no longer a plain stop.\n
+        """
+        stop = self._stops.get(order_id)
+        if stop is None:
+            return False
+        if stop.trade.isDone():
+            self.forget(order_id)
+            return False
+        if stop.trade.order.orderType != "STP":
+            print(f"Stop order {order_id} is now a {stop.trade.order.orderType} order at the broker; not amended")
+            return False
+        stop.target = self.rounded(sl)
+        if adjust is not None:
+            stop.adjust = self._adjustment(adjust)
+        if quantity is not None:
+            stop.trade.order.totalQuantity = quantity
+        waiter = asyncio.get_event_loop().create_future()
+        stop.waiters.append(waiter)
+        if stop.worker is None or stop.worker.done():
+            stop.worker = asyncio.ensure_future(self._work(stop))
+        return await waiter
+
+    async def _work(self, stop):
+        while stop.waiters:
+            if self.coalesce:
+                await asyncio.sleep(self.coalesce)
+            waiters, stop.waiters = stop.waiters, []
+            self.coalesced += len(waiters) - 1
+            order = stop.trade.order
+            if stop.trade.isDone() or self._stops.get(order.orderId) is not stop:
+                # Executed or cancelled while the change was being gathered
+                ok = False
+            else:
+                changes = {k: v for k, v in dict(stop.adjust, auxPrice=stop.target).items()
+                           if getattr(order, k) != v}
+                if not changes:
+                    self.skipped += 1
+                    ok = True
+                else:
+                    previous = {k: getattr(order, k) for k in changes}
+                    for field, value in changes.items():
+                        setattr(order, field, value)
+                    if self.pacing is not None:
+                        await self.pacing.acquire(ORDERS)
+                    stop.send(stop.trade.contract, order)
+                    self.amends += 1
+                    acked = await self._ack(stop.trade)
+                    if acked is False:
+                        for field, value in previous.items():
+                            setattr(order, field, value)
+                        self.rejected += 1
+                    elif acked is None:
+                        # Silence is not a rejection: TWS has most likely applied it, keep what was sent
+                        self.unacknowledged += 1
+                    ok = acked is not False
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(ok)
+        if stop.trade.isDone():
+            self._stops.pop(stop.trade.order.orderId, None)
+
+    async def _ack(self, trade):
+        """
+        Waits for TWS to take the order or amend: True on its openOrder echo or a status update,
+        False on a rejection, None on timeout. A modify of a PreSubmitted (held or TWS-simulated)
+        stop gets no status update, only the openOrder echo.\n
+        """
+        order_id = trade.order.orderId
+        done = asyncio.get_event_loop().create_future()
+
+        def on_open_order(t):
+            if t.order.orderId == order_id and not done.done():
+                done.set_result(True)
+
+        def on_status(t):
+            if t.orderStatus.status != OrderStatus.PendingSubmit and not done.done():
+                done.set_result(t.orderStatus.status not in (OrderStatus.Inactive, OrderStatus.ApiCancelled))
+
+        def on_error(req_id, code, message, contract=None):
+            if req_id == order_id and code not in NOTICE_CODES and not done.done():
+                print(f"Stop order {order_id} rejected: {code} {message}")
+                done.set_result(False)
+
+        self.client.openOrderEvent += on_open_order
+        trade.statusEvent += on_status
+        self.client.errorEvent += on_error
+        try:
+            return await asyncio.wait_for(done, self.ack_timeout)
+        except asyncio.TimeoutError:
+            print(f"No acknowledgement for stop order {order_id} after {self.ack_timeout}s")
+            return None
+        finally:
+            self.client.openOrderEvent -= on_open_order
+            trade.statusEvent -= on_status
+            self.client.errorEvent -= on_error
+
+    def _on_open_order(self, trade):
+        stop = self._stops.get(trade.order.orderId)
+        if stop is None or stop.on_adjusted is None or stop.waiters \
+                or (stop.worker is not None and not stop.worker.done()):
+            return
+        order = trade.order
+        if order.orderType == "STP" and order.auxPrice == stop.target:
+            return
+        # Not our amend: TWS applied the adjustment
+        stop.target = order.auxPrice
+        stop.adjust = {}
+        result = stop.on_adjusted(order.orderId, trade)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def _release(self, stop, ok):
+        for waiter in stop.waiters:
+            if not waiter.done():
+                waiter.set_result(ok)
+        stop.waiters = []
+
+    def usage(self) -> dict:
+        return {"stops": len(self._stops), "amends": self.amends, "coalesced": self.coalesced,
+                "skipped": self.skipped, "rejected": self.rejected,
+                "unacknowledged": self.unacknowledged}
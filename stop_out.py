@@ -0,0 +1,78 @@
+import asyncio
+
+
+class StopOutDetector:
+    """
+    Fires a callback when a watched stop order is executed.\n
+    Listens to execution events for the stop's order id and, as a fallback, to
+    position events that flatten the stop's contract (e.g. a fill that happened
+    while we were not listening). Each watch fires at most once.\n
+    When several strategies share the account, the account-wide position says nothing
+    about one strategy's leg; ``holding(order_id, conId)`` then gives the quantity held by
+    whoever owns the stop (None if unknown, which never fires).\n
+    """
+
+    def __init__(self, client, holding=None):
+        self.client = client
+        self.holding = holding
+        # order_id -> (conId, callback)
+        self._watches = {}
+        self.client.execDetailsEvent += self._on_exec
+        self.client.positionEvent += self._on_position
+
+    def watch(self, order_id, contract, callback):
+        """
+        ``callback(order_id, source)`` may be a plain function or a coroutine function.\n
+        """
+        self._watches[order_id] = (contract.conId, callback)
+
+    def unwatch(self, order_id):
+        self._watches.pop(order_id, None)
+
+    def is_watching(self, order_id) -> bool:
+        return order_id in self._watches
+
+    def _on_exec(self, trade, fill):
+        order_id = fill.execution.orderId
+        if order_id not in self._watches:
+            return
+        if fill.execution.cumQty < trade.order.totalQuantity:
+            return
+        self._fire(order_id, fill)
+
+    def _on_position(self, position):
+        if self.holding is None and position.position != 0:
+            return
+        for order_id, (con_id, _) in list(self._watches.items()):
+            if con_id and con_id == position.contract.conId and self._flat(order_id, con_id, position.position):
+                self._fire(order_id, position)
+
+    def _flat(self, order_id, con_id, account_position) -> bool:
+        if self.holding is None:
+            return account_position == 0
+        return self.holding(order_id, con_id) == 0
+
+    def resync(self, open_order_ids, positions, fills):
+        """
+        Catches up after a reconnect: fires watches whose stop executed or whose
+        position went flat while we were away. Returns the watched ids that are
+        neither open nor executed (their stop is gone and the leg is unprotected).\n
+        """
+        executed = {f.execution.orderId: f for f in fills}
+        held = {p.contract.conId: p.position for p in positions if p.position != 0}
+        open_ids = set(open_order_ids)
+        missing = []
+        for order_id, (con_id, _) in list(self._watches.items()):
+            if order_id in executed:
+                self._fire(order_id, executed[order_id])
+            elif con_id and self._flat(order_id, con_id, held.get(con_id, 0)):
+                self._fire(order_id, "resync")
+            elif order_id not in open_ids:
+                missing.append(order_id)
+        return missing
+
+    def _fire(self, order_id, source):
+        _, callback = self._watches.pop(order_id)
+        result = callback(order_id, source)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
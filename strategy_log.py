@@ -0,0 +1,94 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+
+from pytz import timezone
+
+import credentials
+
+# Structured fields callers can attach to a record through ``extra``
+EVENT_FIELDS = ("leg", "event", "prices", "order_id")
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s: %(message)s'
+
+# Several strategies in one process share the handlers set up by the first call
+_configured = False
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line with the message and any structured event fields
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "ts": record.created,
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands the record to the listener thread untouched, so the message is only
+    formatted and serialized there instead of on the event loop
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _file_handler(path):
+    if credentials.log_rotate_bytes:
+        return logging.handlers.RotatingFileHandler(path, maxBytes=credentials.log_rotate_bytes,
+                                                    backupCount=credentials.log_backup_count)
+    if credentials.log_rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=credentials.log_rotate_when,
+                                                         backupCount=credentials.log_backup_count)
+    return logging.FileHandler(path, mode='w')
+
+
+def setup_logging():
+    global _configured
+    if _configured:
+        return logging.getLogger("strategy")
+    _configured = True
+    os.makedirs('logs', exist_ok=True)
+
+    eastern = timezone('US/Eastern')
+    current_date = datetime.now(eastern).strftime('%Y-%m-%d')
+
+    if credentials.log_format == "jsonl":
+        file_handler = _file_handler(f'logs/strategy_log_{current_date}.jsonl')
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler = _file_handler(f'logs/strategy_log_{current_date}.txt')
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler, stream_handler]
+
+    if credentials.log_async:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        handlers = [DeferredQueueHandler(log_queue)]
+
+    logging.basicConfig(
+        level=getattr(logging, credentials.log_level.upper()),
+        handlers=handlers
+    )
+    return logging.getLogger("strategy")
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+
+class StrikeIndex:
+    """
+    Sorted strike grid with O(log n) lookups.\n
+    ``nearest`` finds the listed strike closest to a price and ``step`` walks ``k``
+    listed strikes up or down the real grid, so no strike spacing is assumed.\n
+    """
+
+    def __init__(self, strikes):
+        self.strikes = np.unique(np.asarray(list(strikes), dtype=float))
+        if not len(self.strikes):
+            raise ValueError("StrikeIndex needs at least one strike")
+
+    def __len__(self):
+        return len(self.strikes)
+
+    def __iter__(self):
+        return iter(self.strikes.tolist())
+
+    def position(self, price) -> int:
+        """
+        Index of the listed strike closest to ``price`` (ties go to the lower strike)\n
+        """
+        i = int(np.searchsorted(self.strikes, price))
+        if i == 0:
+            return 0
+        if i == len(self.strikes):
+            return i - 1
+        return i - 1 if price - self.strikes[i - 1] <= self.strikes[i] - price else i
+
+    def nearest(self, price) -> float:
+        return float(self.strikes[self.position(price)])
+
+    def step(self, strike, k: int) -> float:
+        """
+        The strike ``k`` listed strikes above (k > 0) or below (k < 0) ``strike``\n
+        """
+        i = self.position(strike) + k
+        if i < 0 or i >= len(self.strikes):
+            print(f"Only {len(self.strikes)} strikes listed, {k} strikes from {strike} is off the grid")
+            i = min(max(i, 0), len(self.strikes) - 1)
+        return float(self.strikes[i])
+
+    @staticmethod
+    def cache_path(cache_dir, instrument, trading_class, date) -> str:
+        return os.path.join(cache_dir, f"strikes_{instrument}_{trading_class}_{date}.npy")
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.save(path, self.strikes)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the cached index, or None if there is no cache file for it\n
+        """
+        if not os.path.exists(path):
+            return None
+        return cls(np.load(path))
@@ -0,0 +1,314 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pytz import timezone
+
+import credentials
+from strike_index import StrikeIndex
+from tick_recorder import session_frame
+
+EASTERN = timezone('US/Eastern')
+
+# Settings a sweep can vary, with their current values from credentials as defaults
+PARAMS = {
+    "call_sl": credentials.call_sl,
+    "put_sl": credentials.put_sl,
+    "call_entry_price_changes_by": credentials.call_entry_price_changes_by,
+    "call_change_sl_by": credentials.call_change_sl_by,
+    "put_entry_price_changes_by": credentials.put_entry_price_changes_by,
+    "put_change_sl_by": credentials.put_change_sl_by,
+    "ATM_CALL": credentials.ATM_CALL,
+    "ATM_PUT": credentials.ATM_PUT,
+    "OTM_CALL_HEDGE": credentials.OTM_CALL_HEDGE,
+    "OTM_PUT_HEDGE": credentials.OTM_PUT_HEDGE,
+    "number_of_re_entry": credentials.number_of_re_entry,
+    "opposite_leg_move_to_cost": credentials.opposite_leg_move_to_cost,
+    "opposite_leg_move_to_cost_respect_trailing": credentials.opposite_leg_move_to_cost_respect_trailing,
+    "restrict_reentry_to_first_stopped_leg": credentials.restrict_reentry_to_first_stopped_leg,
+    "entry_time": credentials.entry_hour * 3600 + credentials.entry_minute * 60 + credentials.entry_second,
+    "exit_time": credentials.exit_hour * 3600 + credentials.exit_minute * 60 + credentials.exit_second,
+}
+
+# Settings that change which strikes or which part of the day is traded; combinations
+# sharing these are simulated together as one vectorized batch
+STRUCTURAL = ("ATM_CALL", "ATM_PUT", "OTM_CALL_HEDGE", "OTM_PUT_HEDGE", "entry_time", "exit_time")
+
+# Combinations simulated at once; bounds the (combinations x seconds) working arrays
+BATCH = 128
+
+
+def build_grid(spec: dict) -> pd.DataFrame:
+    """
+    One row per combination of the values in ``spec``; settings not in ``spec`` keep their credentials value
+    """
+    unknown = set(spec) - set(PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    values = {k: spec.get(k, [v]) for k, v in PARAMS.items()}
+    grid = pd.DataFrame(list(itertools.product(*values.values())), columns=list(values))
+    if (grid["entry_time"] >= grid["exit_time"]).any():
+        raise ValueError("Every entry_time must be before exit_time")
+    return grid
+
+
+def _day_start(directory) -> float:
+    name = os.path.basename(os.path.normpath(directory))
+    return EASTERN.localize(datetime.strptime(name, "%Y%m%d")).timestamp()
+
+
+def day_arrays(directory, t_lo: int, t_hi: int) -> dict:
+    """
+    A recorded day resampled to one-second bars between ``t_lo`` and ``t_hi`` (seconds after midnight ET).\n
+    The result is cached next to the strike cache, so each day is only resampled once per time window.\n
+    """
+    name = os.path.basename(os.path.normpath(directory))
+    path = os.path.join(credentials.cache_dir, "sweep", f"{name}_{t_lo}_{t_hi}.npz")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return dict(data)
+
+    frame = session_frame(directory)
+    grid = _day_start(directory) + np.arange(t_lo, t_hi + 1, dtype=float)
+    options = frame[frame["right"] != ""]
+    keys = sorted(set(zip(options["strike"], options["right"])))
+    ask = np.full((len(keys), len(grid)), np.nan)
+    bid = np.full((len(keys), len(grid)), np.nan)
+    for i, (strike, right) in enumerate(keys):
+        rows = options[(options["strike"] == strike) & (options["right"] == right)].sort_values("time", kind="stable")
+        idx = np.searchsorted(rows["time"].to_numpy(), grid, side="right") - 1
+        ok = idx >= 0
+        ask[i, ok] = rows["ask"].to_numpy()[idx[ok]]
+        bid[i, ok] = rows["bid"].to_numpy()[idx[ok]]
+    und_rows = frame[frame["right"] == ""].sort_values("time", kind="stable")
+    idx = np.searchsorted(und_rows["time"].to_numpy(), grid, side="right") - 1
+    underlying = np.where(idx >= 0, und_rows["last"].to_numpy()[np.maximum(idx, 0)], np.nan)
+
+    arrays = {
+        "underlying": underlying,
+        "strikes": np.array([k[0] for k in keys], dtype=float),
+        "rights": np.array([k[1] for k in keys]),
+        "ask": ask,
+        "bid": bid,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **arrays)
+    return arrays
+
+
+def _series(day, strike, right):
+    hit = np.nonzero((day["strikes"] == strike) & (day["rights"] == right))[0]
+    if not len(hit):
+        n = day["ask"].shape[1]
+        return np.full(n, np.nan), np.full(n, np.nan)
+    return day["ask"][hit[0]], day["bid"][hit[0]]
+
+
+def _leg(ask, start, end, fill, sl, chg, csl, cost_from):
+    """
+    Simulates one short leg per combination over one-second asks.\n
+    The stop starts at ``fill * (1 + sl%)`` and drops by ``csl%`` of the fill for every
+    further ``chg%`` the ask has fallen below the fill (the Strategy._check_trail ladder),
+    and is reset to the fill (rounded as Strategy._move_to_cost does) at ``cost_from``
+    (move-to-cost), from where later rungs keep tightening it. Like _check_trail, each
+    one-second check takes at most one rung, and only while the ask is still at or below
+    it. Returns the exit index (``end`` when not stopped), the exit price and the trailing
+    level reached so far.\n
+    """
+    t = np.arange(len(ask))
+    a = ask[None, :]
+    active = (t >= start[:, None]) & (t <= end[:, None])
+    step = fill * chg / 100
+    with np.errstate(invalid='ignore'):
+        reached = np.where(active, np.floor((fill[:, None] - a) / step[:, None]), 0)
+    # Rung-by-rung only at seconds where some combination could take one
+    steps = np.zeros(reached.shape, dtype=bool)
+    level = np.zeros(len(fill))
+    for i in np.nonzero((reached >= 1).any(axis=0))[0]:
+        steps[:, i] = reached[:, i] >= level + 1
+        level += steps[:, i]
+    levels = np.cumsum(steps, axis=1)
+    # The loop samples, tightens, then the broker holds the new stop from the next second on
+    prev = np.zeros_like(levels)
+    prev[:, 1:] = levels[:, :-1]
+    stop = (fill * (1 + sl / 100))[:, None] - prev * (fill * csl / 100)[:, None]
+    rows = np.arange(len(fill))
+    at_cost = prev[rows, np.minimum(cost_from, len(ask) - 1)]
+    cost_stop = np.round(fill, 1)[:, None] - (prev - at_cost[:, None]) * (fill * csl / 100)[:, None]
+    stop = np.where(t >= cost_from[:, None], cost_stop, stop)
+    hit = active & (a >= stop)
+    stopped = hit.any(axis=1)
+    idx = np.where(stopped, hit.argmax(axis=1), end)
+    price = np.where(stopped, np.maximum(stop[rows, idx], ask[idx]), ask[idx])
+    return idx, price, stopped, prev
+
+
+def _reenter(ask, bid, after, end, threshold):
+    """
+    First second after ``after`` where the ask is back at or below ``threshold``
+    """
+    t = np.arange(len(ask))
+    cond = (t >= after[:, None]) & (t < end[:, None]) & (ask[None, :] <= threshold[:, None])
+    found = cond.any(axis=1)
+    idx = np.where(found, cond.argmax(axis=1), end)
+    return idx, bid[idx], found
+
+
+def simulate_day(day, combos: pd.DataFrame, t_lo: int) -> np.ndarray:
+    """
+    P&L (dollars) of every combination on one day; NaN where the day's recording does not
+    cover the combination (no underlying at entry, or a strike or hedge never quoted)\n
+    """
+    pnl = np.full(len(combos), np.nan)
+    index = StrikeIndex(np.unique(day["strikes"])) if len(day["strikes"]) else None
+    if index is None:
+        return pnl
+
+    for key, group in combos.groupby(list(STRUCTURAL), sort=False):
+        s = dict(zip(STRUCTURAL, key))
+        e, x = int(s["entry_time"] - t_lo), int(s["exit_time"] - t_lo)
+        spot = day["underlying"][e]
+        if np.isnan(spot):
+            continue
+        atm = index.nearest(int(spot))
+        call_ask, call_bid = _series(day, index.step(atm, s["ATM_CALL"]) if s["ATM_CALL"] > 0 else atm, "C")
+        put_ask, put_bid = _series(day, index.step(atm, -s["ATM_PUT"]) if s["ATM_PUT"] > 0 else atm, "P")
+
+        hedge = 0.0
+        if credentials.active_close_hedges:
+            ch_ask, ch_bid = _series(day, index.step(atm, s["OTM_CALL_HEDGE"]), "C")
+            ph_ask, ph_bid = _series(day, index.step(atm, -s["OTM_PUT_HEDGE"]), "P")
+            hedge = ((ch_bid[x] - ch_ask[e]) * credentials.call_hedge_quantity
+                     + (ph_bid[x] - ph_ask[e]) * credentials.put_hedge_quantity) * 100
+
+        for lo in range(0, len(group), BATCH):
+            batch = group.iloc[lo:lo + BATCH]
+            pnl[combos.index.get_indexer(batch.index)] = _simulate_batch(
+                batch, e, x, call_ask, call_bid, put_ask, put_bid) + hedge
+    return pnl
+
+
+def _simulate_batch(batch, e, x, call_ask, call_bid, put_ask, put_bid):
+    n = len(batch)
+    p = {k: batch[k].to_numpy() for k in batch.columns}
+    start, end, never = np.full(n, e), np.full(n, x), np.full(n, len(call_ask))
+    legs = {
+        "call": dict(ask=call_ask, bid=call_bid, sl=p["call_sl"], chg=p["call_entry_price_changes_by"],
+                     csl=p["call_change_sl_by"], qty=credentials.call_position,
+                     delay=credentials.call_reentry_time),
+        "put": dict(ask=put_ask, bid=put_bid, sl=p["put_sl"], chg=p["put_entry_price_changes_by"],
+                    csl=p["put_change_sl_by"], qty=credentials.put_position,
+                    delay=credentials.put_reentry_time),
+    }
+    total = np.zeros(n)
+    state = {}
+    for name, leg in legs.items():
+        fill = np.full(n, leg["bid"][e])
+        idx, price, stopped, levels = _leg(leg["ask"], start, end, fill, leg["sl"], leg["chg"], leg["csl"], never)
+        state[name] = dict(fill=fill, idx=idx, price=price, stopped=stopped, levels=levels)
+
+    # Move-to-cost: the first stop-out moves the still-open opposite leg's stop to its fill
+    c, q = state["call"], state["put"]
+    call_first = c["stopped"] & (~q["stopped"] | (c["idx"] <= q["idx"]))
+    put_first = q["stopped"] & ~call_first
+    rows = np.arange(n)
+    for first, other_name, first_state in ((call_first, "put", c), (put_first, "call", q)):
+        other, leg = state[other_name], legs[other_name]
+        trailed = other["levels"][rows, first_state["idx"]] > 0
+        move = (first & p["opposite_leg_move_to_cost"].astype(bool) & (other["idx"] > first_state["idx"])
+                & (~p["opposite_leg_move_to_cost_respect_trailing"].astype(bool) | ~trailed))
+        if move.any():
+            cost_from = np.where(move, first_state["idx"] + 1, never)
+            idx, price, stopped, _ = _leg(leg["ask"], start, end, other["fill"], leg["sl"], leg["chg"], leg["csl"],
+                                          cost_from)
+            other.update(idx=np.where(move, idx, other["idx"]), price=np.where(move, price, other["price"]),
+                         stopped=np.where(move, stopped, other["stopped"]))
+
+    for name, leg in legs.items():
+        st = state[name]
+        total += (st["fill"] - st["price"]) * leg["qty"] * 100
+
+    # Re-entries, limited to the first stopped leg when that rule is on
+    restrict = p["restrict_reentry_to_first_stopped_leg"].astype(bool)
+    allowed = {"call": ~restrict | call_first, "put": ~restrict | put_first}
+    for r in range(int(p["number_of_re_entry"].max(initial=0))):
+        for name, leg in legs.items():
+            st = state[name]
+            eligible = allowed[name] & st["stopped"] & (r < p["number_of_re_entry"])
+            if not eligible.any():
+                continue
+            ridx, new_fill, found = _reenter(leg["ask"], leg["bid"], st["idx"] + leg["delay"], end, st["fill"])
+            go = eligible & found
+            idx, price, stopped, _ = _leg(leg["ask"], ridx, end, new_fill, leg["sl"], leg["chg"], leg["csl"], never)
+            total += np.where(go, (new_fill - price) * leg["qty"] * 100, 0)
+            st.update(fill=np.where(go, new_fill, st["fill"]), idx=np.where(go, idx, st["idx"]),
+                      stopped=go & stopped)
+    return total
+
+
+def _run_days(args):
+    directories, combos, t_lo, t_hi = args
+    return [simulate_day(day_arrays(d, t_lo, t_hi), combos, t_lo) for d in directories]
+
+
+def run_sweep(spec: dict, directories, workers: int = None) -> pd.DataFrame:
+    """
+    Evaluates every combination of ``spec`` over the recorded days and returns them ranked by total P&L
+    """
+    combos = build_grid(spec)
+    t_lo, t_hi = int(combos["entry_time"].min()), int(combos["exit_time"].max())
+    directories = sorted(directories)
+    workers = workers or os.cpu_count() or 1
+    chunks = [directories[i::workers] for i in range(workers) if directories[i::workers]]
+
+    with ProcessPoolExecutor(max_workers=len(chunks) or 1) as pool:
+        results = list(pool.map(_run_days, [(chunk, combos, t_lo, t_hi) for chunk in chunks]))
+    order = [d for chunk in chunks for d in chunk]
+    daily = np.array([row for chunk in results for row in chunk])[np.argsort(np.array(order))]
+
+    # Days a combination could not be simulated on count towards neither its P&L nor its ranking
+    covered = np.isfinite(daily)
+    days = covered.sum(axis=0)
+    equity = np.cumsum(np.where(covered, daily, 0.0), axis=0)
+    drawdown = (np.maximum.accumulate(np.maximum(equity, 0), axis=0) - equity).max(axis=0)
+    table = combos.copy()
+    table["days"] = days
+    table["coverage"] = days / len(directories)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table["total_pnl"] = np.nansum(daily, axis=0)
+        table["mean_daily"] = table["total_pnl"] / days
+        table["std_daily"] = np.sqrt(np.nansum((daily - table["mean_daily"].to_numpy()) ** 2, axis=0) / days)
+        table["win_rate"] = (daily > 0).sum(axis=0) / days
+    table["max_drawdown"] = drawdown
+    # Fully covered combinations rank first; a partly covered total is not comparable
+    return table.sort_values(["coverage", "total_pnl", "max_drawdown"],
+                             ascending=[False, False, True]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep strategy settings over recorded sessions")
+    parser.add_argument("spec", help='JSON file mapping setting names to lists, e.g. {"call_sl": [50, 70, 90]}')
+    parser.add_argument("days", nargs="+", help="Recorded session directories (ticks/<YYYYMMDD>)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", help="Write the ranked table to this CSV")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    began = time.perf_counter()
+    ranked = run_sweep(spec, args.days, workers=args.workers)
+    print(ranked.head(args.top).to_string())
+    print(f"{len(ranked)} combinations x {len(args.days)} days in {time.perf_counter() - began:.1f}s")
+    partial = ranked["coverage"] < 1
+    if partial.any():
+        print(f"{partial.sum()} combinations lack recorded quotes on some days and rank below the rest "
+              f"({(ranked['days'] == 0).sum()} on every day)")
+    if args.out:
+        ranked.to_csv(args.out, index=False)
@@ -0,0 +1,47 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from pytz import timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import credentials  # noqa: E402
+
+EASTERN = timezone('US/Eastern')
+
+
+def synthetic_frame(day, start="09:30", end="10:00", step=5.0, spot=5850.0, seed=0):
+    """
+    A recorded-tape frame: a random-walk index and a 5-point grid of calls and puts priced off it
+    """
+    rng = np.random.default_rng(seed)
+    t0 = EASTERN.localize(datetime.strptime(f"{day} {start}", "%Y%m%d %H:%M")).timestamp()
+    t1 = EASTERN.localize(datetime.strptime(f"{day} {end}", "%Y%m%d %H:%M")).timestamp()
+    times = np.arange(t0, t1 + step, step)
+    index = spot + np.cumsum(rng.normal(0, 1.5, len(times)))
+    frames = [pd.DataFrame({"time": times, "strike": 0.0, "right": "", "bid": index - 0.1, "ask": index + 0.1,
+                            "last": index})]
+    decay = np.linspace(1.0, 0.5, len(times))
+    for strike in np.arange(spot - 100, spot + 105, 5.0):
+        for right in "CP":
+            intrinsic = np.maximum(index - strike, 0) if right == "C" else np.maximum(strike - index, 0)
+            mid = np.round(intrinsic + 12 * decay * np.exp(-((index - strike) / 40) ** 2) + 0.1, 2)
+            frames.append(pd.DataFrame({"time": times, "strike": strike, "right": right,
+                                        "bid": np.maximum(mid - 0.05, 0.05), "ask": mid + 0.05, "last": mid}))
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def short_session(monkeypatch):
+    """
+    Credentials for a quiet 20-minute session on credentials.date: enter 09:35, exit 09:55
+    """
+    for name, value in {"entry_hour": 9, "entry_minute": 35, "entry_second": 0, "exit_hour": 9,
+                        "exit_minute": 55, "exit_second": 0, "enable_logging": False, "enable_journal": False,
+                        "record_ticks": False, "enable_metrics": False}.items():
+        monkeypatch.setattr(credentials, name, value)
+    return credentials.date
@@ -0,0 +1,25 @@
+import asyncio
+
+from replay import TickTape, VirtualEventLoop, run_replay
+from conftest import synthetic_frame
+
+
+def test_virtual_loop_sleeps_at_epoch_start():
+    loop = VirtualEventLoop(1774272840.0)
+    try:
+        loop.run_until_complete(asyncio.sleep(10))
+        assert loop.time() == 10.0
+        assert loop.epoch() == 1774272850.0
+    finally:
+        loop.close()
+
+
+def test_replay_runs_a_session_to_completion(short_session):
+    tape = TickTape(synthetic_frame(short_session))
+    result = run_replay(tape)
+    entries = result.ledger[result.ledger["action"] == "SELL"]
+    exits = result.ledger[result.ledger["action"] == "BUY"]
+    assert len(entries) >= 2
+    # Every short leg is bought back by the end of the session
+    assert exits["qty"].sum() == entries["qty"].sum()
+    assert result.wall_seconds < 30
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import credentials
+from conftest import EASTERN
+from replay import TickTape, run_replay
+from sweep import _leg
+
+
+def _move_to_cost_tape(day):
+    """
+    One-second tape where the put stops out at 09:36, moving the call stop to cost while the call
+    trades just below it; the call then falls two 20% rungs below its fill and comes back up
+    through the stop tightened from cost
+    """
+    t0 = EASTERN.localize(datetime.strptime(f"{day} 09:30", "%Y%m%d %H:%M")).timestamp()
+    times = t0 + np.arange(0, 26 * 60 + 1, 1.0)
+    clock = (times - t0) / 60  # Minutes after 09:30
+    mids = {
+        ("P", 5840.0): np.where(clock < 6, 5.02, 10.0),
+        ("C", 5860.0): np.select([clock < 5.5, clock < 7, clock < 8], [5.02, 4.5, 2.73], 3.5),
+    }
+    frames = [pd.DataFrame({"time": times, "strike": 0.0, "right": "", "bid": 5849.9, "ask": 5850.1,
+                            "last": 5850.0})]
+    for strike in np.arange(5750.0, 5955.0, 5.0):
+        for right in "CP":
+            mid = mids.get((right, strike), np.full(len(times), 1.0))
+            frames.append(pd.DataFrame({"time": times, "strike": strike, "right": right, "bid": mid - 0.05,
+                                        "ask": mid + 0.05, "last": mid}))
+    return t0, times, pd.concat(frames, ignore_index=True)
+
+
+def test_leg_trails_from_cost_like_replayed_strategy(short_session, monkeypatch):
+    for name, value in {"opposite_leg_move_to_cost": True, "opposite_leg_move_to_cost_respect_trailing": True,
+                        "number_of_re_entry": 0, "call_entry_price_changes_by": 20, "call_change_sl_by": 20,
+                        "call_sl": 70, "call_check_time": 1}.items():
+        monkeypatch.setattr(credentials, name, value)
+    t0, times, frame = _move_to_cost_tape(short_session)
+    ledger = run_replay(TickTape(frame)).ledger
+    ledger["second"] = ledger["time"].map(lambda t: int(t.timestamp() - t0))
+    call = ledger[ledger["right"] == "C"]
+    put_stop = ledger[(ledger["right"] == "P") & (ledger["kind"] == "stop")]
+    call_stop = call[call["kind"] == "stop"]
+    assert len(put_stop) == 1 and len(call_stop) == 1
+
+    entry = call[call["action"] == "SELL"].iloc[0]
+    asks = frame[(frame["right"] == "C") & (frame["strike"] == 5860.0)]["ask"].to_numpy()
+    idx, price, stopped, _ = _leg(asks, np.array([entry["second"]]), np.array([len(times) - 1]),
+                                  np.array([entry["price"]]), np.array([70.0]), np.array([20.0]),
+                                  np.array([20.0]), np.array([put_stop["second"].iloc[0] + 1]))
+    assert stopped[0]
+    assert idx[0] == call_stop["second"].iloc[0]
+    assert np.isclose(price[0], call_stop["price"].iloc[0])
@@ -0,0 +1,134 @@
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Column name -> dtype of every recorded chunk
+COLUMNS = {
+    "time": np.float64,
+    "con_id": np.int64,
+    "strike": np.float64,
+    "right": np.int8,  # 0 = underlying, 1 = call, 2 = put
+    "bid": np.float64,
+    "ask": np.float64,
+    "last": np.float64,
+    "volume": np.float64,
+}
+RIGHT_CODES = {"": 0, "C": 1, "P": 2}
+RIGHT_NAMES = {v: k for k, v in RIGHT_CODES.items()}
+
+
+class TickRecorder:
+    """
+    Records every quote update of the tracked contracts to compressed columnar chunks.\n
+    The event loop only appends a tuple per updated ticker to a deque; a background
+    thread drains it every ``flush_every`` seconds into ``chunk_<n>.npz`` under
+    ``directory``. ``load_session`` later consolidates the chunks into plain .npy
+    columns that can be memory-mapped.\n
+    """
+
+    def __init__(self, client, directory: str, flush_every: float = 5.0):
+        self.client = client
+        self.directory = directory
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._tracked = {}
+        self._rows = deque()
+        self._chunk = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, contract):
+        code = RIGHT_CODES.get(getattr(contract, "right", "") or "", 0)
+        self._tracked[contract.conId] = (float(getattr(contract, "strike", 0.0) or 0.0), code)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._chunk = len(glob.glob(os.path.join(self.directory, "chunk_*.npz")))
+        self.client.pendingTickersEvent += self._on_tickers
+        self._thread = threading.Thread(target=self._run, name="tick-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.client.pendingTickersEvent -= self._on_tickers
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _on_tickers(self, tickers):
+        now = time.time()
+        for t in tickers:
+            meta = self._tracked.get(t.contract.conId)
+            if meta is None:
+                continue
+            self._rows.append((
+                t.time.timestamp() if t.time else now,
+                t.contract.conId, meta[0], meta[1], t.bid, t.ask, t.last, t.volume
+            ))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_every):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        n = len(self._rows)
+        if not n:
+            return
+        rows = [self._rows.popleft() for _ in range(n)]
+        cols = list(zip(*rows))
+        arrays = {name: np.asarray(cols[i], dtype=dtype) for i, (name, dtype) in enumerate(COLUMNS.items())}
+        path = os.path.join(self.directory, f"chunk_{self._chunk:06d}.npz")
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, path)
+        self._chunk += 1
+        self.recorded += n
+
+
+def load_session(directory: str, mmap: bool = True) -> dict:
+    """
+    Returns {column: array} for a recorded session.\n
+    The first call writes the chunks out as ``columns/<name>.npy``; later calls
+    (and every call with ``mmap``) open those memory-mapped instead of decompressing.\n
+    """
+    col_dir = os.path.join(directory, "columns")
+    chunks = sorted(glob.glob(os.path.join(directory, "chunk_*.npz")))
+    stamp = os.path.join(col_dir, "chunks.txt")
+    current = os.path.exists(stamp) and open(stamp).read() == str(len(chunks))
+    if not current:
+        os.makedirs(col_dir, exist_ok=True)
+        parts = {name: [] for name in COLUMNS}
+        for path in chunks:
+            with np.load(path) as data:
+                for name in COLUMNS:
+                    parts[name].append(data[name])
+        for name, dtype in COLUMNS.items():
+            merged = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+            np.save(os.path.join(col_dir, f"{name}.npy"), merged)
+        with open(stamp, "w") as f:
+            f.write(str(len(chunks)))
+    return {name: np.load(os.path.join(col_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in COLUMNS}
+
+
+def session_frame(directory: str) -> pd.DataFrame:
+    """
+    Recorded session as a frame with time, strike, right, bid, ask, last (what replay.TickTape reads)
+    """
+    cols = load_session(directory)
+    return pd.DataFrame({
+        "time": cols["time"],
+        "strike": cols["strike"],
+        "right": pd.Series(cols["right"]).map(RIGHT_NAMES).to_numpy(),
+        "bid": cols["bid"],
+        "ask": cols["ask"],
+        "last": cols["last"],
+        "volume": cols["volume"],
+    })